@@ -1159,6 +1159,7 @@ class Analysis(object):
         genome_assembly=None,
         output_dir=None,
         overwrite=False,
+        fasta=True,
     ):
         """
         Get genome-centric resources used by several ``ngs_toolkit`` analysis
@@ -1174,6 +1175,9 @@ class Analysis(object):
                  * "tss": Locations of gene"s TSSs
                  * "genomic_context": Genomic context of genome
                  * "chromosome_sizes": Sizes of chromosomes
+                 * "reference_store": Binary store of the blacklist, TSSs,
+                   genomic context and chromosome sizes
+                   (see :func:`ngs_toolkit.analysis.Analysis.get_reference_store`)
 
             Defaults to ["blacklist", "tss", "genomic_context"].
         organism : :obj:`str`, optional
@@ -1196,6 +1200,14 @@ class Analysis(object):
             Otherwise they will be kept and no action is made.
 
             Defaults to :obj:`False`.
+        fasta: :obj:`bool`, optional
+            Whether the "genome" step should also get the genome sequence
+            in FASTA format, converting the 2bit file or downloading it.
+            Not needed to read sequences with :class:`ngs_toolkit.utils.GenomeSequence`,
+            which reads 2bit files directly. If :obj:`False`, the FASTA file is
+            only returned if it already exists.
+
+            Defaults to :obj:`True`.
 
         Returns
         -------
@@ -1204,7 +1216,8 @@ class Analysis(object):
             to the requested files.
 
             The values of the 'genome' step are also a dictionary with keys
-            "2bit" and "fasta" for each file type respectively.
+            "2bit" and "fasta" for each file type respectively,
+            without "fasta" if ``fasta`` is :obj:`False` and the file does not exist.
         """
         from ngs_toolkit.general import (
             get_genome_reference,
@@ -1220,11 +1233,7 @@ class Analysis(object):
         if genome_assembly is None:
             genome_assembly = self.genome
         if output_dir is None:
-            output_dir = self._format_string_with_environment_variables(
-                _CONFIG["preferences"]["root_reference_dir"]
-            )
-            if output_dir is None:
-                output_dir = os.path.join(self.root_dir, "reference")
+            output_dir = self._get_reference_dir()
 
         kwargs = {
             "organism": organism,
@@ -1237,12 +1246,14 @@ class Analysis(object):
 
         if "genome" in steps:
             output["genome_file"] = dict()
-            output["genome_file"]["2bit"] = get_genome_reference(file_format="2bit", **kwargs)
-            fasta = output["genome_file"]["2bit"].replace(".2bit", ".fa")
-            if os.path.exists(fasta):
-                output["genome_file"]["fasta"] = fasta
-            else:
-                output["genome_file"]["fasta"] = get_genome_reference(file_format="fasta", **kwargs)
+            output["genome_file"]["2bit"] = get_genome_reference(
+                file_format="2bit", convert=fasta, **kwargs)
+            fasta_file = output["genome_file"]["2bit"].replace(".2bit", ".fa")
+            if os.path.exists(fasta_file):
+                output["genome_file"]["fasta"] = fasta_file
+            elif fasta:
+                output["genome_file"]["fasta"] = get_genome_reference(
+                    file_format="fasta", **kwargs)
         if "blacklist" in steps:
             output["blacklist_file"] = get_blacklist_annotations(**kwargs)
         if "tss" in steps:
@@ -1263,8 +1274,108 @@ class Analysis(object):
 
         if "chromosome_sizes" in steps:
             output["chromosome_sizes_file"] = get_chromosome_sizes(**kwargs)
+        if "reference_store" in steps:
+            output["reference_store_file"] = self.get_reference_store(**kwargs).store_file
         return output
 
+    def _get_reference_dir(self):
+        """
+        Get the directory of reference files from the configuration or
+        a directory called "reference" in the analysis root directory.
+        """
+        output_dir = self._format_string_with_environment_variables(
+            _CONFIG["preferences"]["root_reference_dir"]
+        )
+        if output_dir is None:
+            output_dir = os.path.join(self.root_dir, "reference")
+        return output_dir
+
+    @check_has_attributes(["organism", "genome"])
+    def get_reference_store(
+        self, organism=None, genome_assembly=None, output_dir=None, overwrite=False
+    ):
+        """
+        Get a store with the blacklist, TSSs, genomic context and chromosome sizes
+        of a genome assembly as sorted interval arrays, which loads in a fraction of
+        the time of parsing the annotation files (see :class:`ngs_toolkit.utils.ReferenceStore`).
+
+        The store is built once from the files of
+        :func:`ngs_toolkit.analysis.Analysis.get_resources` into a single file
+        in ``output_dir`` and shared by all analyses of the process.
+
+        Parameters
+        ----------
+        organism : :obj:`str`, optional
+            Organism to get for. Currently supported are "human" and "mouse".
+
+            Defaults to analysis' own organism.
+        genome_assembly : :obj:`str`, optional
+            Genome assembly to get resources for.
+            Currently supported are "hg19", "hg38" and "mm10".
+
+            Defaults to the genome assembly of the analysis.
+        output_dir : :obj:`str`, optional
+            Directory to save the store to.
+
+            Defaults to the same directory as
+            :func:`ngs_toolkit.analysis.Analysis.get_resources`.
+        overwrite: :obj:`bool`, optional
+            Whether to build the store (and get its annotation files) again
+            even if it exists.
+
+            Defaults to :obj:`False`.
+
+        Returns
+        -------
+        :class:`ngs_toolkit.utils.ReferenceStore`
+            Store with layers "blacklist", "tss" (with columns "gene_name" and "strand")
+            and "genomic_context" (with column "name").
+        """
+        from ngs_toolkit.utils import ReferenceStore, read_bed_coordinates
+
+        if organism is None:
+            organism = self.organism
+        if genome_assembly is None:
+            genome_assembly = self.genome
+        if output_dir is None:
+            output_dir = self._get_reference_dir()
+
+        store_file = os.path.join(
+            output_dir, "{}.{}.reference_store.npz".format(organism, genome_assembly)
+        )
+        if overwrite or (not os.path.exists(store_file)):
+            _LOGGER.info("Building reference store '{}'.".format(store_file))
+            resources = self.get_resources(
+                steps=["blacklist", "tss", "genomic_context", "chromosome_sizes"],
+                organism=organism,
+                genome_assembly=genome_assembly,
+                output_dir=output_dir,
+                overwrite=overwrite,
+            )
+            tss = pd.read_csv(
+                resources["tss_file"],
+                sep="\t",
+                header=None,
+                usecols=[0, 1, 2, 3, 5],
+                names=["chrom", "start", "end", "gene_name", "strand"],
+                comment="#",
+            )
+            chrom_sizes = pd.read_csv(
+                resources["chromosome_sizes_file"], sep="\t", header=None, index_col=0
+            )[1]
+            ReferenceStore.write(
+                store_file,
+                {
+                    "blacklist": read_bed_coordinates(resources["blacklist_file"]),
+                    "tss": tss,
+                    "genomic_context": read_bed_coordinates(
+                        resources["genomic_context_file"], name=True
+                    ),
+                },
+                chrom_sizes=chrom_sizes.to_dict(),
+            )
+        return ReferenceStore.load(store_file)
+
     def normalize_rpm(
         self,
         matrix="matrix_raw",
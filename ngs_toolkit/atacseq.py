@@ -275,14 +275,17 @@ class ATACSeqAnalysis(Analysis):
         permissive=False,
         save=True,
         assign=True,
+        engine="bedtools",
         **kwargs,
     ):
         """
         Get consensus (union) of enriched sites (peaks) across samples.
-        There are two modes possible, defined by the value of ``region_type``:
+        There are three modes possible, defined by the value of ``region_type``:
 
          * peaks: simple union of all sites;
-         * summits: peak summits are extended by ``extension`` and a union is made.
+         * summits: peak summits are extended by ``extension`` and a union is made;
+         * fixed_width: peak summits are extended by ``extension`` and
+           non-overlapping sites are kept greedily by descending summit score.
 
         Parameters
         ----------
@@ -293,11 +296,17 @@ class ATACSeqAnalysis(Analysis):
             Defaults to all samples in the analysis (``samples`` attribute).
         region_type : :obj:`str`
             The type of region to use to create the consensus region set
-            - one of "summits" or "peaks".
+            - one of "summits", "peaks" or "fixed_width".
             If "summits", peak summits will be extended by ``extension``
             before union.
             If "peaks", sample peaks will be used with no modification prior to
             union.
+            If "fixed_width", peak summits of all samples will be extended by ``extension``,
+            dropping those reaching past chromosome ends, and selected by their score
+            (fifth column of the summits file) so that no two sites overlap.
+            Unlike the union, sites do not grow wider with more samples,
+            all having a width of ``2 * extension + 1``.
+            Always uses the "numpy" ``engine``.
 
             Default is "summits".
         extension : :obj:`int`
@@ -308,7 +317,9 @@ class ATACSeqAnalysis(Analysis):
             Either :obj:`False` or a path to a BED file with genomic positions
             to exclude from consensus peak set.
 
-            Default is to use a blacklist file for the analysis ``genome``.
+            Default is to use a blacklist file for the analysis ``genome``,
+            read from the reference store with the "numpy" ``engine``
+            (see :func:`ngs_toolkit.analysis.Analysis.get_reference_store`).
         filter_chroms : {:obj:`list`, :obj:`str`}
             A list of chromosomes to filter out or
             a string with a pattern to match to exclude chromosomes.
@@ -322,6 +333,14 @@ class ATACSeqAnalysis(Analysis):
             should be simply skipped or an error thrown.
 
             Default is :obj:`True`.
+        engine : :obj:`str`
+            Engine used to make the union of sites. One of "bedtools"
+            (concatenates files of all samples and runs bedtools sort, merge and intersect)
+            or "numpy" (reads files with vectorized parsing and does all operations
+            in memory on sorted arrays, much faster for many samples).
+            Both produce the same sites.
+
+            Default is "bedtools".
         **kwargs
             Not used. Provided for compatibility with :class:`ngs_toolkit.ChIPSeqAnalysis` class.
 
@@ -331,6 +350,7 @@ class ATACSeqAnalysis(Analysis):
             If not ``permissive`` and either the ``peaks`` or ``summits`` file
             of a sample is not readable, or if ``permissive``
             but none of the samples has an existing file.
+            Or if ``engine`` is not one of the available options.
         :obj:`AttributeError`
             If analysis does not have ``organism`` and ``genome`` attributes.
 
@@ -348,8 +368,12 @@ class ATACSeqAnalysis(Analysis):
         import pybedtools
         import tempfile
 
-        if region_type not in ["summits", "peaks"]:
-            msg = "`region_type` attribute must be one of 'summits' or 'peaks'!"
+        if region_type not in ["summits", "peaks", "fixed_width"]:
+            msg = "`region_type` attribute must be one of 'summits', 'peaks' or 'fixed_width'!"
+            _LOGGER.error(msg)
+            raise ValueError(msg)
+        if engine not in ["bedtools", "numpy"]:
+            msg = "`engine` must be one of 'bedtools' or 'numpy'."
             _LOGGER.error(msg)
             raise ValueError(msg)
 
@@ -358,72 +382,380 @@ class ATACSeqAnalysis(Analysis):
 
         # Check which samples to run (dependent on permissive)
         samples = self._get_samples_with_input_file(
-            region_type, permissive=permissive, samples=samples
+            "summits" if region_type == "fixed_width" else region_type,
+            permissive=permissive,
+            samples=samples,
         )
 
+        if region_type == "fixed_width":
+            engine = "numpy"
+        blacklist_bed = self._get_blacklist_bed(blacklist_bed, engine=engine)
+
+        if engine == "numpy":
+            sites = self._get_consensus_sites_numpy(
+                samples, region_type, extension, blacklist_bed, filter_chroms, permissive
+            )
+        else:
+            f = tempfile.NamedTemporaryFile()
+            with open(f.name, "a") as handle:
+                for sample in tqdm(samples, total=len(samples), desc="Sample"):
+                    try:
+                        file = (
+                            pybedtools.BedTool(sample.summits)
+                            .slop(b=extension, genome=sample.genome)
+                            .fn
+                            if region_type == "summits"
+                            else sample.peaks
+                        )
+                    except (ValueError, FileNotFoundError):
+                        if not permissive:
+                            raise
+                        else:
+                            _LOGGER.warning(
+                                "Peaks for sample {} ({}) not found!".format(sample, sample.peaks)
+                            )
+                            continue
+                    for line in open(file, "r"):
+                        handle.write(line)
+
+            # NCBI genome FASTA files are sorted naturally while Ensembl are not
+            # depending on that you might want to sort the resulting BED file
+            # accordingly with the following:
+            #     sites = sort_bed(f.name).merge()
+            sites = pybedtools.BedTool(f.name).sort().merge()
+
+            # Filter
+            # # remove blacklist regions
+            if blacklist_bed is not False:
+                if not isinstance(blacklist_bed, pybedtools.BedTool):
+                    blacklist = pybedtools.BedTool(blacklist_bed)
+                sites = sites.intersect(v=True, b=blacklist)
+
+            # # filter requested chromosomes
+            if filter_chroms is not None:
+                if isinstance(filter_chroms, list):
+                    sites = sites.filter(lambda x: x.chrom not in filter_chroms).saveas()
+                elif isinstance(filter_chroms, str):
+                    s = sites.to_dataframe()
+                    sites = pybedtools.BedTool.from_dataframe(
+                        s.loc[~s["chrom"].str.match(filter_chroms)]
+                    )
+
+        # Save and assign
+        if save:
+            output_file = os.path.join(self.results_dir, self.name + ".peak_set.bed")
+            sites.saveas(output_file)
+            self.record_output_file(output_file, "consensus_sites")
+            sites = pybedtools.BedTool(output_file)
+        if assign:
+            self.sites = sites
+        return sites
+
+    def _get_blacklist_bed(self, blacklist_bed=None, engine="bedtools"):
+        """
+        Get the blacklist file of the analysis' genome if ``blacklist_bed`` is :obj:`None`,
+        or its intervals from the reference store with the "numpy" ``engine``.
+        """
         if blacklist_bed is not False and blacklist_bed is None:
             _LOGGER.info("Blacklist file not provided. Downloading...")
             try:
-                blacklist_bed = self.get_resources(steps=["blacklist"])["blacklist_file"]
+                if engine == "numpy":
+                    blacklist_bed = self.get_reference_store().get_intervals("blacklist")
+                else:
+                    blacklist_bed = self.get_resources(steps=["blacklist"])["blacklist_file"]
             except AttributeError:
                 msg = "Blacklist file was not provided and cannot be"
                 msg += " get one without `organism` and `genome` set."
                 _LOGGER.error(msg)
                 raise AttributeError(msg)
+        return blacklist_bed
 
-        f = tempfile.NamedTemporaryFile()
-        with open(f.name, "a") as handle:
-            for sample in tqdm(samples, total=len(samples), desc="Sample"):
-                try:
-                    file = (
-                        pybedtools.BedTool(sample.summits)
-                        .slop(b=extension, genome=sample.genome)
-                        .fn
-                        if region_type == "summits"
-                        else sample.peaks
-                    )
-                except (ValueError, FileNotFoundError):
-                    if not permissive:
-                        raise
-                    else:
-                        _LOGGER.warning(
-                            "Peaks for sample {} ({}) not found!".format(sample, sample.peaks)
+    def _get_consensus_sites_numpy(
+        self, samples, region_type, extension, blacklist_bed, filter_chroms, permissive
+    ):
+        """
+        Get consensus sites of samples in memory with NumPy.
+        See :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.get_consensus_sites`.
+        """
+        import pybedtools
+        from ngs_toolkit.utils import merge_intervals, select_intervals_by_score
+
+        beds = self._read_sample_sites(samples, region_type, extension, permissive)
+        if region_type == "fixed_width":
+            # filter candidates first so that sites next to excluded ones can be kept
+            sites = self._filter_sites(
+                pd.concat(beds, ignore_index=True), blacklist_bed, filter_chroms)
+            sites = select_intervals_by_score(sites)[["chrom", "start", "end"]]
+        else:
+            sites = merge_intervals(pd.concat(beds, ignore_index=True))
+            sites = self._filter_sites(sites, blacklist_bed, filter_chroms)
+        return pybedtools.BedTool.from_dataframe(sites)
+
+    def _read_sample_sites(self, samples, region_type, extension, permissive):
+        """
+        Read the peaks or summits (extended by ``extension``) of each sample
+        into dataframes with columns "chrom", "start" and "end".
+        With ``region_type`` "fixed_width", summits are read with their score and
+        those not fully extended within the chromosome are dropped.
+        """
+        from tqdm import tqdm
+        import pybedtools
+        from ngs_toolkit.utils import extend_intervals, read_bed_coordinates
+
+        chrom_sizes = dict()
+        beds = list()
+        fixed_width = region_type == "fixed_width"
+        attribute = "summits" if fixed_width else region_type
+        for sample in tqdm(samples, total=len(samples), desc="Sample"):
+            try:
+                bed = read_bed_coordinates(getattr(sample, attribute), score=fixed_width)
+                if region_type != "peaks":
+                    if sample.genome not in chrom_sizes:
+                        chrom_sizes[sample.genome] = {
+                            chrom: end for chrom, (_, end) in pybedtools.chromsizes(
+                                sample.genome).items()}
+                    extended = extend_intervals(bed, extension, chrom_sizes[sample.genome])
+                    if fixed_width:
+                        full = (
+                            (extended["end"] - extended["start"]).values
+                            == (bed["end"] - bed["start"]).values + 2 * extension
                         )
-                        continue
-                for line in open(file, "r"):
-                    handle.write(line)
+                        extended = extended.loc[full].assign(score=bed["score"].values[full])
+                    bed = extended
+            except (ValueError, FileNotFoundError):
+                if not permissive:
+                    raise
+                else:
+                    _LOGGER.warning(
+                        "{} for sample {} ({}) not found!".format(
+                            attribute.capitalize(), sample, getattr(sample, attribute))
+                    )
+                    continue
+            beds.append(bed)
+        return beds
 
-        # NCBI genome FASTA files are sorted naturally while Ensembl are not
-        # depending on that you might want to sort the resulting BED file
-        # accordingly with the following:
-        #     sites = sort_bed(f.name).merge()
-        sites = pybedtools.BedTool(f.name).sort().merge()
+    @staticmethod
+    def _filter_sites(sites, blacklist_bed=False, filter_chroms=None):
+        """
+        Remove sites overlapping a blacklist and sites in chromosomes matching ``filter_chroms``
+        from a dataframe with columns "chrom", "start" and "end".
+        """
+        from ngs_toolkit.utils import read_bed_coordinates, remove_overlapping_intervals
 
-        # Filter
         # # remove blacklist regions
         if blacklist_bed is not False:
-            if not isinstance(blacklist_bed, pybedtools.BedTool):
-                blacklist = pybedtools.BedTool(blacklist_bed)
-            sites = sites.intersect(v=True, b=blacklist)
+            if not isinstance(blacklist_bed, pd.DataFrame):
+                blacklist_bed = read_bed_coordinates(blacklist_bed)
+            sites = remove_overlapping_intervals(sites, blacklist_bed)
 
         # # filter requested chromosomes
         if filter_chroms is not None:
             if isinstance(filter_chroms, list):
-                sites = sites.filter(lambda x: x.chrom not in filter_chroms).saveas()
+                sites = sites.loc[~sites["chrom"].isin(filter_chroms)]
             elif isinstance(filter_chroms, str):
-                s = sites.to_dataframe()
-                sites = pybedtools.BedTool.from_dataframe(
-                    s.loc[~s["chrom"].str.match(filter_chroms)]
+                sites = sites.loc[~sites["chrom"].str.match(filter_chroms)]
+        return sites
+
+    @check_has_attributes(["sites"])
+    def update_consensus_sites(
+        self,
+        samples,
+        region_type="summits",
+        extension=250,
+        blacklist_bed=None,
+        filter_chroms=None,
+        permissive=False,
+        recount=True,
+        save=True,
+        assign=True,
+        **kwargs,
+    ):
+        """
+        Update the consensus sites with the peaks of samples without rebuilding them.
+
+        Peaks of ``samples`` are filtered and merged into the existing ``sites``,
+        which are only extended or merged with each other, so each existing site
+        is contained in exactly one updated site.
+        The resulting mapping of existing sites to updated sites is used to carry over
+        the values of ``matrix_raw`` and ``support`` (summing sites merged together),
+        and only sites whose coordinates changed are quantified again.
+        To quantify samples not yet in ``matrix_raw`` use
+        :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.add_samples` afterwards.
+
+        Parameters
+        ----------
+        samples : :obj:`list`
+            Iterable of :class:`peppy.Sample` objects with peaks to add to the sites.
+            Must have a ``region_type`` attribute set.
+        region_type : :obj:`str`
+            The type of region to add - one of "summits" or "peaks".
+            See :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.get_consensus_sites`.
+
+            Default is "summits".
+        extension : :obj:`int`
+            Amount to extend peaks summits by in both directions.
+
+            Default is 250.
+        blacklist_bed : {:obj:`False`, :obj:`str`}
+            Either :obj:`False` or a path to a BED file with genomic positions.
+            Peaks of ``samples`` overlapping these are not added.
+
+            Default is to use a blacklist file for the analysis ``genome``.
+        filter_chroms : {:obj:`list`, :obj:`str`}
+            A list of chromosomes or a pattern to match chromosomes
+            whose peaks are not added.
+            See :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.get_consensus_sites`.
+
+            Default is not to filter anything.
+        permissive : :obj:`bool`
+            Whether Samples that which ``region_type`` attribute file does not exist
+            should be simply skipped or an error thrown.
+
+            Default is :obj:`False`.
+        recount : :obj:`bool`
+            Whether to quantify again the reads and peaks of existing samples
+            in sites whose coordinates changed.
+            If :obj:`False`, merged sites keep the sum of values of their existing sites
+            and new sites have zero values.
+
+            Default is :obj:`True`.
+        save : :obj:`bool`
+            Whether to save to disk the updated sites, mapping of sites,
+            ``matrix_raw`` and ``support``.
+
+            Default is :obj:`True`.
+        assign : :obj:`bool`
+            Whether to assign the updated sites, mapping of sites,
+            ``matrix_raw`` and ``support`` to the analysis.
+
+            Default is :obj:`True`.
+        **kwargs : :obj:`dict`
+            Additional keyword arguments will be passed to
+            :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.measure_coverage`
+            when recounting sites.
+
+        Returns
+        -------
+        :class:`pybedtools.bedtool.BedTool`
+            The updated consensus peak set.
+
+        Attributes
+        ----------
+        sites : :class:`pybedtools.bedtool.BedTool`
+            The updated consensus peak set.
+        site_mapping : :class:`pandas.Series`
+            Updated site of each existing site.
+        matrix_raw : :class:`pandas.DataFrame`
+            The ``matrix_raw`` dataframe in the updated sites, if existing.
+        support : :class:`pandas.DataFrame`
+            The ``support`` dataframe in the updated sites, if existing.
+        """
+        import pybedtools
+        from ngs_toolkit.utils import (
+            _get_offset_coordinates,
+            bed_to_index,
+            count_interval_overlaps,
+            merge_intervals,
+            read_bed_coordinates,
+        )
+
+        if region_type not in ["summits", "peaks"]:
+            msg = "`region_type` attribute must be one of 'summits' or 'peaks'!"
+            _LOGGER.error(msg)
+            raise ValueError(msg)
+        samples = self._get_samples_with_input_file(
+            region_type, permissive=permissive, samples=samples
+        )
+        blacklist_bed = self._get_blacklist_bed(blacklist_bed, engine="numpy")
+
+        old_sites = read_bed_coordinates(self.sites)
+        peaks = self._filter_sites(
+            pd.concat(
+                self._read_sample_sites(samples, region_type, extension, permissive),
+                ignore_index=True,
+            ),
+            blacklist_bed,
+            filter_chroms,
+        )
+        sites = merge_intervals(pd.concat([old_sites, peaks], ignore_index=True))
+
+        # map each existing site to the updated site containing it
+        _, _, [(old_starts, _), (starts, _)] = _get_offset_coordinates([old_sites, sites])
+        old_index = bed_to_index(old_sites)
+        index = bed_to_index(sites)
+        mapping = pd.Series(
+            index[np.searchsorted(starts, old_starts, side="right") - 1],
+            index=old_index,
+            name="site",
+        )
+        changed = ~index.isin(old_index)
+        _LOGGER.info(
+            "Updated %i sites to %i sites, of which %i are new or changed.",
+            old_sites.shape[0], sites.shape[0], changed.sum())
+
+        # carry over existing values
+        matrix_raw = getattr(self, "matrix_raw", None)
+        if matrix_raw is not None:
+            name = matrix_raw.index.name
+            matrix_raw = (
+                matrix_raw.groupby(mapping.reindex(matrix_raw.index).values)
+                .sum()
+                .reindex(index, fill_value=0)
+            )
+            matrix_raw.index.name = name
+            if recount and changed.any():
+                counts = self.measure_coverage(
+                    samples=[s for s in self.samples if s.name in matrix_raw.columns],
+                    sites=pybedtools.BedTool.from_dataframe(sites.loc[changed]),
+                    save=False,
+                    assign=False,
+                    **kwargs,
                 )
+                matrix_raw.loc[counts.index, counts.columns] = counts
+
+        support = getattr(self, "support", None)
+        if support is not None:
+            sample_names = support.columns.drop(["chrom", "start", "end", "support"])
+            overlap = (
+                support[sample_names]
+                .groupby(mapping.reindex(support.index).values)
+                .sum()
+                .reindex(index, fill_value=0)
+            )
+            if recount and changed.any():
+                for sample in self.samples:
+                    if sample.name not in sample_names:
+                        continue
+                    overlap.loc[changed, sample.name] = count_interval_overlaps(
+                        sites.loc[changed], getattr(sample, region_type)
+                    )
+            support = pd.concat([sites.set_index(index), overlap], axis=1)
+            support["support"] = (overlap >= 1).sum(axis=1) / float(len(sample_names))
 
-        # Save and assign
+        sites = pybedtools.BedTool.from_dataframe(sites)
         if save:
             output_file = os.path.join(self.results_dir, self.name + ".peak_set.bed")
             sites.saveas(output_file)
             self.record_output_file(output_file, "consensus_sites")
             sites = pybedtools.BedTool(output_file)
+            mapping.to_csv(
+                os.path.join(self.results_dir, self.name + ".site_mapping.csv"), header=True
+            )
+            if matrix_raw is not None:
+                matrix_raw.to_csv(
+                    os.path.join(self.results_dir, self.name + ".matrix_raw.csv"), index=True
+                )
+            if support is not None:
+                support.to_csv(
+                    os.path.join(self.results_dir, self.name + ".support.csv"), index=True
+                )
         if assign:
             self.sites = sites
+            self.site_mapping = mapping
+            if matrix_raw is not None:
+                self.matrix_raw = matrix_raw
+            if support is not None:
+                self.support = support
         return sites
 
     def set_consensus_sites(self, bed_file, overwrite=True):
@@ -465,6 +797,7 @@ class ATACSeqAnalysis(Analysis):
         permissive=False,
         comparison_table=None,
         peak_dir=None,
+        cores=None,
     ):
         """
         Count number of called peaks per sample in the consensus region set.
@@ -493,6 +826,10 @@ class ATACSeqAnalysis(Analysis):
             Not used. Provided for compatibility with ChIPSeqAnalysis class.
         peak_dir: :obj:`str`
             Not used. Provided for compatibility with ChIPSeqAnalysis class.
+        cores : :obj:`int`
+            Number of processes to count the peaks of samples in.
+
+            Default is to use all available cores.
 
         Raises
         ----------
@@ -506,11 +843,6 @@ class ATACSeqAnalysis(Analysis):
             A dataframe with counts of peaks overlapping each feature of consensus set.
         """
         # TODO: Implement distributed
-        from tqdm import tqdm
-        import pybedtools
-        import tempfile
-        from ngs_toolkit.utils import bed_to_index
-
         if samples is None:
             samples = self.samples
 
@@ -520,49 +852,68 @@ class ATACSeqAnalysis(Analysis):
         )
 
         # calculate support (number of samples overlaping each merged peak)
-        for i, sample in tqdm(enumerate(samples), total=len(samples), desc="Sample"):
-            if region_type == "summits":
-                peaks = sample.summits
-            else:
-                peaks = sample.peaks
-            # print(sample, peaks)
-            if i == 0:
-                support = self.sites.intersect(peaks, wa=True, c=True)
-            else:
-                support = support.intersect(peaks, wa=True, c=True)
-
-        try:
-            support = support.to_dataframe()
-        except (
-            ValueError,
-            pybedtools.MalformedBedLineError,
-            pybedtools.helpers.BEDToolsError,
-            OverflowError,
-        ):
-            _LOGGER.debug(
-                "Could not convert support intersection directly to dataframe,"
-                "saving/reading temporary file."
-            )
-            t = tempfile.NamedTemporaryFile()
-            support.saveas(t.name)
-            support = pd.read_csv(t.name, sep="\t", header=None)
-
-        support.columns = ["chrom", "start", "end"] + [sample.name for sample in samples]
-        support.index = bed_to_index(support)
+        support = self._get_peak_overlap_counts(samples, region_type=region_type, cores=cores)
         support.to_csv(
             os.path.join(self.results_dir, self.name + ".binary_overlap_support.csv"), index=True,
         )
 
         # divide sum (of unique overlaps) by total to get support value between 0 and 1
-        support.loc[:, "support"] = support[[sample.name for sample in samples]].apply(
-            lambda x: sum([i if i <= 1 else 1 for i in x]) / float(len(samples)), axis=1
-        )
+        support["support"] = (support[[sample.name for sample in samples]] > 0).sum(
+            axis=1
+        ) / float(len(samples))
         # save
         support.to_csv(os.path.join(self.results_dir, self.name + ".support.csv"), index=True)
 
         setattr(self, "support", support)
         return self.support
 
+    def _get_peak_overlap_counts(self, samples, region_type="summits", cores=None):
+        """
+        Count the number of peaks of each sample overlapping each region in ``sites``.
+
+        The peaks of each sample are counted in parallel with a search over
+        their sorted positions in each chromosome and filled into a single matrix.
+
+        Parameters
+        ----------
+        samples : :obj:`list`
+            Iterable of :class:`peppy.Sample` objects with a ``region_type`` attribute set.
+        region_type : :obj:`str`
+            The type of region to use. One of "summits" or "peaks".
+
+            Default is "summits".
+        cores : :obj:`int`
+            Number of processes to use.
+
+            Default is to use all available cores.
+
+        Returns
+        -------
+        :obj:`pandas.DataFrame`
+            Dataframe with "chrom", "start", "end" columns and the number of overlapping
+            peaks for each sample, indexed by region.
+        """
+        import parmap
+        from ngs_toolkit.utils import bed_to_index, count_interval_overlaps, read_bed_coordinates
+
+        sites = read_bed_coordinates(self.sites)
+        res = parmap.starmap(
+            count_interval_overlaps,
+            [(sites, getattr(sample, region_type)) for sample in samples],
+            pm_processes=cores,
+            pm_parallel=True,
+        )
+        counts = np.empty((sites.shape[0], len(samples)), dtype=np.int64)
+        for i, c in enumerate(res):
+            counts[:, i] = c
+        del res
+
+        support = pd.concat(
+            [sites, pd.DataFrame(counts, columns=[sample.name for sample in samples])], axis=1
+        )
+        support.index = bed_to_index(support)
+        return support
+
     def get_supported_peaks(self, samples=None, **kwargs):
         """
         Get mask of sites with 0 support in the given samples.
@@ -596,20 +947,35 @@ class ATACSeqAnalysis(Analysis):
         permissive=False,
         distributed=False,
         overwrite=True,
+        engine="count",
+        cores=None,
+        compact=False,
+        cache=False,
+        coverage_format="bed",
+        frip=False,
+        read_filters=None,
+        bam_attribute="aligned_filtered_bam",
+        count_mode="reads",
+        source="bam",
+        bigwig_statistic="sum",
+        reference=None,
         **kwargs,
     ):
         """
         Measure read coverage (counts) of each sample in each region
         in consensus sites.
         Uses parallel computing using the :class:`parmap` library.
-        However, for many samples (hundreds), parallelization in a
+        By default one process is used per sample, but if ``cores`` is given,
+        the work of each sample is further split by chromosome in a pool
+        of ``cores`` processes, which is useful for few samples with many reads.
+        For many samples (hundreds), parallelization in a
         computing cluster is possible with the `distributed` option.
 
         Parameters
         ----------
         samples : :obj:`list`
             Iterable of :class:`peppy.Sample` objects to restrict to.
-            Must have a ``aligned_filtered_bam`` attribute set.
+            Must have a ``bam_attribute`` attribute set.
 
             Defaults to all samples in the analysis (``samples`` attribute).
         sites : {:class:`pybedtools.bedtool.BedTool`, :class:`pandas.DataFrame`, :obj:`str`}
@@ -618,10 +984,16 @@ class ATACSeqAnalysis(Analysis):
             If a DataFrame, will try to convert to BED format assuming first
             three columns are chr,start,end.
             If a string assumes a path to a BED file.
+            If a dict of names and any of the above, all region sets are quantified
+            with a single pass over each BAM file (with the "sweep" engine) and
+            a dict with one matrix per region set is returned.
+            This is not supported if ``distributed`` is True.
 
             Defaults to ``sites`` attribute of analysis object.
         save : :obj:`bool`
             Whether to save to disk the coverage matrix with filename ``output_file``.
+            If ``sites`` is a dict, the name of each region set is added as suffix to
+            ``output_file`` before the extension.
 
             Default is :obj:`True`.
         assign : :obj:`bool`
@@ -650,6 +1022,108 @@ class ATACSeqAnalysis(Analysis):
             Whether to overwrite existing files if ``distributed`` is True.
 
             Default is :obj:`True`.
+        engine : :obj:`str`
+            Engine used to count reads in the BAM files. One of "count"
+            (one index query per region) or "sweep" (one pass over
+            each chromosome, much faster for large region sets).
+            See :func:`ngs_toolkit.utils.count_reads_in_intervals`.
+
+            Default is "count".
+        cores : :obj:`int`
+            Number of processes to split the work of all samples by chromosome into.
+            If ``distributed`` is True, this is the number of cores requested
+            for each job, which will be used in the same way.
+
+            Default is to use one process per sample.
+        compact : :obj:`bool`
+            Whether to have workers return counts as unsigned 32-bit integer arrays
+            in the order of sites which are filled into a preallocated matrix,
+            instead of a dictionary of region labels.
+            This greatly reduces memory usage and communication between processes
+            for large numbers of sites and samples.
+            The resulting matrix will be of ``uint32`` type and
+            regions which could not be quantified will have zero counts instead of NaN.
+            Does not apply if ``distributed`` is True.
+
+            Default is :obj:`False`.
+        cache : :obj:`bool`
+            Whether to use a persistent on-disk cache of the counts of each sample.
+            Entries are identified by a fingerprint of the BAM file and a hash of the sites,
+            so only samples not yet quantified in the same sites or
+            whose BAM file changed are counted.
+            Implies ``compact``.
+            Does not apply if ``distributed`` is True.
+            See :func:`ngs_toolkit.utils.inspect_coverage_cache` and
+            :func:`ngs_toolkit.utils.invalidate_coverage_cache` to manage the cache
+            and the "preferences:coverage_cache" section of the configuration
+            to set its location and maximum size.
+
+            Default is :obj:`False`.
+        coverage_format : :obj:`str`
+            Format of the coverage file of each sample if ``distributed`` is True.
+            One of "bed" (text BED file with counts in fourth column) or
+            "binary" (counts in order of sites with a header holding a hash of the sites,
+            see :func:`ngs_toolkit.utils.write_coverage_array`), which is much
+            more compact and faster to collect with
+            :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.collect_coverage`.
+
+            Default is "bed".
+        frip : :obj:`bool`
+            Whether to also count the total number of reads and the number
+            of those reads overlapping any site in the same pass over each BAM file (with the
+            "sweep" engine) to compute the fraction of reads in peaks (FRiP) of each sample.
+            These are stored in the ``read_stats`` attribute and, if ``save`` is True,
+            written to the "stats.tsv" file of each sample, replacing values of previous runs.
+            Both count the reads placed in a chromosome which pass ``read_filters``.
+            Implies ``compact`` and the "sweep" ``engine``, and cannot be combined with
+            ``cache``, ``distributed`` or several region sets in ``sites``.
+
+            Default is :obj:`False`.
+        read_filters : :obj:`dict`
+            Filters to apply to reads while counting, such as a minimum mapping quality,
+            SAM flags to include or exclude, skipping duplicates or a window of
+            fragment lengths. This allows quantifying unfiltered BAM files
+            (see ``bam_attribute``) without producing filtered BAM files.
+            See :func:`ngs_toolkit.utils.count_reads_in_intervals` for available filters.
+
+            Default is not to filter reads.
+        bam_attribute : :obj:`str`
+            Attribute of samples with the path to the BAM file to quantify.
+
+            Default is "aligned_filtered_bam".
+        count_mode : :obj:`str`
+            What to count in each site. One of "reads" (reads overlapping sites),
+            "fragments" (read pairs overlapping sites counted once) or
+            "cutsites" (Tn5 insertion sites, i.e. read ends shifted +4/-5 bp
+            in forward/reverse strand reads, within sites).
+            Modes other than "reads" always use the "sweep" engine.
+            See :func:`ngs_toolkit.utils.count_reads_in_intervals`.
+
+            Default is "reads".
+        source : :obj:`str`
+            Source of the signal to quantify. One of "bam", to count reads in the
+            BAM file of each sample (see ``bam_attribute``) or "bigwig", to
+            measure the signal in the bigWig file of each sample (``bigwig`` attribute),
+            which does not require BAM files.
+            The "bigwig" source reads each chromosome of each file with a single query,
+            produces a matrix of floats and does not support ``distributed``
+            or ``sites`` as a dict. Options specific to counting reads do not apply to it.
+            Requires the "pyBigWig" Python library to be installed.
+
+            Default is "bam".
+        bigwig_statistic : :obj:`str`
+            Statistic of the signal in each site if ``source`` is "bigwig".
+            One of "sum" or "mean". See :func:`ngs_toolkit.utils.measure_bigwig_signal`.
+
+            Default is "sum".
+        reference : :obj:`str`
+            Path to reference genome FASTA file used to decode CRAM files
+            (files ending in ".cram"). Its sequences are stored once in a local
+            cache shared by all worker processes
+            (see :func:`ngs_toolkit.utils.setup_reference_cache`).
+
+            Default is the genome FASTA file from
+            :func:`ngs_toolkit.analysis.Analysis.get_resources` if any file is a CRAM file.
         **kwargs : :obj:`dict`
             Additional keyword arguments will be passed to
             `ngs_toolkit.utils.submit_job` if `distributed` is True,
@@ -660,96 +1134,118 @@ class ATACSeqAnalysis(Analysis):
         Raises
         ----------
         IOError
-            If not ``permissive`` and the 'aligned_filtered_bam'
+            If not ``permissive`` and the ``bam_attribute``
             file attribute of a sample is not readable.
             Or if ``permissive`` but none of the samples has an existing file.
 
+        ValueError
+            If ``sites`` is a dict and ``distributed`` is True,
+            if ``source`` is not one of the available options or
+            if ``frip`` is True and ``cache`` or ``distributed`` is True
+            or ``sites`` is a dict.
+
         Attributes
         ----------
         matrix_raw : :class:`pandas.DataFrame`
             The dataframe of raw coverage values (counts) of
             shape (n_features, m_samples).
+        matrix_raw_sets : :obj:`dict`
+            If ``sites`` is a dict, a dict of region set names and dataframes of
+            raw coverage values (counts) of shape (n_features, m_samples).
+        read_stats : :class:`pandas.DataFrame`
+            If ``frip`` is True, a dataframe with the total number of reads
+            ("total_reads"), reads overlapping sites ("reads_in_sites") and
+            their ratio ("frip") for each sample.
 
         Returns
         -------
         :class:`pandas.DataFrame`
-            Pandas DataFrame with read counts of shape (n_sites, m_samples).
+            Pandas DataFrame with read counts of shape (n_sites, m_samples)
+            or dict of region set names and such dataframes if ``sites`` is a dict.
         """
-        import sys
-        import multiprocessing
-        import parmap
-
-        from ngs_toolkit.utils import count_reads_in_intervals, submit_job, to_bed_index
+        from ngs_toolkit.utils import (
+            _check_count_mode,
+            _check_read_filters,
+            setup_reference_cache,
+            to_bed_index,
+        )
 
         if samples is None:
             samples = self.samples
 
         output_file = self._format_string_with_attributes(output_file)
 
+        sources = ["bam", "bigwig"]
+        if source not in sources:
+            msg = "`source` must be one of '{}'.".format("', '".join(sources))
+            _LOGGER.error(msg)
+            raise ValueError(msg)
+        if source == "bigwig":
+            if distributed or isinstance(sites, dict):
+                msg = "Quantifying bigWig files does not support `distributed` mode"
+                msg += " or several region sets."
+                _LOGGER.error(msg)
+                raise ValueError(msg)
+            samples = self._get_samples_with_input_file(
+                "bigwig", samples=samples, permissive=permissive
+            )
+            sites_str = to_bed_index(self.sites if sites is None else sites)
+            matrix_raw = self._measure_bigwig_coverage(
+                samples, sites_str, statistic=bigwig_statistic, cores=cores)
+            if assign:
+                self.matrix_raw = matrix_raw
+            if save:
+                matrix_raw.to_csv(output_file, index=True)
+            return matrix_raw
+
         # Check which samples to run (dependent on permissive)
         samples = self._get_samples_with_input_file(
-            "aligned_filtered_bam", samples=samples, permissive=permissive
+            bam_attribute, samples=samples, permissive=permissive
         )
+        bams = [getattr(sample, bam_attribute) for sample in samples]
+        read_filters = _check_read_filters(read_filters)
+        _check_count_mode(count_mode)
+        if any([bam.endswith(".cram") for bam in bams]):
+            if reference is None:
+                reference = self.get_resources(steps=["genome"])["genome_file"]["fasta"]
+            # workers decode CRAM files with the cache of ``reference`` if it was set up
+            setup_reference_cache(reference)
+        counting = dict(read_filters=read_filters, count_mode=count_mode, reference=reference)
 
         if sites is None:
             sites = self.sites
 
-        if not distributed:
-            # Count reads with pysam
-            # make strings with intervals
-            sites_str = to_bed_index(sites)
-            # count, create dataframe
-            matrix_raw = pd.DataFrame(
-                map(
-                    pd.Series,
-                    parmap.map(
-                        count_reads_in_intervals,
-                        [sample.aligned_filtered_bam for sample in samples],
-                        sites_str,
-                        pm_parallel=True,
-                    ),
-                ),
-                index=[sample.name for sample in samples],
-            ).T
+        if frip and (distributed or isinstance(sites, dict)):
+            msg = "`frip` is not supported in `distributed` mode or with several region sets."
+            _LOGGER.error(msg)
+            raise ValueError(msg)
 
+        if isinstance(sites, dict):
+            if distributed:
+                msg = "Quantifying several region sets is not supported in `distributed` mode."
+                _LOGGER.error(msg)
+                raise ValueError(msg)
+            sites_str = {name: to_bed_index(s) for name, s in sites.items()}
+            matrices = self._measure_region_set_coverage(
+                samples, bams, sites_str, cores=cores, **counting)
             if assign:
-                self.matrix_raw = matrix_raw
+                self.matrix_raw_sets = matrices
             if save:
-                matrix_raw.to_csv(output_file, index=True)
-            return matrix_raw
-
-        else:
-            for s in samples:
-                output_dir = os.path.join(s.sample_root, "coverage")
-                if not os.path.exists(output_dir):
-                    os.makedirs(output_dir)
-
-                job_name = "{}.{}_coverage".format(peak_set_name, s.name)
-                prefix = os.path.join(output_dir, s.name + ".{}_coverage".format(peak_set_name))
-                output_file = prefix + ".bed"
-                log_file = prefix + ".log"
-                job_file = prefix + ".sh"
-                if not overwrite:
-                    if os.path.exists(output_file):
-                        continue
-
-                cmd = "\\\n".join(
-                    [
-                        "{executable} -m ngs_toolkit.recipes.coverage ",
-                        "--no-overwrite" if not overwrite else "",
-                        "{input_bed} {input_bam} {output_bed}",
-                    ]
-                ).format(
-                    executable=sys.executable,
-                    input_bed=sites.fn,
-                    input_bam=s.aligned_filtered_bam,
-                    output_bed=output_file,
-                )
-                for k, v in [("cores", 1), ("mem", 8000), ("time", "04:00:00")]:
-                    if k not in kwargs:
-                        kwargs[k] = v
-
-                submit_job(cmd, job_file, jobname=job_name, logfile=log_file, **kwargs)
+                root, ext = os.path.splitext(output_file)
+                for name, matrix_raw in matrices.items():
+                    matrix_raw.to_csv(root + "." + name + ext, index=True)
+            return matrices
+
+        if distributed:
+            if coverage_format not in ["bed", "binary"]:
+                msg = "`coverage_format` must be one of 'bed' or 'binary'."
+                _LOGGER.error(msg)
+                raise ValueError(msg)
+            self._submit_coverage_jobs(
+                samples, bams, sites,
+                peak_set_name=peak_set_name, engine=engine, cores=cores,
+                coverage_format=coverage_format, overwrite=overwrite,
+                **counting, **kwargs)
             if getattr(kwargs, "computing_configuration", None) in ["localhost", "default"]:
                 _LOGGER.info("Collecting job results.")
                 return self.collect_coverage(
@@ -758,7 +1254,295 @@ class ATACSeqAnalysis(Analysis):
                     assign=assign,
                     output_file=output_file,
                     permissive=permissive,
+                    peak_set_name=peak_set_name,
+                    sites=sites,
+                    coverage_format=coverage_format,
                 )
+            return None
+
+        # Count reads with pysam
+        # make strings with intervals
+        sites_str = to_bed_index(sites)
+        if frip:
+            if cache:
+                msg = "`frip` counts reads in the same pass as the statistics"
+                msg += " and cannot be combined with `cache`."
+                _LOGGER.error(msg)
+                raise ValueError(msg)
+            if engine != "sweep":
+                _LOGGER.warning(
+                    "`frip` counts reads with the 'sweep' engine, ignoring `engine`.")
+            matrix_raw, read_stats = self._measure_coverage_and_frip(
+                samples, bams, sites_str, cores=cores, **counting)
+            if assign:
+                self.read_stats = read_stats
+            if save:
+                self._write_frip_stats(samples, read_stats)
+        elif cache:
+            matrix_raw = self._measure_cached_coverage(
+                samples, bams, sites_str, engine=engine, cores=cores, **counting)
+        else:
+            matrix_raw = self._measure_local_coverage(
+                samples, bams, sites_str, engine=engine, cores=cores, compact=compact,
+                **counting)
+
+        if assign:
+            self.matrix_raw = matrix_raw
+        if save:
+            matrix_raw.to_csv(output_file, index=True)
+        return matrix_raw
+
+    @staticmethod
+    def _fill_coverage_matrix(samples, sites_str, counts, dtype=np.uint32):
+        """
+        Fill a preallocated matrix of shape (n_sites, m_samples) with the
+        array of counts of each sample and label it with sites and sample names.
+        """
+        matrix_raw = np.empty((len(sites_str), len(samples)), dtype=dtype)
+        for i, c in enumerate(counts):
+            matrix_raw[:, i] = c
+        return pd.DataFrame(
+            matrix_raw, index=sites_str, columns=[sample.name for sample in samples])
+
+    def _measure_bigwig_coverage(self, samples, sites_str, statistic="mean", cores=None):
+        """
+        Summarize the signal of the bigWig file of each sample in ``sites_str``.
+        """
+        import parmap
+        from ngs_toolkit.utils import measure_bigwig_signal
+
+        res = parmap.map(
+            measure_bigwig_signal,
+            [sample.bigwig for sample in samples],
+            sites_str,
+            statistic=statistic,
+            pm_processes=cores,
+            pm_parallel=True,
+        )
+        return self._fill_coverage_matrix(samples, sites_str, res, dtype=np.float64)
+
+    def _measure_region_set_coverage(self, samples, bams, sites_str, cores=None, **kwargs):
+        """
+        Count reads of each sample in several region sets (``sites_str`` is a
+        dict of names and interval strings) in one pass over each BAM file.
+        """
+        import parmap
+        from ngs_toolkit.utils import _get_reference_cache_pool, count_reads_in_interval_sets
+
+        with _get_reference_cache_pool(kwargs.get("reference"), cores) as pool:
+            res = parmap.map(
+                count_reads_in_interval_sets,
+                bams,
+                sites_str,
+                pm_pool=pool,
+                pm_parallel=True,
+                **kwargs,
+            )
+        return {
+            name: self._fill_coverage_matrix(samples, intervals, [c[name] for c in res])
+            for name, intervals in sites_str.items()}
+
+    def _measure_coverage_and_frip(self, samples, bams, sites_str, cores=None, **kwargs):
+        """
+        Count reads of each sample in ``sites_str`` together with the total
+        number of reads and return the count matrix and a dataframe of
+        "total_reads", "reads_in_sites" and "frip" per sample.
+        """
+        import parmap
+        from ngs_toolkit.utils import _get_reference_cache_pool, count_reads_in_interval_sets
+
+        with _get_reference_cache_pool(kwargs.get("reference"), cores) as pool:
+            res = parmap.map(
+                count_reads_in_interval_sets,
+                bams,
+                {"sites": sites_str},
+                stats=True,
+                pm_pool=pool,
+                pm_parallel=True,
+                **kwargs,
+            )
+        matrix_raw = self._fill_coverage_matrix(
+            samples, sites_str, [c["sites"] for c, _ in res])
+        read_stats = pd.DataFrame(
+            [[st["total"], st["sites"]] for _, st in res],
+            index=pd.Index([sample.name for sample in samples], name="sample_name"),
+            columns=["total_reads", "reads_in_sites"],
+        )
+        read_stats["frip"] = read_stats["reads_in_sites"] / read_stats["total_reads"]
+        return matrix_raw, read_stats
+
+    @staticmethod
+    def _write_frip_stats(samples, read_stats):
+        """
+        Write the read statistics of each sample to the "stats.tsv" file in its
+        directory, replacing values of previous runs and keeping other statistics.
+        """
+        keys = {
+            "total_reads": "total_reads",
+            "region_set_reads": "reads_in_sites",
+            "region_set_frip": "frip",
+        }
+        for sample in samples:
+            if not os.path.exists(sample.sample_root):
+                os.makedirs(sample.sample_root)
+            stats_file = os.path.join(sample.sample_root, "stats.tsv")
+            lines = list()
+            if os.path.exists(stats_file):
+                with open(stats_file, "r") as handle:
+                    lines = [line for line in handle if line.split("\t")[0] not in keys]
+            lines += [
+                "{}\t{}\t.\n".format(key, read_stats.loc[sample.name, col])
+                for key, col in keys.items()]
+            with open(stats_file, "w") as handle:
+                handle.writelines(lines)
+
+    def _measure_cached_coverage(
+        self, samples, bams, sites_str, engine="sweep", cores=None, **kwargs
+    ):
+        """
+        Read the coverage of each sample in ``sites_str`` from the coverage cache,
+        counting and caching only samples missing from it.
+        """
+        from ngs_toolkit.utils import (
+            cache_coverage,
+            count_reads_in_intervals_parallel,
+            get_cached_coverage,
+        )
+
+        parameters = dict()
+        if kwargs.get("read_filters"):
+            parameters["read_filters"] = kwargs["read_filters"]
+        if kwargs.get("count_mode", "reads") != "reads":
+            parameters["count_mode"] = kwargs["count_mode"]
+        res = [get_cached_coverage(bam, sites_str, parameters) for bam in bams]
+        missing = [i for i, c in enumerate(res) if c is None]
+        _LOGGER.info(
+            "Found %i samples in coverage cache, counting %i samples.",
+            len(bams) - len(missing), len(missing))
+        if missing:
+            counts = count_reads_in_intervals_parallel(
+                [bams[i] for i in missing],
+                sites_str,
+                cores=cores,
+                compact=True,
+                engine=engine,
+                **kwargs,
+            )
+            for j, i in enumerate(missing):
+                res[i] = counts.iloc[:, j].values
+                cache_coverage(bams[i], sites_str, res[i], parameters)
+            del counts
+        return self._fill_coverage_matrix(samples, sites_str, res)
+
+    def _measure_local_coverage(
+        self, samples, bams, sites_str, engine="sweep", cores=None, compact=False, **kwargs
+    ):
+        """
+        Count reads of each sample in ``sites_str`` in parallel, with one process
+        per sample or, if ``cores`` is given, per sample and chromosome.
+        """
+        import parmap
+        from ngs_toolkit.utils import (
+            _get_reference_cache_pool,
+            count_reads_in_intervals,
+            count_reads_in_intervals_parallel,
+        )
+
+        if cores is not None:
+            # split work by sample and chromosome
+            matrix_raw = count_reads_in_intervals_parallel(
+                bams, sites_str, cores=cores, compact=compact, engine=engine, **kwargs)
+            matrix_raw.columns = [sample.name for sample in samples]
+            return matrix_raw
+        with _get_reference_cache_pool(kwargs.get("reference")) as pool:
+            res = parmap.map(
+                count_reads_in_intervals,
+                bams,
+                sites_str,
+                engine=engine,
+                as_array=compact,
+                pm_pool=pool,
+                pm_parallel=True,
+                **kwargs,
+            )
+        if compact:
+            # fill preallocated matrix with array of counts from each sample
+            return self._fill_coverage_matrix(samples, sites_str, res)
+        return pd.DataFrame(
+            map(pd.Series, res), index=[sample.name for sample in samples]).T
+
+    @staticmethod
+    def _submit_coverage_jobs(
+        samples,
+        bams,
+        sites,
+        peak_set_name="peak_set",
+        engine="sweep",
+        cores=None,
+        coverage_format="bed",
+        overwrite=True,
+        read_filters=None,
+        count_mode="reads",
+        reference=None,
+        **kwargs
+    ):
+        """
+        Submit one job per sample quantifying its coverage in ``sites`` with
+        :mod:`ngs_toolkit.recipes.coverage`.
+        """
+        import sys
+        from ngs_toolkit.utils import submit_job
+
+        filter_args = list()
+        for key, value in (read_filters or dict()).items():
+            if key == "skip_duplicates":
+                filter_args += ["--skip-duplicates"] if value else []
+            elif key == "fragment_length":
+                filter_args += ["--fragment-length {} {}".format(*value)]
+            elif value is not None:
+                filter_args += ["--{} {}".format(key.replace("_", "-"), value)]
+        for s, bam in zip(samples, bams):
+            output_dir = os.path.join(s.sample_root, "coverage")
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+
+            job_name = "{}.{}_coverage".format(peak_set_name, s.name)
+            prefix = os.path.join(output_dir, s.name + ".{}_coverage".format(peak_set_name))
+            output_file = prefix + (".bin" if coverage_format == "binary" else ".bed")
+            log_file = prefix + ".log"
+            job_file = prefix + ".sh"
+            if not overwrite:
+                if os.path.exists(output_file):
+                    continue
+
+            cmd = "\\\n".join(
+                [
+                    "{executable} -m ngs_toolkit.recipes.coverage ",
+                    "--no-overwrite" if not overwrite else "",
+                    "--engine {engine}",
+                    "--cores {cores}" if cores is not None else "",
+                    "--output-format {coverage_format}",
+                    "--count-mode {count_mode}",
+                    "--reference {reference}" if reference is not None else "",
+                ]
+                + filter_args
+                + ["{input_bed} {input_bam} {output_bed}"]
+            ).format(
+                executable=sys.executable,
+                engine=engine,
+                cores=cores,
+                coverage_format=coverage_format,
+                count_mode=count_mode,
+                reference=reference,
+                input_bed=sites.fn,
+                input_bam=bam,
+                output_bed=output_file,
+            )
+            for k, v in [("cores", cores or 1), ("mem", 8000), ("time", "04:00:00")]:
+                if k not in kwargs:
+                    kwargs[k] = v
+
+            submit_job(cmd, job_file, jobname=job_name, logfile=log_file, **kwargs)
 
     def collect_coverage(
         self,
@@ -769,6 +1553,8 @@ class ATACSeqAnalysis(Analysis):
         permissive=False,
         peak_set_name="peak_set",
         fast_and_unsafe=False,
+        sites=None,
+        coverage_format="bed",
     ):
         """
         Collect read coverage (counts) of each sample in each region in consensus sites from existing files.
@@ -802,14 +1588,33 @@ class ATACSeqAnalysis(Analysis):
             Whether to use a faster but unsafer method to concatenate the data.
             If the order of all rows in all samples is the same then the result should be the same.
             The default, slower method assures that all rows are matched and is therefore slower.
+            Does not apply to "binary" ``coverage_format``.
 
             Defaults to :obj:`False`.
 
+        sites : {:class:`pybedtools.bedtool.BedTool`, :class:`pandas.DataFrame`, :obj:`str`}
+            Sites in the genome which were quantified.
+            Only used if ``coverage_format`` is "binary" to check that
+            files were produced with these sites and to label the matrix.
+
+            Defaults to ``sites`` attribute of analysis object.
+
+        coverage_format: :obj:`str`
+            Format of coverage files produced by
+            :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.measure_coverage`.
+            One of "bed" or "binary".
+            Binary files are memory-mapped directly into the matrix.
+
+            Defaults to "bed".
+
         Raises
         ----------
         IOError
             If not ``permissive`` and the coverage file of a sample is not readable or is empty.
             Or if ``permissive`` but none of the samples has an existing file or are empty.
+        ValueError
+            If not ``permissive`` and a binary coverage file of a sample
+            was not produced with ``sites``.
 
         Attributes
         ----------
@@ -823,10 +1628,20 @@ class ATACSeqAnalysis(Analysis):
         """
         from tqdm import tqdm
 
-        from ngs_toolkit.utils import bed_to_index
+        from ngs_toolkit.utils import (
+            bed_to_index,
+            get_site_set_hash,
+            read_coverage_array,
+            to_bed_index,
+        )
 
+        if coverage_format not in ["bed", "binary"]:
+            msg = "`coverage_format` must be one of 'bed' or 'binary'."
+            _LOGGER.error(msg)
+            raise ValueError(msg)
         if samples is None:
             samples = self.samples
+        ext = "bin" if coverage_format == "binary" else "bed"
 
         for sample in samples:
             setattr(
@@ -835,7 +1650,7 @@ class ATACSeqAnalysis(Analysis):
                 os.path.join(
                     sample.sample_root,
                     "coverage",
-                    sample.name + ".{}_coverage.bed".format(peak_set_name),
+                    sample.name + ".{}_coverage.{}".format(peak_set_name, ext),
                 ),
             )
 
@@ -844,9 +1659,22 @@ class ATACSeqAnalysis(Analysis):
             "_coverage", permissive=permissive, samples=samples
         )
 
+        if coverage_format == "binary":
+            sites_str = to_bed_index(self.sites if sites is None else sites)
+            site_hash = get_site_set_hash(sites_str)
+
         # Read in counts
         matrix_raw = list()
         for sample in tqdm(samples, total=len(samples)):
+            if coverage_format == "binary":
+                try:
+                    cov = read_coverage_array(sample._coverage, site_hash=site_hash)
+                except ValueError:
+                    if not permissive:
+                        raise
+                    continue
+                matrix_raw.append((sample.name, cov))
+                continue
             cov = pd.read_csv(
                 sample._coverage,
                 sep="\t",
@@ -873,7 +1701,17 @@ class ATACSeqAnalysis(Analysis):
                 _LOGGER.error(msg)
                 raise IOError(msg)
 
-        if fast_and_unsafe:
+        if coverage_format == "binary":
+            # fill preallocated matrix with memory-mapped counts
+            values = np.empty((len(sites_str), len(matrix_raw)), dtype=np.uint32)
+            for i, (_, cov) in enumerate(matrix_raw):
+                values[:, i] = cov
+            matrix_raw = pd.DataFrame(
+                values,
+                index=pd.Index(sites_str, name="region"),
+                columns=[name for name, _ in matrix_raw],
+            )
+        elif fast_and_unsafe:
             _LOGGER.warning("Using a concatenation method that is not 100% safe.")
             matrix_raw = pd.concat(matrix_raw, axis=1, sort=False).dropna().sort_index()
             matrix_raw = (
@@ -893,7 +1731,8 @@ class ATACSeqAnalysis(Analysis):
                 )
                 .astype(int)
             )
-        matrix_raw.index = bed_to_index(matrix_raw.index.to_frame())
+        if coverage_format != "binary":
+            matrix_raw.index = bed_to_index(matrix_raw.index.to_frame())
 
         if assign:
             self.matrix_raw = matrix_raw
@@ -906,23 +1745,178 @@ class ATACSeqAnalysis(Analysis):
                 )
         return matrix_raw
 
+    @check_has_attributes(["sites", "matrix_raw"])
+    def add_samples(
+        self,
+        samples,
+        region_type="summits",
+        permissive=False,
+        save=True,
+        assign=True,
+        output_file="{results_dir}/{name}.matrix_raw.csv",
+        **kwargs,
+    ):
+        """
+        Add samples to an existing analysis with a fixed set of ``sites``.
+
+        Only the BAM files and peaks of the new samples are quantified
+        and their values are appended as new columns to the existing ``matrix_raw``
+        and ``support`` (if existing) dataframes, leaving existing values untouched.
+        The support value of each region is updated to reflect all samples.
+
+        Parameters
+        ----------
+        samples : :obj:`list`
+            Iterable of :class:`peppy.Sample` objects to add.
+            Must have a ``aligned_filtered_bam`` attribute set and
+            a ``region_type`` attribute set if ``support`` is to be updated.
+            Samples already in ``matrix_raw`` are skipped.
+        region_type : :obj:`str`
+            The type of region to count overlaps with to update ``support``.
+            One of "summits" or "peaks".
+
+            Default is "summits".
+        permissive: :obj:`bool`
+            Whether Samples that which `region_type` attribute file does
+            not exist should be simply skipped or an error thrown.
+
+            Default is :obj:`False`.
+        save : :obj:`bool`
+            Whether to save to disk the updated ``matrix_raw`` with filename ``output_file``
+            and the updated ``support`` dataframe.
+
+            Default is :obj:`True`.
+        assign : :obj:`bool`
+            Whether to assign the updated dataframes to the ``matrix_raw``
+            and ``support`` attributes.
+
+            Default is :obj:`True`.
+        output_file : :obj:`str`
+            Output file for the updated ``matrix_raw`` if ``save`` is True.
+
+            Default is "{results_dir}/{name}.matrix_raw.csv".
+        **kwargs : :obj:`dict`
+            Additional keyword arguments will be passed to
+            :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.measure_coverage`.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            The updated ``matrix_raw`` dataframe.
+
+        Raises
+        ----------
+        ValueError
+            If the regions quantified in the new samples do not match
+            the ones in the existing ``matrix_raw``.
+
+        Attributes
+        ----------
+        matrix_raw : :class:`pandas.DataFrame`
+            The ``matrix_raw`` dataframe with new samples as columns.
+        support : :class:`pandas.DataFrame`
+            The ``support`` dataframe with new samples as columns.
+        samples : :obj:`list`
+            Samples of the analysis including the added samples.
+        """
+        existing = [s for s in samples if s.name in self.matrix_raw.columns]
+        if existing:
+            _LOGGER.warning(
+                "Skipping samples already in `matrix_raw`: '%s'.",
+                "', '".join([s.name for s in existing]))
+        samples = [s for s in samples if s.name not in self.matrix_raw.columns]
+        if not samples:
+            _LOGGER.warning("No new samples to add.")
+            return self.matrix_raw
+
+        # quantify coverage of new samples only
+        matrix = self.measure_coverage(samples=samples, save=False, assign=False, **kwargs)
+        if not matrix.index.equals(self.matrix_raw.index):
+            msg = "Regions quantified in new samples do not match existing `matrix_raw`."
+            msg += " `add_samples` requires the same `sites` used to produce `matrix_raw`."
+            _LOGGER.error(msg)
+            raise ValueError(msg)
+        matrix_raw = pd.concat([self.matrix_raw, matrix], axis=1)
+
+        # count overlap of new samples' peaks
+        support = getattr(self, "support", None)
+        if support is not None:
+            peak_samples = self._get_samples_with_input_file(
+                region_type, permissive=permissive, samples=samples
+            )
+            overlap = self._get_peak_overlap_counts(peak_samples, region_type=region_type)
+            support = pd.concat(
+                [
+                    support.drop("support", axis=1),
+                    overlap.drop(["chrom", "start", "end"], axis=1).reindex(support.index),
+                ],
+                axis=1,
+            )
+            sample_names = support.columns.drop(["chrom", "start", "end"])
+            support.loc[:, "support"] = (support[sample_names] >= 1).sum(axis=1) / float(
+                len(sample_names)
+            )
+
+        if assign:
+            self.matrix_raw = matrix_raw
+            if support is not None:
+                self.support = support
+            names = [s.name for s in self.samples]
+            self.samples += [s for s in samples if s.name not in names]
+        if save:
+            matrix_raw.to_csv(self._format_string_with_attributes(output_file), index=True)
+            if support is not None:
+                support.drop("support", axis=1).to_csv(
+                    os.path.join(self.results_dir, self.name + ".binary_overlap_support.csv"),
+                    index=True,
+                )
+                support.to_csv(
+                    os.path.join(self.results_dir, self.name + ".support.csv"), index=True
+                )
+        return matrix_raw
+
     @check_has_attributes(["organism", "genome"])
-    def get_peak_gccontent_length(self, bed_file=None, fasta_file=None):
+    def get_peak_gccontent_length(
+        self, bed_file=None, fasta_file=None, engine="bedtools", cores=None, cache=True
+    ):
         """
         Get length and GC content of features in region set.
 
+        Parameters
+        ----------
         bed_file : :obj:`str`
             A BED file with regions to calculate GC content on. Must be a 3-column BED!
             If not provided the calculation will be for the analysis `sites` attribute.
 
-        genome : :obj:`str`
-            Genome assembly.
-
         fasta_file : :obj:`str`
             Fasta file of `genome`. Preferably indexed. If not given, will try to download.
+            With the "numpy" ``engine`` it can also be a 2bit file,
+            which is used by default if available.
 
-        :var nuc:
-            DataFrame with nucleotide content and length of each region.
+        engine : :obj:`str`
+            Engine used to compute the nucleotide content. One of "bedtools"
+            (runs bedtools nuc) or "numpy" (counts bases of a memory-mapped FASTA file
+            in parallel by chromosome, see :func:`ngs_toolkit.utils.get_gc_content_length`).
+
+            Default is "bedtools".
+
+        cores : :obj:`int`
+            Number of processes to use with the "numpy" ``engine``.
+
+            Default is to use all available cores.
+
+        cache : :obj:`bool`
+            Whether to store and retrieve the nucleotide content of a set of regions
+            with the "numpy" ``engine`` in a persistent cache, kept apart from the cache
+            of coverage counts and identified by the genome file and the set of regions
+            (see :func:`ngs_toolkit.utils.cache_gc_content_length`).
+
+            Default is :obj:`True`.
+
+        Raises
+        ----------
+        :obj:`ValueError`
+            If ``engine`` is not one of the available options.
 
         Returns
         -------
@@ -935,7 +1929,18 @@ class ATACSeqAnalysis(Analysis):
             Dataframe with length and GC-content of each feature.
         """
         import pybedtools
-        from ngs_toolkit.utils import bed_to_index
+        from ngs_toolkit.utils import (
+            bed_to_index,
+            cache_gc_content_length,
+            get_cached_gc_content_length,
+            get_gc_content_length,
+            read_bed_coordinates,
+        )
+
+        if engine not in ["bedtools", "numpy"]:
+            msg = "`engine` must be one of 'bedtools' or 'numpy'."
+            _LOGGER.error(msg)
+            raise ValueError(msg)
 
         if bed_file is None:
             sites = self.sites
@@ -949,13 +1954,31 @@ class ATACSeqAnalysis(Analysis):
                     self.organism, self.genome
                 )
             )
-            fasta_file = self.get_resources(steps=["genome"])["genome_file"]["fasta"]
-
-        nuc = sites.nucleotide_content(fi=fasta_file).to_dataframe(comment="#")[
-            ["score", "blockStarts"]
-        ]
-        nuc.columns = ["gc_content", "length"]
-        nuc.index = bed_to_index(sites)
+            # the numpy engine reads the 2bit file directly, without a FASTA file
+            genome_files = self.get_resources(
+                steps=["genome"], fasta=engine != "numpy")["genome_file"]
+            if (engine == "numpy") and os.path.exists(genome_files.get("2bit", "")):
+                fasta_file = genome_files["2bit"]
+            elif "fasta" in genome_files:
+                fasta_file = genome_files["fasta"]
+            else:
+                fasta_file = self.get_resources(steps=["genome"])["genome_file"]["fasta"]
+
+        if engine == "numpy":
+            sites = read_bed_coordinates(sites)
+            index = bed_to_index(sites)
+            nuc = get_cached_gc_content_length(fasta_file, index) if cache else None
+            if nuc is None:
+                nuc = get_gc_content_length(sites, fasta_file, cores=cores)
+                if cache:
+                    cache_gc_content_length(fasta_file, index, nuc)
+            nuc.index = index
+        else:
+            nuc = sites.nucleotide_content(fi=fasta_file).to_dataframe(comment="#")[
+                ["score", "blockStarts"]
+            ]
+            nuc.columns = ["gc_content", "length"]
+            nuc.index = bed_to_index(sites)
 
         # get only the sites matching the coverage (not overlapping blacklist)
         self.nuc = nuc.loc[self.matrix_raw.index]
@@ -1034,7 +2057,13 @@ class ATACSeqAnalysis(Analysis):
 
     @check_has_attributes(["sites"])
     def get_peak_gene_annotation(
-        self, tss_file=None, max_dist=100000, save=True, output_prefix="", assign=True
+        self,
+        tss_file=None,
+        max_dist=100000,
+        save=True,
+        output_prefix="",
+        assign=True,
+        engine="bedtools",
     ):
         """
         Annotates peaks with closest gene.
@@ -1049,7 +2078,9 @@ class ATACSeqAnalysis(Analysis):
             A valid BED file where the name field (4th column) identifies the gene
             and the strand column (6th column). Other fields will not be used.
 
-            Default is to get gene position annotations.
+            Default is to get gene position annotations, from the reference store
+            with the "numpy" ``engine``
+            (see :func:`ngs_toolkit.analysis.Analysis.get_reference_store`).
         max_dist : :obj:`int`, optional
             Maximum absolute distance allowed to perform associations.
             Regions with no genes within the range will have NaN values.
@@ -1067,6 +2098,18 @@ class ATACSeqAnalysis(Analysis):
             Whether to assign the DataFrames to `Attributes`.
 
             Default is :obj:`True`.
+        engine : :obj:`str`, optional
+            Engine used to find the closest TSS of each region. One of "bedtools"
+            (runs bedtools closest) or "numpy" (binary search of each region in
+            sorted arrays of TSS positions in memory, much faster for many regions).
+            Both produce the same annotation.
+
+            Default is "bedtools".
+
+        Raises
+        ----------
+        :obj:`ValueError`
+            If ``engine`` is not one of the available options.
 
         Attributes
         ----------
@@ -1084,9 +2127,18 @@ class ATACSeqAnalysis(Analysis):
             A dataframe with genes annotated for the peak set.
         """
         import pybedtools
-        from ngs_toolkit.utils import bed_to_index, get_this_file_or_timestamped
+        from ngs_toolkit.utils import (
+            _join_unique_values,
+            bed_to_index,
+            get_closest_intervals,
+            get_this_file_or_timestamped,
+            read_bed_coordinates,
+        )
 
-        cols = [6, 8, -1]  # gene_name, strand, distance
+        if engine not in ["bedtools", "numpy"]:
+            msg = "`engine` must be one of 'bedtools' or 'numpy'."
+            _LOGGER.error(msg)
+            raise ValueError(msg)
 
         if tss_file is None:
             _LOGGER.info("Reference TSS file was not given, will try to get TSS annotations.")
@@ -1095,20 +2147,52 @@ class ATACSeqAnalysis(Analysis):
                     self.organism, self.genome
                 )
             )
-            tss_file = self.get_resources(steps=["tss"])["tss_file"]
+            if engine != "numpy":
+                tss_file = self.get_resources(steps=["tss"])["tss_file"]
 
-        # extract only relevant columns
-        tss_file = get_this_file_or_timestamped(tss_file)
         if isinstance(self.sites, str):
             self.sites = pybedtools.BedTool(self.sites)
 
         # get closest TSS of each region
-        tss = pybedtools.BedTool(tss_file)
         columns = ["chrom", "start", "end", "gene_name", "strand", "distance"]
-        closest_tss_distances = self.sites.closest(tss, D="b").to_dataframe()
+        if engine == "numpy":
+            sites = read_bed_coordinates(self.sites)
+            if tss_file is None:
+                tss = self.get_reference_store().get_intervals("tss")
+            else:
+                tss = pd.read_csv(
+                    get_this_file_or_timestamped(tss_file),
+                    sep="\t",
+                    header=None,
+                    usecols=[0, 1, 2, 3, 5],
+                    names=["chrom", "start", "end", "gene_name", "strand"],
+                    dtype={"chrom": str, "start": np.int64, "end": np.int64},
+                    comment="#",
+                )
+            index, tss_index, distance = get_closest_intervals(sites, tss)
+            # regions without a TSS in the same chromosome get "." and -1 as bedtools
+            distance = np.where(tss_index == -1, -1, distance).astype(np.int64)
+            tss_values = np.append(
+                tss[["gene_name", "strand"]].values.astype(object), [[".", "."]], axis=0
+            )[tss_index]
+            closest_tss_distances = pd.DataFrame(
+                {
+                    "chrom": sites["chrom"].values[index],
+                    "start": sites["start"].values[index],
+                    "end": sites["end"].values[index],
+                    "gene_name": tss_values[:, 0],
+                    "strand": tss_values[:, 1],
+                    "distance": distance,
+                },
+                columns=columns,
+            )
+        else:
+            cols = [6, 8, -1]  # gene_name, strand, distance
+            tss = pybedtools.BedTool(get_this_file_or_timestamped(tss_file))
+            closest_tss_distances = self.sites.closest(tss, D="b").to_dataframe()
 
-        closest_tss_distances = closest_tss_distances.iloc[:, [0, 1, 2] + cols]
-        closest_tss_distances.columns = columns
+            closest_tss_distances = closest_tss_distances.iloc[:, [0, 1, 2] + cols]
+            closest_tss_distances.columns = columns
 
         # set NaN to distance without assignment (rather than the default '-1' from bedtools)
         closest_tss_distances.loc[closest_tss_distances["gene_name"] == ".", "distance"] = np.nan
@@ -1119,11 +2203,17 @@ class ATACSeqAnalysis(Analysis):
         ] = np.nan
 
         # aggregate annotation per peak, concatenate various genes (comma-separated)
-        gene_annotation = (
-            closest_tss_distances.groupby(["chrom", "start", "end"])
-            .aggregate(lambda x: ",".join(set([str(i) for i in x if i != "."])))
-            .reset_index()
-        )
+        codes = closest_tss_distances.groupby(["chrom", "start", "end"]).ngroup().values
+        _, first = np.unique(codes, return_index=True)
+        gene_annotation = closest_tss_distances.iloc[first][["chrom", "start", "end"]]
+        gene_annotation = gene_annotation.reset_index(drop=True)
+        for col in ["gene_name", "strand", "distance"]:
+            gene_annotation[col] = _join_unique_values(
+                codes,
+                closest_tss_distances[col].astype(object).map(str).values,
+                first.shape[0],
+                exclude=".",
+            )
         closest_tss_distances.index = bed_to_index(closest_tss_distances)
         gene_annotation.index = bed_to_index(gene_annotation)
 
@@ -1151,7 +2241,14 @@ class ATACSeqAnalysis(Analysis):
 
     @check_has_attributes(["organism", "genome", "sites"])
     def get_peak_genomic_location(
-        self, genomic_context_file=None, save=True, output_prefix="", assign=True
+        self,
+        genomic_context_file=None,
+        save=True,
+        output_prefix="",
+        assign=True,
+        engine="bedtools",
+        seed=None,
+        exclude=None,
     ):
         """
         Annotates a consensus peak set (``sites`` attribute of analysis) with their genomic context.
@@ -1167,7 +2264,9 @@ class ATACSeqAnalysis(Analysis):
         ----------
         genomic_context_file : :obj:`str`
             A 4 column BED file (chrom, start, end, feature), where feature is a string with the type of region.
-            If not provided will be get with the get_genomic_context function.
+            If not provided will be get with the get_genomic_context function,
+            or from the reference store with the "numpy" ``engine``
+            (see :func:`ngs_toolkit.analysis.Analysis.get_reference_store`).
         save: :obj:`bool`, optional
             Whether to write the annotated DataFrame to disk.
 
@@ -1180,6 +2279,29 @@ class ATACSeqAnalysis(Analysis):
             Whether to assign the DataFrames to `Attributes`.
 
             Default is :obj:`True`.
+        engine : :obj:`str`, optional
+            Engine used to overlap regions with the genomic context. One of "bedtools"
+            (runs bedtools intersect) or "numpy" (in memory with
+            :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.annotate_sites`).
+
+            Default is "bedtools".
+        seed : :obj:`int`, optional
+            Seed used to shuffle sites into the genome background, to make it reproducible.
+            With the "bedtools" ``engine``, giving ``seed`` or ``exclude`` shuffles sites
+            in-process (see :func:`ngs_toolkit.utils.shuffle_intervals`) instead of
+            with ``bedtools shuffle``.
+
+            Default is not to seed the shuffling.
+        exclude : {:obj:`str`, :class:`pandas.DataFrame`}, optional
+            BED file or dataframe with regions (e.g. blacklist or assembly gaps)
+            where the sites of the genome background should not be placed.
+
+            Default is not to exclude any region.
+
+        Raises
+        ----------
+        :obj:`ValueError`
+            If ``engine`` is not one of the available options.
 
         Attributes
         ----------
@@ -1198,6 +2320,11 @@ class ATACSeqAnalysis(Analysis):
 
         from ngs_toolkit.utils import bed_to_index, get_this_file_or_timestamped
 
+        if engine not in ["bedtools", "numpy"]:
+            msg = "`engine` must be one of 'bedtools' or 'numpy'."
+            _LOGGER.error(msg)
+            raise ValueError(msg)
+
         if genomic_context_file is None:
             _LOGGER.info("Reference genomic context file was not given, will try to get it.")
             _LOGGER.info(
@@ -1205,18 +2332,41 @@ class ATACSeqAnalysis(Analysis):
                     self.organism, self.genome
                 )
             )
-            genomic_context_file = self.get_resources(steps=["genomic_context"])[
-                "genomic_context_file"
-            ]
+            if engine == "numpy":
+                genomic_context = self.get_reference_store().get_intervals("genomic_context")
+            else:
+                genomic_context_file = self.get_resources(steps=["genomic_context"])[
+                    "genomic_context_file"
+                ]
+        if genomic_context_file is not None:
+            genomic_context = genomic_context_file = get_this_file_or_timestamped(
+                genomic_context_file
+            )
+
+        if engine == "numpy":
+            return self.annotate_sites(
+                layers={"genomic_region": genomic_context},
+                frac=0.2,
+                seed=seed,
+                exclude=exclude,
+                save=save,
+                output_prefix=output_prefix,
+                assign=assign,
+            )["genomic_region"]
 
-        context = pybedtools.BedTool(get_this_file_or_timestamped(genomic_context_file))
+        context = pybedtools.BedTool(genomic_context_file)
 
         if isinstance(self.sites, str):
             self.sites = pybedtools.BedTool(self.sites)
 
         # create background
         # shuffle regions in genome to create background (keep them in the same chromossome)
-        background = self.sites.shuffle(genome=self.genome, chrom=True)
+        if (seed is None) and (exclude is None):
+            background = self.sites.shuffle(genome=self.genome, chrom=True)
+        else:
+            background = pybedtools.BedTool.from_dataframe(
+                self._get_background_sites(seed=seed, exclude=exclude)[["chrom", "start", "end"]]
+            )
 
         cols = [0, 1, 2, -1]
         for label, attr, bed in [
@@ -1266,7 +2416,15 @@ class ATACSeqAnalysis(Analysis):
 
     @check_has_attributes(["organism", "genome", "sites"])
     def get_peak_chromatin_state(
-        self, chrom_state_file, frac=0.2, save=True, output_prefix="", assign=True
+        self,
+        chrom_state_file,
+        frac=0.2,
+        save=True,
+        output_prefix="",
+        assign=True,
+        engine="bedtools",
+        seed=None,
+        exclude=None,
     ):
         """
         Annotates a consensus peak set (``sites`` attribute of analysis)
@@ -1300,6 +2458,29 @@ class ATACSeqAnalysis(Analysis):
             Whether to assign the DataFrames to `Attributes`.
 
             Default is :obj:`True`.
+        engine : :obj:`str`, optional
+            Engine used to overlap regions with the chromatin states. One of "bedtools"
+            (runs bedtools intersect) or "numpy" (in memory with
+            :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.annotate_sites`).
+
+            Default is "bedtools".
+        seed : :obj:`int`, optional
+            Seed used to shuffle sites into the genome background, to make it reproducible.
+            With the "bedtools" ``engine``, giving ``seed`` or ``exclude`` shuffles sites
+            in-process (see :func:`ngs_toolkit.utils.shuffle_intervals`) instead of
+            with ``bedtools shuffle``.
+
+            Default is not to seed the shuffling.
+        exclude : {:obj:`str`, :class:`pandas.DataFrame`}, optional
+            BED file or dataframe with regions (e.g. blacklist or assembly gaps)
+            where the sites of the genome background should not be placed.
+
+            Default is not to exclude any region.
+
+        Raises
+        ----------
+        :obj:`ValueError`
+            If ``engine`` is not one of the available options.
 
         Returns
         ----------
@@ -1319,6 +2500,21 @@ class ATACSeqAnalysis(Analysis):
         import pybedtools
         from ngs_toolkit.utils import bed_to_index
 
+        if engine not in ["bedtools", "numpy"]:
+            msg = "`engine` must be one of 'bedtools' or 'numpy'."
+            _LOGGER.error(msg)
+            raise ValueError(msg)
+        if engine == "numpy":
+            return self.annotate_sites(
+                layers={"chromatin_state": chrom_state_file},
+                frac=frac,
+                seed=seed,
+                exclude=exclude,
+                save=save,
+                output_prefix=output_prefix,
+                assign=assign,
+            )["chromatin_state"]
+
         states = pybedtools.BedTool(chrom_state_file)
 
         if isinstance(self.sites, str):
@@ -1326,7 +2522,12 @@ class ATACSeqAnalysis(Analysis):
 
         # create background
         # shuffle regions in genome to create background (keep them in the same chromossome)
-        background = self.sites.shuffle(genome=self.genome, chrom=True)
+        if (seed is None) and (exclude is None):
+            background = self.sites.shuffle(genome=self.genome, chrom=True)
+        else:
+            background = pybedtools.BedTool.from_dataframe(
+                self._get_background_sites(seed=seed, exclude=exclude)[["chrom", "start", "end"]]
+            )
 
         for label, attr, bed in [
             ("real", "chrom_state_annotation", self.sites),
@@ -1380,6 +2581,211 @@ class ATACSeqAnalysis(Analysis):
                 setattr(self, attr + "_mapping", annot)
         return self.chrom_state_annotation
 
+    def _get_background_sites(self, replicates=1, seed=None, exclude=None):
+        """
+        Shuffle the sites of the analysis within their chromosomes into a genome background.
+        See :func:`ngs_toolkit.utils.shuffle_intervals`.
+        """
+        import pybedtools
+        from ngs_toolkit.utils import read_bed_coordinates, shuffle_intervals
+
+        if isinstance(self.sites, str):
+            self.sites = pybedtools.BedTool(self.sites)
+        if exclude is not None and not isinstance(exclude, pd.DataFrame):
+            exclude = read_bed_coordinates(exclude)
+        chrom_sizes = {
+            chrom: end for chrom, (_, end) in pybedtools.chromsizes(self.genome).items()
+        }
+        return shuffle_intervals(
+            read_bed_coordinates(self.sites),
+            chrom_sizes,
+            exclude=exclude,
+            replicates=replicates,
+            seed=seed,
+        )
+
+    @check_has_attributes(["organism", "genome", "sites"])
+    def annotate_sites(
+        self,
+        layers=None,
+        frac=0.2,
+        background=True,
+        replicates=1,
+        seed=None,
+        exclude=None,
+        save=True,
+        output_prefix="",
+        assign=True,
+    ):
+        """
+        Annotates a consensus peak set (``sites`` attribute of analysis) and a genome background
+        with several annotation layers at once, such as genomic context,
+        chromatin states or other tracks of features.
+
+        The sites and the background are overlapped with the features of all layers in
+        a single pass over sorted arrays in memory (:func:`ngs_toolkit.utils.annotate_intervals`).
+        Results are the same as those of
+        :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.get_peak_genomic_location` and
+        :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.get_peak_chromatin_state`.
+
+        Parameters
+        ----------
+        layers : :obj:`dict`, optional
+            Dictionary with the name of each annotation and a 4 column BED file
+            (chrom, start, end, feature), where feature is a string with the type of region,
+            or a dataframe with columns "chrom", "start", "end" and "name".
+            The names "genomic_region" and "chromatin_state" produce the attributes of
+            :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.get_peak_genomic_location` and
+            :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.get_peak_chromatin_state`
+            ("region_annotation" and "chrom_state_annotation" respectively),
+            other names produce "<name>_annotation" attributes.
+            Regions without features are reported with "." as feature,
+            except for "genomic_region" where they are not reported.
+
+            Default is to annotate the genomic context of the analysis' genome
+            from the reference store
+            (see :func:`ngs_toolkit.analysis.Analysis.get_reference_store`).
+        frac : :obj:`float`, optional
+            Minimal fraction of region to overlap with a feature.
+
+            Default is 0.2.
+        background : :obj:`bool`, optional
+            Whether to annotate also a background of sites shuffled in the same chromosomes.
+
+            Default is :obj:`True`.
+        replicates : :obj:`int`, optional
+            Number of times to shuffle the sites into the genome background.
+            If more than one, the background mappings have a "replicate" column.
+            See :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.region_context_enrichment`.
+
+            Default is 1.
+        seed : :obj:`int`, optional
+            Seed used to shuffle sites into the genome background, to make it reproducible.
+
+            Default is not to seed the shuffling.
+        exclude : {:obj:`str`, :class:`pandas.DataFrame`}, optional
+            BED file or dataframe with regions (e.g. blacklist or assembly gaps)
+            where the sites of the genome background should not be placed.
+
+            Default is not to exclude any region.
+        save: :obj:`bool`, optional
+            Whether to write the annotated DataFrames to disk.
+
+            Default is :obj:`True`.
+        output_prefix: :obj:`str`, optional
+            Prefix to add to output files when save is True.
+
+            Default is "" (empty string).
+        assign: :obj:`bool`, optional
+            Whether to assign the DataFrames to `Attributes`.
+
+            Default is :obj:`True`.
+
+        Returns
+        ----------
+        :obj:`dict`
+            Dictionary with the name of each annotation and
+            a :class:`pandas.DataFrame` with the annotation for the peak set.
+
+        Attributes
+        ----------
+        <annotation>, <annotation>_b : :class:`pandas.DataFrame`
+            A DataFrame with the annotations of the region features or of the genome background,
+            with the various features of a region concatenated with a comma.
+
+        <annotation>_mapping, <annotation>_b_mapping : :class:`pandas.DataFrame`
+            A DataFrame with one row for each feature-region mapping
+            or for the genome background.
+        """
+        import pybedtools
+        from ngs_toolkit.utils import (
+            _join_unique_values,
+            annotate_intervals,
+            bed_to_index,
+            get_this_file_or_timestamped,
+            read_bed_coordinates,
+        )
+
+        if layers is None:
+            _LOGGER.info("Annotation layers were not given, will get the genomic context.")
+            layers = {
+                "genomic_region": self.get_reference_store().get_intervals("genomic_context")
+            }
+        attributes = {
+            "genomic_region": "region_annotation",
+            "chromatin_state": "chrom_state_annotation",
+        }
+
+        if isinstance(self.sites, str):
+            self.sites = pybedtools.BedTool(self.sites)
+        sets = [("real", "", read_bed_coordinates(self.sites))]
+        if background:
+            # shuffle regions in genome to create background (keep them in the same chromossome)
+            background = self._get_background_sites(
+                replicates=replicates, seed=seed, exclude=exclude
+            )
+            sets.append(("background", "_b", background))
+        # annotate sites and background together
+        n = sets[0][2].shape[0]
+        layers = {
+            name: get_this_file_or_timestamped(f) if isinstance(f, str) else f
+            for name, f in layers.items()
+        }
+        annotations = annotate_intervals(
+            pd.concat([b[["chrom", "start", "end"]] for _, _, b in sets], ignore_index=True),
+            layers,
+            fraction=frac,
+            missing={name: "." for name in layers if name != "genomic_region"},
+        )
+
+        if output_prefix != "":
+            output_prefix += "."
+        output = dict()
+        for name, mapping in annotations.items():
+            attr = attributes.get(name, name + "_annotation")
+            for label, suffix, _ in sets:
+                annot = mapping.loc[mapping.index < n if label == "real" else mapping.index >= n]
+                if label == "background" and replicates > 1:
+                    annot = annot.assign(
+                        replicate=background["replicate"].values[annot.index.values - n]
+                    )
+                annot = annot.sort_values(["chrom", "start", "end"], kind="mergesort")
+
+                # remove duplicates (there shouldn't be anyway)
+                annot = annot.drop_duplicates()
+                annot.index = bed_to_index(annot)
+                # join various annotations per peak
+                codes = annot.groupby(["chrom", "start", "end"]).ngroup().values
+                _, first = np.unique(codes, return_index=True)
+                annot_comp = annot.iloc[first][["chrom", "start", "end"]].assign(
+                    **{name: _join_unique_values(
+                        codes, annot[name].astype(str).values, first.shape[0])}
+                )
+                # save to disk
+                if save:
+                    a = "" if (label == "real") else ("_" + label)
+                    annot.to_csv(
+                        os.path.join(
+                            self.results_dir,
+                            self.name + ".{}{}_mapping.{}csv".format(attr, a, output_prefix),
+                        ),
+                        index=True,
+                    )
+                    annot_comp.to_csv(
+                        os.path.join(
+                            self.results_dir,
+                            self.name + ".{}{}.{}csv".format(attr, a, output_prefix),
+                        ),
+                        index=True,
+                    )
+
+                if assign:
+                    setattr(self, attr + suffix, annot_comp)
+                    setattr(self, attr + suffix + "_mapping", annot)
+                if label == "real":
+                    output[name] = annot_comp
+        return output
+
     def get_sex_chrom_ratio(
         self,
         matrix="matrix_norm",
@@ -1420,6 +2826,7 @@ class ATACSeqAnalysis(Analysis):
         import seaborn as sns
         from natsort import natsorted
         from ngs_toolkit.graphics import savefig
+        from ngs_toolkit.utils import location_index_to_bed
 
         matrix = self.get_matrix(matrix)
 
@@ -1428,7 +2835,7 @@ class ATACSeqAnalysis(Analysis):
         # remove per sample mean
         matrix -= matrix.mean()
 
-        chroms = matrix.index.str.extract(r"^(.*):\d+-\d+$").iloc[:, 0].values
+        chroms = location_index_to_bed(matrix.index)["chrom"].values
         if not all([x in chroms for x in sex_chroms]):
             msg = f"Requested sex chromosomes {', '.join(sex_chroms)} not found in matrix."
             _LOGGER.error(msg)
@@ -2308,7 +3715,11 @@ class ATACSeqAnalysis(Analysis):
             Options are:
 
                 * "region_set": the consensus region_set of the analysis
-                * "genome": a randomized set of size as region_set across the genome
+                * "genome": a randomized set of size as region_set across the genome.
+                  If several backgrounds were annotated (see ``replicates`` in
+                  :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.annotate_sites`),
+                  their counts are averaged. The "universe" counts are the averages and
+                  the counts used in Fisher's exact test are the averages rounded to integers.
 
         prefix : :obj:`str`, optional
             Prefix for saved files.
@@ -2370,7 +3781,7 @@ class ATACSeqAnalysis(Analysis):
 
             # Count foreground occurences
             annot = getattr(self, matrix)
-            res = annot.loc[set(regions), step].value_counts().to_frame("foreground")
+            res = annot.loc[list(set(regions)), step].value_counts().to_frame("foreground")
 
             # Count background occurences
             # # in case of background == 'genome', we simply replace the dataframes
@@ -2380,8 +3791,13 @@ class ATACSeqAnalysis(Analysis):
                 except AttributeError:
                     _LOGGER.warning(msg2.format(matrix_b))
                     continue
+            # # average counts of several background replicates
+            n_rep = annot["replicate"].nunique() if "replicate" in annot.columns else 1
             # # account for foreground regions not annotated
-            res_b = annot.loc[:, step].value_counts().to_frame(name="universe")
+            res_b = annot.loc[:, step].value_counts()
+            if n_rep > 1:
+                res_b = res_b / n_rep
+            res_b = res_b.to_frame(name="universe")
             if not all([x in res_b.index for x in res.index]):
                 m = res.index[~res.index.isin(res_b.index)]
                 msg3 = "Foreground regions contains type of {} not in background: {}".format(
@@ -2392,7 +3808,8 @@ class ATACSeqAnalysis(Analysis):
             res = res.reindex(res_b.index)
 
             # # join
-            res = res.join(res_b, how="outer").fillna(0).astype(int)
+            res = res.join(res_b, how="outer").fillna(0)
+            res = res.astype({"foreground": int, "universe": int if n_rep == 1 else float})
 
             # Calculate log fold enrichment:
             # # normalize to total:
@@ -2402,11 +3819,15 @@ class ATACSeqAnalysis(Analysis):
                 res["foreground_fraction"] / res["universe_fraction"]
             )
             # Calculate overlap p-value:
+            rest = annot.loc[(~annot.index.isin(regions)), step].value_counts()
+            if n_rep > 1:
+                # Fisher's exact test needs counts as integers
+                rest = (rest / n_rep).round().astype(int)
             for feature in res["foreground"].index:
                 a = res.loc[feature, "foreground"]
                 b = res.loc[:, "foreground"].drop(feature).sum()
-                c = annot.loc[(~annot.index.isin(regions)), step].value_counts()[feature]
-                d = annot.loc[(~annot.index.isin(regions)), step].value_counts().drop(feature).sum()
+                c = rest[feature]
+                d = rest.drop(feature).sum()
                 res.loc[feature, "odds_ratio"], res.loc[feature, "p_value"] = fisher_exact(
                     [[a, c], [b, d]], alternative="two-sided"
                 )
@@ -2561,16 +3982,23 @@ class ATACSeqAnalysis(Analysis):
             hint = " Will not do motif enrichment analysis."
             fasta_file = os.path.join(output_dir, "{}_regions.fa".format(prefix))
 
-            resources = self.get_resources(steps=["genome"])["genome_file"]
-            if "fasta" not in resources:
+            resources = self.get_resources(steps=["genome"], fasta=False)["genome_file"]
+            # read sequences directly from the 2bit file if available
+            genome_file = resources.get("2bit")
+            if (genome_file is None) or (not os.path.exists(genome_file)):
+                genome_file = resources.get("fasta")
+            if genome_file is None:
                 reason = "Could not get genome sequence file in either FASTA or 2bit format."
                 _LOGGER.warning(reason + hint)
             else:
                 try:
                     bed_to_fasta(
-                        input_bed=bed_file, output_fasta=fasta_file, genome_file=resources["fasta"],
+                        input_bed=bed_file,
+                        output_fasta=fasta_file,
+                        genome_file=genome_file,
+                        engine="numpy",
                     )
-                except EnvironmentError:
+                except (EnvironmentError, ValueError):
                     reason = "Could not get FASTA sequence for regions."
                     _LOGGER.warning(reason + hint)
 
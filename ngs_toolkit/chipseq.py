@@ -616,7 +616,7 @@ class ChIPSeqAnalysis(ATACSeqAnalysis):
 
     def calculate_peak_support(
             self, samples=None, region_type="summits", peak_type="filtered", permissive=True,
-            comparison_table=None, peak_dir="{results_dir}/chipseq_peaks"):
+            comparison_table=None, peak_dir="{results_dir}/chipseq_peaks", cores=None):
         """
         Calculate a measure of support for each region in peak set
         (i.e. ratio of samples containing a peak overlapping region in union set of peaks).
@@ -635,48 +635,60 @@ class ChIPSeqAnalysis(ATACSeqAnalysis):
         region_type: :obj:`str`
             Not used. Provided for compatibility with ATACSeqAnalysis class.
         permissive: :obj:`bool`
-            Not used. Provided for compatibility with ATACSeqAnalysis class.
+            Whether peak files which do not exist or cannot be read
+            should be skipped or an error thrown.
+        cores : :obj:`int`, optional
+            Number of processes to count the peaks of comparisons and peak callers in.
+
+            Defaults to all available cores.
 
         Attributes
         ----------
         support : :obj:`pandas.DataFrame`
             DataFrame with signal/background combinations used to call peaks
         """
-        import pybedtools
-        from tqdm import tqdm
-        from ngs_toolkit.utils import bed_to_index
+        import parmap
+        from ngs_toolkit.utils import bed_to_index, count_interval_overlaps, read_bed_coordinates
 
         if comparison_table is None:
             comparison_table = self.comparison_table
 
         peak_dir = os.path.abspath(self._format_string_with_attributes(peak_dir))
 
-        # get index
-        index = bed_to_index(self.sites.to_dataframe())
+        sites = read_bed_coordinates(self.sites)
+        index = bed_to_index(sites)
 
         # calculate support (number of samples overlaping each merged peak)
-        support = pd.DataFrame(index=index)
-        for name, comp in tqdm(self.comparisons.items(), total=len(self.comparisons), desc="Comparison"):
+        columns = list()
+        peaks = list()
+        for name, comp in self.comparisons.items():
             for peak_caller, peak_file in comp['peak_calls'][peak_type].items():
                 try:
-                    sample_support = self.sites.intersect(peak_file, wa=True, c=True).to_dataframe()
-                except (
-                    ValueError,
-                    pybedtools.MalformedBedLineError,
-                    pybedtools.helpers.BEDToolsError,
-                ):
+                    peaks.append(read_bed_coordinates(peak_file))
+                except (IOError, ValueError):
                     _LOGGER.warning(
-                        "Peaks for comparison %s (%s) not found!", (name, peak_file))
+                        "Peaks for comparison %s (%s) not found!", name, peak_file)
                     if permissive:
                         continue
                     else:
                         raise
-                sample_support.index = index
-                support[(name, peak_caller)] = sample_support.iloc[:, 3]
+                columns.append((name, peak_caller))
+        res = parmap.starmap(
+            count_interval_overlaps,
+            [(sites, p) for p in peaks],
+            pm_processes=cores,
+            pm_parallel=True,
+        )
+        counts = np.empty((sites.shape[0], len(columns)), dtype=np.int64)
+        for i, c in enumerate(res):
+            counts[:, i] = c
+        del res
 
         # Make multiindex labeling comparisons and peak type
-        support.columns = pd.MultiIndex.from_tuples(
-            support.columns, names=["comparison", "peak_caller"]
+        support = pd.DataFrame(
+            counts,
+            index=index,
+            columns=pd.MultiIndex.from_tuples(columns, names=["comparison", "peak_caller"]),
         )
         support.to_csv(
             os.path.join(
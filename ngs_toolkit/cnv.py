@@ -9,7 +9,7 @@ import pandas as pd
 from ngs_toolkit import _LOGGER
 from ngs_toolkit.analysis import Analysis
 from ngs_toolkit.decorators import check_has_attributes
-from ngs_toolkit.utils import warn_or_raise
+from ngs_toolkit.utils import location_index_to_bed, warn_or_raise
 
 from ngs_toolkit.demo.data_generator import DEFAULT_CNV_RESOLUTIONS
 
@@ -670,7 +670,7 @@ class CNVAnalysis(Analysis):
             names = [s.name for s in samples if s.name in matrix[resolution].columns]
             to_plot = matrix[resolution].loc[:, names]
 
-            to_plot["chr"] = list(map(lambda x: x[0], to_plot.index.str.split(":")))
+            to_plot["chr"] = location_index_to_bed(to_plot.index)["chrom"].values
 
             for label, function in tqdm([("variation", np.std), ("mean", np.mean)], desc="metric"):
                 prefix = os.path.join(
@@ -778,12 +778,9 @@ class CNVAnalysis(Analysis):
 
         segmentation = dict()
         for resolution in tqdm(resolutions, desc="Resolution"):
-            chrom = np.array(list(map(lambda x: x[0], matrix[resolution].index.str.split(":"))))
-            start = np.array(
-                list(
-                    map(lambda x: int(x[1].split("-")[0]), matrix[resolution].index.str.split(":"),)
-                )
-            )
+            bed = location_index_to_bed(matrix[resolution].index)
+            chrom = bed["chrom"].values.astype(str)
+            start = bed["start"].values
             names = [s.name for s in samples if s.name in matrix[resolution].columns]
             df = matrix[resolution].reindex(names, axis=1)
 
@@ -1081,9 +1078,10 @@ def to_igv(matrix, output_file=None, save=True, view_limits=(-2, 2)):
 
     # as IGV file
     igv = pd.DataFrame(index=matrix.index)
-    igv.loc[:, "Chromosome"] = list(map(lambda x: x[0], matrix.index.str.split(":")))
-    igv.loc[:, "Start"] = list(map(lambda x: int(x[1].split("-")[0]), matrix.index.str.split(":")))
-    igv.loc[:, "End"] = list(map(lambda x: int(x[1].split("-")[1]), matrix.index.str.split(":")))
+    bed = location_index_to_bed(matrix.index)
+    igv["Chromosome"] = bed["chrom"].values
+    igv["Start"] = bed["start"].values
+    igv["End"] = bed["end"].values
     igv.loc[:, "Name"] = igv.index
 
     igv = igv.join(matrix).reset_index(drop=True)
@@ -19,6 +19,7 @@ def get_genome_reference(
     file_format="2bit",
     dry_run=False,
     overwrite=True,
+    convert=True,
 ):
     """
     Get genome FASTA/2bit file.
@@ -47,6 +48,12 @@ def get_genome_reference(
         Otherwise they will be kept and no action is made.
         Defaults to :obj:`True`.
 
+    convert: :obj:`bool`, optional
+        Whether to convert a 2bit file to FASTA format with ``twoBitToFa``.
+        Not needed to read sequences with :class:`ngs_toolkit.utils.GenomeSequence`,
+        which reads 2bit files directly.
+        Defaults to :obj:`True`.
+
     Returns
     -------
     {str, tuple}
@@ -187,7 +194,7 @@ def get_genome_reference(
         hint = " Returning existing file: {}".format(genome_file)
         _LOGGER.warning(msg + hint)
         # even so, if 2bit and FASTA not there try to get fasta
-        if file_format == "2bit":
+        if (file_format == "2bit") and convert:
             if not os.path.exists(genome_file.replace(".2bit", ".fa")):
                 twobit_to_fasta(genome_file)
         return genome_file
@@ -201,7 +208,8 @@ def get_genome_reference(
     else:
         if not dry_run:
             download_file(url, genome_file)
-            twobit_to_fasta(genome_file)
+            if convert:
+                twobit_to_fasta(genome_file)
             return genome_file
 
     return (url, genome_file)
@@ -4,6 +4,9 @@
 A helper script to calculate the read coverage of a BAM file
 in regions from a BED file.
 Ensures the same order and number of lines as input BED file.
+Output is either a BED file with counts in the fourth column or
+a binary file with counts in the order of the input BED file
+and a hash of its regions.
 
 Software requirements:
 
@@ -18,8 +21,10 @@ from argparse import ArgumentParser
 import pandas as pd
 
 from ngs_toolkit.utils import count_reads_in_intervals
+from ngs_toolkit.utils import count_reads_in_intervals_parallel
 from ngs_toolkit.utils import read_bed_file_three_columns
 from ngs_toolkit.utils import to_bed_index
+from ngs_toolkit.utils import write_coverage_array
 
 
 def parse_arguments():
@@ -34,16 +39,101 @@ def parse_arguments():
     )
     parser.add_argument(
         dest="bam_file",
-        help="Input BAM file with reads.",
+        help="Input BAM or CRAM file with reads.",
     )
     parser.add_argument(
         dest="output_bed", help="Output BED file with counts for each region."
     )
+    parser.add_argument(
+        "--output-format",
+        dest="output_format",
+        default="bed",
+        choices=["bed", "binary"],
+        help="Format of output file. "
+        "'bed' writes a BED file with counts in the fourth column, "
+        "'binary' writes counts as unsigned 32-bit integers with a header "
+        "containing a hash of the regions. "
+        "Default is 'bed'."
+    )
     parser.add_argument(
         "--no-overwrite", action="store_false",
         dest="overwrite",
         help="Whether results should not be overwritten if existing."
     )
+    parser.add_argument(
+        "--engine",
+        dest="engine",
+        default="count",
+        choices=["count", "sweep"],
+        help="Engine used to count reads. "
+        "'count' queries the BAM index once per region, "
+        "'sweep' reads each chromosome once and is faster for many regions. "
+        "Default is 'count'."
+    )
+    parser.add_argument(
+        "--count-mode",
+        dest="count_mode",
+        default="reads",
+        choices=["reads", "fragments", "cutsites"],
+        help="What to count in each region. "
+        "'reads' counts reads overlapping regions, "
+        "'fragments' counts read pairs overlapping regions once, "
+        "'cutsites' counts Tn5 insertion sites (read ends shifted +4/-5 bp) in regions. "
+        "Modes other than 'reads' always use the 'sweep' engine. "
+        "Default is 'reads'."
+    )
+    parser.add_argument(
+        "--cores",
+        dest="cores",
+        default=None,
+        type=int,
+        help="Number of processes to split the counting by chromosome into. "
+        "Default is to use a single process."
+    )
+    parser.add_argument(
+        "--reference",
+        dest="reference",
+        default=None,
+        help="Reference genome FASTA file to decode CRAM files. "
+        "Not needed if the reference cache of ngs_toolkit was set up "
+        "and its location is in the REF_CACHE environment variable."
+    )
+    parser.add_argument(
+        "--min-mapq",
+        dest="min_mapq",
+        default=None,
+        type=int,
+        help="Minimum mapping quality of reads to count."
+    )
+    parser.add_argument(
+        "--include-flags",
+        dest="include_flags",
+        default=None,
+        type=int,
+        help="SAM flag bits which must all be set in reads to count."
+    )
+    parser.add_argument(
+        "--exclude-flags",
+        dest="exclude_flags",
+        default=None,
+        type=int,
+        help="SAM flag bits which must all be unset in reads to count."
+    )
+    parser.add_argument(
+        "--skip-duplicates",
+        action="store_true",
+        dest="skip_duplicates",
+        help="Whether reads marked as duplicates should not be counted."
+    )
+    parser.add_argument(
+        "--fragment-length",
+        dest="fragment_length",
+        default=None,
+        nargs=2,
+        type=int,
+        metavar=("MIN", "MAX"),
+        help="Minimum and maximum absolute template length of reads to count."
+    )
     return parser
 
 
@@ -59,7 +149,27 @@ def main(cli=None):
     print("Getting regions.")
     sites_str = to_bed_index(args.bed_file)
     print("Quantifying.")
-    res = count_reads_in_intervals(args.bam_file, sites_str)
+    read_filters = {
+        k: getattr(args, k)
+        for k in ["min_mapq", "include_flags", "exclude_flags", "skip_duplicates", "fragment_length"]
+        if getattr(args, k) not in [None, False]
+    }
+    as_array = args.output_format == "binary"
+    if args.cores is None:
+        res = count_reads_in_intervals(
+            args.bam_file, sites_str, engine=args.engine, as_array=as_array,
+            read_filters=read_filters, count_mode=args.count_mode, reference=args.reference)
+    else:
+        res = count_reads_in_intervals_parallel(
+            [args.bam_file], sites_str, cores=args.cores, compact=as_array, engine=args.engine,
+            read_filters=read_filters, count_mode=args.count_mode, reference=args.reference,
+        )[0]
+
+    if as_array:
+        print("Saving results.")
+        write_coverage_array(res, sites_str, args.output_bed)
+        print("Done.")
+        return
 
     print("Merging with input set.")
     # make sure there is an entry for each region in input file
@@ -7,6 +7,9 @@ derived from several samples.
 A consensus region set can be passed, otherwise it will either try to use an
 existing one for that analysis or produce one on the fly.
 
+FRiP can also be computed without additional jobs while quantifying coverage
+with :func:`ngs_toolkit.atacseq.ATACSeqAnalysis.measure_coverage` and ``frip=True``.
+
 
 Software requirements:
 
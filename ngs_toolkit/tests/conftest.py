@@ -131,6 +131,7 @@ def has_R_library(library):
 
 RPY2 = has_module("rpy2")
 COMBAT = has_module("combat")
+PYBIGWIG = has_module("pyBigWig")
 STAP = has_module("STAP")
 DNACOPY = has_module("DNAcopy")
 PREPROCESSCORE = has_R_library("preprocessCore")
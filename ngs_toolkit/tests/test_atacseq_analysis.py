@@ -49,6 +49,45 @@ def test_coverage_matrix_loading(various_analysis):
         assert analysis.matrix_raw.dtypes.all() == int
 
 
+def test_region_index(various_analysis):
+    from ngs_toolkit.utils import location_index_to_bed, to_region_index
+
+    for analysis in various_analysis:
+        matrix = analysis.matrix_raw
+        index = to_region_index(matrix.index)
+
+        assert index.tolist() == matrix.index.tolist()
+        assert index.nbytes < matrix.index.memory_usage(deep=True)
+        bed = location_index_to_bed(matrix.index)
+        assert (index.values.chrom == bed["chrom"].values).all()
+        assert (index.values.start == bed["start"].values).all()
+        assert (index.values.end == bed["end"].values).all()
+        assert (to_region_index(bed).values == index.values).all()
+
+        m = matrix.copy()
+        m.index = index
+        assert (m.loc[matrix.index[:10]].values == matrix.iloc[:10].values).all()
+        assert (m.reindex(matrix.index[::-1]).values == matrix.iloc[::-1].values).all()
+        for i in [0, len(index) // 2, -1]:
+            assert index.get_loc(matrix.index[i]) == np.arange(len(index))[i]
+            assert (m.loc[matrix.index[i]].values == matrix.iloc[i].values).all()
+        assert "chrNA:1-2" not in index
+        assert m.to_csv() == matrix.to_csv()
+
+
+def test_location_index_parsing(various_analysis):
+    from ngs_toolkit.utils import bed_to_index, bedtool_to_index, location_index_to_bed
+
+    for analysis in various_analysis:
+        index = analysis.matrix_raw.index
+        bed = location_index_to_bed(index)
+        assert bed.index.equals(index)
+        assert (bed["start"] < bed["end"]).all()
+        assert location_index_to_bed(index).equals(bed)
+        assert bed_to_index(bed).equals(index)
+        assert bedtool_to_index(analysis.sites) == bed_to_index(analysis.sites).tolist()
+
+
 def test_set_consensus_set(various_analysis):
     for analysis in various_analysis:
         peaks = os.path.join(
@@ -142,6 +181,124 @@ def test_cqn_normalization(atac_analysis):
     assert file_exists_and_not_empty(file)
 
 
+def test_get_peak_gccontent_length_numpy_engine(tmp_path, monkeypatch):
+    from ngs_toolkit.utils import bed_to_index, inspect_coverage_cache
+
+    # keep the caches of the user untouched
+    for cache in ["nucleotide_content_cache", "coverage_cache"]:
+        monkeypatch.setitem(
+            _CONFIG["preferences"], cache, {"location": str(tmp_path / cache)})
+    rng = np.random.default_rng(0)
+    genome = {c: "".join(rng.choice(list("ACGTNacgt"), 5000)) for c in ["chr1", "chr2"]}
+    fasta = str(tmp_path / "genome.fa")
+    with open(fasta, "w") as handle:
+        for chrom, seq in genome.items():
+            handle.write(">" + chrom + "\n")
+            handle.write("\n".join(seq[i : i + 60] for i in range(0, len(seq), 60)) + "\n")
+
+    start = rng.integers(0, 4800, 100)
+    sites = pd.DataFrame(
+        {"chrom": rng.choice(list(genome), 100), "start": start,
+         "end": start + rng.integers(1, 200, 100)}
+    ).drop_duplicates()
+    an = ATACSeqAnalysis(name="gc", root_dir=str(tmp_path), results_dir=str(tmp_path))
+    an.organism, an.genome = "human", "hg38"
+    an.sites = pybedtools.BedTool.from_dataframe(sites)
+    an.matrix_raw = pd.DataFrame(1, index=bed_to_index(sites), columns=["s"])
+
+    nuc = an.get_peak_gccontent_length(fasta_file=fasta, engine="numpy", cores=1)
+    expected = [
+        sum(b in "GCgc" for b in genome[c][s:e]) / (e - s)
+        for c, s, e in sites.itertuples(index=False)
+    ]
+    assert nuc.index.equals(an.matrix_raw.index)
+    assert np.allclose(nuc["gc_content"], expected)
+    assert (nuc["length"] == (sites["end"] - sites["start"]).values).all()
+    cached = an.get_peak_gccontent_length(fasta_file=fasta, engine="numpy", cores=1)
+    assert cached.equals(nuc)
+    assert len(os.listdir(tmp_path / "nucleotide_content_cache")) == 1
+    # not stored with the coverage counts
+    assert inspect_coverage_cache().empty
+
+    with pytest.raises(ValueError):
+        an.get_peak_gccontent_length(fasta_file=fasta, engine="other")
+
+
+def test_bed_to_fasta_numpy_engine(tmp_path):
+    import struct
+    from ngs_toolkit.utils import GenomeSequence, bed_to_fasta, get_gc_content_length
+
+    rng = np.random.default_rng(0)
+    genome = {
+        "chr1": "".join(rng.choice(list("ACGTacgt"), 1001)) + "N" * 50 + "acgtACGT" * 20,
+        "chr2": "".join(rng.choice(list("ACGTNacgtn"), 333)),
+    }
+    fasta = str(tmp_path / "genome.fa")
+    with open(fasta, "w") as handle:
+        for chrom, seq in genome.items():
+            handle.write(">" + chrom + "\n")
+            handle.write("\n".join(seq[i : i + 50] for i in range(0, len(seq), 50)) + "\n")
+
+    # write 2bit file
+    def blocks(mask):
+        diff = np.diff(np.concatenate([[0], mask.astype(int), [0]]))
+        starts = np.flatnonzero(diff == 1)
+        return [len(starts)] + starts.tolist() + (np.flatnonzero(diff == -1) - starts).tolist()
+
+    records = list()
+    for chrom, seq in genome.items():
+        bases = np.frombuffer(seq.upper().encode(), dtype=np.uint8)
+        codes = np.zeros(len(seq) + -len(seq) % 4, dtype=np.uint8)
+        codes[: len(seq)] = np.searchsorted(np.frombuffer(b"ACGT", np.uint8), bases) % 4
+        codes = np.array([2, 1, 3, 0], dtype=np.uint8)[codes]
+        packed = codes[0::4] << 6 | codes[1::4] << 4 | codes[2::4] << 2 | codes[3::4]
+        values = [len(seq)] + blocks(bases == ord("N"))
+        values += blocks(np.array([b.islower() for b in seq])) + [0]
+        records.append(struct.pack("<{}I".format(len(values)), *values) + packed.tobytes())
+    offset = 16 + sum(len(chrom) + 5 for chrom in genome)
+    twobit = struct.pack("<4I", 0x1A412743, 0, len(genome), 0)
+    for chrom, record in zip(genome, records):
+        twobit += struct.pack("<B", len(chrom)) + chrom.encode() + struct.pack("<I", offset)
+        offset += len(record)
+    twobit_file = str(tmp_path / "genome.2bit")
+    with open(twobit_file, "wb") as handle:
+        handle.write(twobit + b"".join(records))
+
+    start = rng.integers(0, 1100, 200)
+    bed = pd.DataFrame(
+        {"chrom": rng.choice(list(genome), 200), "start": start,
+         "end": start + rng.integers(0, 150, 200), "name": ".", "score": 0,
+         "strand": rng.choice(["+", "-"], 200)}
+    )
+    bed_file = str(tmp_path / "regions.bed")
+    bed.to_csv(bed_file, sep="\t", header=False, index=False)
+    complement = str.maketrans("ACGTNacgtn", "TGCANtgcan")
+    expected = [
+        genome[c][s:e][::-1].translate(complement) if strand == "-" else genome[c][s:e]
+        for c, s, e, strand in bed[["chrom", "start", "end", "strand"]].itertuples(index=False)
+    ]
+
+    for genome_file in [fasta, twobit_file]:
+        reader = GenomeSequence(genome_file)
+        assert reader.chrom_sizes == {k: len(v) for k, v in genome.items()}
+        assert reader.fetch_intervals(bed, bed["strand"] == "-", batch_size=100) == expected
+
+        output = str(tmp_path / "regions.fa")
+        bed_to_fasta(bed_file, output, genome_file, engine="numpy", reverse_complement=True)
+        with open(output) as handle:
+            lines = handle.read().splitlines()
+        assert lines[1::2] == expected
+        assert lines[0] == ">{}:{}-{}".format(*bed.iloc[0, :3])
+
+        gc = get_gc_content_length(bed, genome_file, cores=1)
+        assert (gc["length"] == bed["end"] - bed["start"]).all()
+        counts = [sum(b in "GCgc" for b in x) for x in expected]
+        assert np.allclose(gc["gc_content"].fillna(0) * gc["length"], counts)
+
+    with pytest.raises(ValueError):
+        bed_to_fasta(bed_file, output, twobit_file, engine="other")
+
+
 def test_pca_normalization(atac_analysis):
     qnorm = atac_analysis.normalize_pca(pc=1)
     assert hasattr(atac_analysis, "matrix_norm")
@@ -235,6 +392,120 @@ def test_get_peak_gene_annotation(atac_analysis):
     assert annot.shape[0] >= len(atac_analysis.sites)
 
 
+def test_get_peak_gene_annotation_numpy_engine(atac_analysis):
+    annot = atac_analysis.get_peak_gene_annotation(max_dist=1e10, save=False)
+    closest = atac_analysis.closest_tss_distances
+    annot2 = atac_analysis.get_peak_gene_annotation(max_dist=1e10, save=False, engine="numpy")
+    closest2 = atac_analysis.closest_tss_distances
+
+    cols = ["gene_name", "strand", "distance"]
+    assert closest.index.equals(closest2.index)
+    assert (closest[cols].astype(str).values == closest2[cols].astype(str).values).all()
+    assert annot.index.equals(annot2.index)
+    for col in cols:
+        for a, b in zip(annot[col], annot2[col]):
+            assert set(a.split(",")) == set(b.split(","))
+
+    with pytest.raises(ValueError):
+        atac_analysis.get_peak_gene_annotation(save=False, engine="pandas")
+
+
+def test_reference_store(tmp_path):
+    from ngs_toolkit.utils import ReferenceStore
+
+    rng = np.random.default_rng(0)
+    start = rng.integers(0, 10000, 100)
+    context = pd.DataFrame(
+        {"chrom": rng.choice(["chr1", "chr2"], 100), "start": start, "end": start + 500,
+         "name": rng.choice(["exon", "intron", "promoter"], 100)}
+    )
+    tss = context.iloc[:20, :3].assign(
+        end=lambda x: x["start"] + 1, gene_name=["gene{}".format(i) for i in range(20)],
+        strand=rng.choice(["+", "-"], 20),
+    )
+    an = ATACSeqAnalysis(name="ref", results_dir=str(tmp_path))
+    an.organism, an.genome, an.root_dir = "human", "hg38", str(tmp_path)
+    os.makedirs(os.path.join(str(tmp_path), "reference"))
+    store_file = os.path.join(str(tmp_path), "reference", "human.hg38.reference_store.npz")
+    ReferenceStore.write(
+        store_file,
+        {"blacklist": context.iloc[:0, :3], "tss": tss, "genomic_context": context},
+        chrom_sizes={"chr1": 20000, "chr2": 20000, "chr3": 100},
+    )
+
+    store = an.get_reference_store()
+    assert store is an.get_reference_store()
+    assert store.chrom_sizes == {"chr1": 20000, "chr2": 20000, "chr3": 100}
+    assert store.get_intervals("blacklist").empty
+    intervals = store.get_intervals("genomic_context")
+    expected = context.sort_values(["chrom", "start", "end"]).reset_index(drop=True)
+    assert (intervals[["chrom", "start", "end"]] == expected[["chrom", "start", "end"]]).all().all()
+    assert sorted(map(tuple, intervals.values)) == sorted(map(tuple, context.values))
+    chr2 = store.get_intervals("tss", chrom="chr2")
+    assert (chr2["chrom"] == "chr2").all() and chr2["start"].is_monotonic_increasing
+    assert chr2.shape[0] == (tss["chrom"] == "chr2").sum()
+    assert store.get_intervals("tss", chrom="chr3").empty
+    with pytest.raises(ValueError):
+        store.get_intervals("chromatin_state")
+
+    # analysis steps use the store by default with the numpy engine
+    an.sites = pybedtools.BedTool.from_dataframe(context.iloc[:, :3].drop_duplicates())
+    annot = an.get_peak_gene_annotation(max_dist=1e10, save=False, engine="numpy")
+    assert set(annot["gene_name"].str.split(",").sum()) <= set(tss["gene_name"])
+    regions = an.annotate_sites(background=False, save=False)["genomic_region"]
+    assert set(regions["genomic_region"].str.split(",").sum()) <= set(context["name"])
+
+
+def test_annotate_sites(atac_analysis):
+    context = atac_analysis.get_resources(steps=["genomic_context"])["genomic_context_file"]
+    annot = atac_analysis.get_peak_genomic_location(save=False)
+    states = atac_analysis.get_peak_chromatin_state(context, save=False)
+
+    # several layers at once, as with the numpy engine of each method
+    out = atac_analysis.annotate_sites(
+        layers={"genomic_region": context, "chromatin_state": context, "track": context},
+        save=False,
+    )
+    for a, b, col in [
+        (annot, out["genomic_region"], "genomic_region"),
+        (states, out["chromatin_state"], "chromatin_state"),
+        (states, out["track"], "track"),
+    ]:
+        assert a.index.equals(b.index)
+        for x, y in zip(a.iloc[:, -1], b[col]):
+            assert set(x.split(",")) == set(y.split(","))
+    assert hasattr(atac_analysis, "region_annotation_b_mapping")
+    assert hasattr(atac_analysis, "track_annotation_mapping")
+
+    annot2 = atac_analysis.get_peak_genomic_location(save=False, engine="numpy")
+    assert annot.index.equals(annot2.index)
+
+
+def test_shuffled_background(atac_analysis):
+    from ngs_toolkit.utils import count_interval_overlaps, read_bed_coordinates
+
+    sites = read_bed_coordinates(atac_analysis.sites)
+    exclude = sites.iloc[::2]
+    b1 = atac_analysis._get_background_sites(replicates=3, seed=1, exclude=exclude)
+    b2 = atac_analysis._get_background_sites(replicates=3, seed=1, exclude=exclude)
+    assert b1.equals(b2)
+    assert b1.shape[0] == 3 * sites.shape[0]
+    assert (b1["chrom"].values == np.tile(sites["chrom"].values, 3)).all()
+    lengths = (sites["end"] - sites["start"]).values
+    assert ((b1["end"] - b1["start"]).values == np.tile(lengths, 3)).all()
+    assert (count_interval_overlaps(b1, exclude) == 0).all()
+
+    atac_analysis.annotate_sites(replicates=3, seed=1, save=False)
+    mapping = atac_analysis.region_annotation_b_mapping
+    assert set(mapping["replicate"]) <= {0, 1, 2}
+    enr = atac_analysis.region_context_enrichment(
+        atac_analysis.region_annotation_mapping.index[:50].tolist(),
+        steps=["genomic_region"],
+        background="genome",
+    )
+    assert isinstance(enr, pd.DataFrame)
+
+
 def test_get_peak_genomic_location(atac_analysis):
     reference_dir = ATACSeqAnalysis._format_string_with_environment_variables(
         _CONFIG["preferences"]["root_reference_dir"]
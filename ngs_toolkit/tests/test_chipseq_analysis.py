@@ -64,3 +64,42 @@ def test_get_supported_peaks(chipseq_analysis_with_peaks):
 def test_normalize_by_background(chipseq_analysis_with_peaks):
     chipseq_analysis_with_peaks.test_normalize_by_background()
     assert False
+
+
+def test_calculate_peak_support_counts(chipseq_analysis_with_peaks):
+    import pandas as pd
+
+    an = chipseq_analysis_with_peaks
+    an.calculate_peak_support(cores=1)
+
+    sites = an.sites.to_dataframe()
+    for name, comp in an.comparisons.items():
+        for peak_caller, peak_file in comp["peak_calls"]["filtered"].items():
+            if (name, peak_caller) not in an.support.columns:
+                continue
+            peaks = pd.read_csv(peak_file, sep="\t", header=None)
+            expected = [
+                ((peaks[0] == s.chrom) & (peaks[1] < s.end) & (peaks[2] > s.start)).sum()
+                for s in sites.itertuples()
+            ]
+            assert (an.support[(name, peak_caller)].values == expected).all()
+    assert ((an.support["support"] >= 0) & (an.support["support"] <= 1)).all()
+
+
+def test_calculate_peak_support_missing_peaks(chipseq_analysis_with_peaks):
+    import os
+
+    an = chipseq_analysis_with_peaks
+    # remove the first peak file to be read
+    name, comp = next(iter(an.comparisons.items()))
+    peak_caller, peak_file = next(iter(comp["peak_calls"]["filtered"].items()))
+    os.remove(peak_file)
+
+    with pytest.raises(IOError):
+        an.calculate_peak_support(permissive=False)
+
+    an.calculate_peak_support(permissive=True)
+    assert (name, peak_caller) not in an.support.columns
+    assert an.support.shape[0] == len(an.sites)
+    assert file_exists_and_not_empty(
+        os.path.join(an.results_dir, an.name + "_peaks.support.csv"))
@@ -89,6 +89,28 @@ def test_coverage(tmp_path, atac_analysis_with_input_files):
     assert pd.read_csv(output, sep="\t", header=None).shape[1] == 4
 
 
+def test_coverage_binary(tmp_path, atac_analysis_with_input_files):
+    from ngs_toolkit.utils import read_coverage_array, to_bed_index
+
+    region_set = atac_analysis_with_input_files.sites.fn
+    sample = atac_analysis_with_input_files.samples[0]
+    output_bed = os.path.join(tmp_path, "output.bed")
+    output_bin = os.path.join(tmp_path, "output.bin")
+
+    for output, fmt in [(output_bed, "bed"), (output_bin, "binary")]:
+        cmd = ("{} -m ngs_toolkit.recipes.coverage --output-format {} {} {} {}").format(
+            sys.executable, fmt, region_set, sample.aligned_filtered_bam, output
+        )
+        p = subprocess.Popen(cmd.split(" "))
+        o = p.communicate()
+        assert o == (None, None)
+        assert file_exists_and_not_empty(output)
+
+    bed = pd.read_csv(output_bed, sep="\t", header=None)
+    counts = read_coverage_array(output_bin, intervals=to_bed_index(region_set))
+    assert (bed.iloc[:, 3].values == counts).all()
+
+
 def test_enrichr_good(tmp_path):
     genes = ["PAX5", "SOX2"]
     input_file = os.path.join(tmp_path, "genes.txt")
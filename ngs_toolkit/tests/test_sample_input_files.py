@@ -3,10 +3,11 @@
 
 import os
 
+import numpy as np
 import pandas as pd
 import pytest
 
-from .conftest import file_exists_and_not_empty
+from .conftest import file_exists_and_not_empty, PYBIGWIG
 from ngs_toolkit.utils import get_this_file_or_timestamped
 
 
@@ -32,6 +33,97 @@ def test_has_summit_files(a):
     assert all(v)
 
 
+class Test_get_consensus_sites:
+    @pytest.mark.parametrize("region_type", ["summits", "peaks"])
+    def test_numpy_engine(self, a, region_type):
+        import pybedtools
+
+        blacklist = os.path.join(a.results_dir, "blacklist.bed")
+        pybedtools.BedTool(a.samples[0].peaks).to_dataframe().iloc[::3, :3].to_csv(
+            blacklist, sep="\t", header=False, index=False)
+
+        for kwargs in [
+            dict(blacklist_bed=False),
+            dict(blacklist_bed=blacklist),
+            dict(blacklist_bed=blacklist, filter_chroms=["chr1"]),
+            dict(blacklist_bed=blacklist, filter_chroms=".*_.*|chrM"),
+        ]:
+            s1 = a.get_consensus_sites(
+                region_type=region_type, save=False, assign=False, **kwargs)
+            s2 = a.get_consensus_sites(
+                region_type=region_type, save=False, assign=False, engine="numpy", **kwargs)
+            assert s1.to_dataframe().equals(s2.to_dataframe())
+
+        with pytest.raises(ValueError):
+            a.get_consensus_sites(save=False, assign=False, engine="pandas")
+
+    def test_fixed_width(self, a):
+        from ngs_toolkit.utils import count_interval_overlaps
+
+        # 1 bp summits with name and score columns as in MACS2 summit files
+        for s in a.samples:
+            summits = pd.read_csv(s.summits, sep="\t", header=None, usecols=[0, 1])
+            summits[2] = summits[1] + 1
+            summits[3] = ["peak_{}".format(i) for i in range(summits.shape[0])]
+            summits[4] = np.random.uniform(2, 100, summits.shape[0]).round(5)
+            summits.to_csv(s.summits, sep="\t", header=False, index=False)
+
+        extension = 100
+        sites = a.get_consensus_sites(
+            region_type="fixed_width", extension=extension, blacklist_bed=False,
+            save=False, assign=False).to_dataframe()
+        assert ((sites["end"] - sites["start"]) == 2 * extension + 1).all()
+        # sites do not overlap each other
+        assert (count_interval_overlaps(sites, sites) == 1).all()
+
+        # sites are centered on summits and the best summit is kept
+        summits = pd.concat(
+            [pd.read_csv(s.summits, sep="\t", header=None, usecols=[0, 1, 4]) for s in a.samples])
+        summits.columns = ["chrom", "start", "score"]
+        centers = sites.assign(start=sites["start"] + extension)[["chrom", "start"]]
+        assert centers.merge(summits).drop_duplicates(["chrom", "start"]).shape[0] == sites.shape[0]
+        best = summits.sort_values("score").iloc[-1]
+        assert ((centers["chrom"] == best["chrom"]) & (centers["start"] == best["start"])).any()
+
+
+class Test_update_consensus_sites:
+    def test_update(self, a):
+        from ngs_toolkit.utils import bed_to_index
+
+        full = a.get_consensus_sites(
+            blacklist_bed=False, save=False, assign=False, engine="numpy")
+        a.get_consensus_sites(
+            samples=a.samples[:2], blacklist_bed=False, save=False, engine="numpy")
+        old = bed_to_index(a.sites.to_dataframe())
+        a.measure_coverage(compact=True, save=False)
+        a.calculate_peak_support()
+
+        sites = a.update_consensus_sites(
+            a.samples[2:], blacklist_bed=False, save=False, compact=True)
+        assert sites.to_dataframe().equals(full.to_dataframe())
+        assert a.site_mapping.index.equals(old)
+        assert a.site_mapping.isin(bed_to_index(full.to_dataframe())).all()
+
+        # carried over and recounted values match quantifying the updated sites
+        matrix_raw = a.measure_coverage(compact=True, save=False, assign=False)
+        assert (a.matrix_raw.values == matrix_raw.values).all()
+        support = a.support
+        cols = [s.name for s in a.samples] + ["support"]
+        assert (support[cols].values == a.calculate_peak_support()[cols].values).all()
+
+
+class Test_calculate_peak_support:
+    def test_overlap_counts(self, a):
+        support = a.calculate_peak_support(cores=2)
+
+        for s in a.samples:
+            c = a.sites.intersect(s.summits, wa=True, c=True).to_dataframe()
+            assert (support[s.name].values == c.iloc[:, -1].values).all()
+        assert (
+            support["support"] == (support[[s.name for s in a.samples]] > 0).mean(axis=1)
+        ).all()
+
+
 class Test_measure_coverage:
     def test_no_arguments(self, a):
         mn = get_this_file_or_timestamped(os.path.join(a.results_dir, a.name + ".matrix_raw.csv"))
@@ -42,6 +134,184 @@ class Test_measure_coverage:
 
         assert file_exists_and_not_empty(mn)
 
+    def test_sweep_engine(self, a):
+        m1 = a.measure_coverage(save=False, assign=False)
+        m2 = a.measure_coverage(save=False, assign=False, engine="sweep")
+
+        assert m1.shape == m2.shape
+        assert (m1 == m2.loc[m1.index, m1.columns]).all().all()
+
+    def test_cores(self, a):
+        m1 = a.measure_coverage(save=False, assign=False)
+        m2 = a.measure_coverage(save=False, assign=False, cores=2)
+
+        assert m1.shape == m2.shape
+        assert (m1 == m2.loc[m1.index, m1.columns]).all().all()
+
+    def test_compact(self, a):
+        m1 = a.measure_coverage(save=False, assign=False)
+        m2 = a.measure_coverage(save=False, assign=False, compact=True)
+
+        assert (m2.dtypes == np.uint32).all()
+        assert m1.shape == m2.shape
+        assert (m1 == m2.loc[m1.index, m1.columns]).all().all()
+
+    def test_cache(self, a, tmp_path, monkeypatch):
+        from ngs_toolkit import _CONFIG
+        from ngs_toolkit.utils import inspect_coverage_cache, invalidate_coverage_cache
+
+        # keep the cache of the user untouched
+        monkeypatch.setitem(
+            _CONFIG["preferences"], "coverage_cache", {"location": str(tmp_path / "cache")})
+        bams = [s.aligned_filtered_bam for s in a.samples]
+        assert inspect_coverage_cache().empty
+
+        m1 = a.measure_coverage(save=False, assign=False)
+        m2 = a.measure_coverage(save=False, assign=False, cache=True)
+        entries = inspect_coverage_cache()
+        assert all([os.path.abspath(bam) in entries["bam"].tolist() for bam in bams])
+        m3 = a.measure_coverage(save=False, assign=False, cache=True)
+
+        assert m1.shape == m2.shape == m3.shape
+        assert (m1 == m2.loc[m1.index, m1.columns]).all().all()
+        assert (m2 == m3).all().all()
+
+        assert sum([invalidate_coverage_cache(bam) for bam in bams]) == len(bams)
+
+    def test_region_sets(self, a):
+        import pybedtools
+
+        other = pybedtools.BedTool.from_dataframe(a.sites.to_dataframe().head(20))
+        m = a.measure_coverage(sites={"peaks": a.sites, "other": other}, save=False)
+
+        assert set(m.keys()) == {"peaks", "other"}
+        assert set(a.matrix_raw_sets.keys()) == {"peaks", "other"}
+        for name, sites in [("peaks", a.sites), ("other", other)]:
+            m1 = a.measure_coverage(sites=sites, save=False, assign=False)
+            assert m1.shape == m[name].shape
+            assert (m1 == m[name].loc[m1.index, m1.columns]).all().all()
+
+    def test_frip(self, a):
+        import pysam
+
+        m1 = a.measure_coverage(save=False, assign=False)
+        m2 = a.measure_coverage(save=False, frip=True)
+
+        assert (m1 == m2.loc[m1.index, m1.columns]).all().all()
+        assert a.read_stats.shape == (len(a.samples), 3)
+        assert ((a.read_stats["frip"] >= 0) & (a.read_stats["frip"] <= 1)).all()
+        for s in a.samples:
+            total = pysam.AlignmentFile(s.aligned_filtered_bam).mapped
+            assert a.read_stats.loc[s.name, "total_reads"] == total
+
+    def test_frip_stats_file(self, a):
+        for _ in range(2):
+            a.measure_coverage(frip=True, engine="sweep")
+        for s in a.samples:
+            stats = pd.read_csv(os.path.join(s.sample_root, "stats.tsv"), sep="\t", header=None)
+            assert not stats[0].duplicated().any()
+            assert stats.set_index(0).loc["region_set_frip", 1] == a.read_stats.loc[s.name, "frip"]
+
+        # the total counts the same reads as the sites, with or without filters
+        stats = a.read_stats.copy()
+        a.measure_coverage(save=False, frip=True, read_filters={"min_mapq": 0})
+        assert (a.read_stats == stats).all().all()
+        assert (stats["reads_in_sites"] <= stats["total_reads"]).all()
+
+        with pytest.raises(ValueError):
+            a.measure_coverage(save=False, frip=True, cache=True)
+        with pytest.raises(ValueError):
+            a.measure_coverage(save=False, frip=True, sites={"all": a.sites})
+
+    def test_read_filters(self, a):
+        m1 = a.measure_coverage(save=False, assign=False)
+        m2 = a.measure_coverage(save=False, assign=False, read_filters={"min_mapq": 0})
+        m3 = a.measure_coverage(
+            save=False, assign=False, read_filters={"min_mapq": 30, "skip_duplicates": True}
+        )
+        m4 = a.measure_coverage(
+            save=False,
+            assign=False,
+            engine="sweep",
+            read_filters={"min_mapq": 30, "skip_duplicates": True},
+        )
+
+        assert (m1 == m2).all().all()
+        assert (m3 <= m1).all().all()
+        assert (m3 == m4.loc[m3.index, m3.columns]).all().all()
+
+        with pytest.raises(ValueError):
+            a.measure_coverage(save=False, assign=False, read_filters={"mapq": 30})
+
+    @pytest.mark.parametrize("count_mode", ["reads", "fragments", "cutsites"])
+    def test_count_mode(self, a, count_mode):
+        m1 = a.measure_coverage(save=False, assign=False)
+        m2 = a.measure_coverage(save=False, assign=False, count_mode=count_mode)
+
+        assert m1.shape == m2.shape
+        if count_mode == "reads":
+            assert (m1 == m2.loc[m1.index, m1.columns]).all().all()
+
+        with pytest.raises(ValueError):
+            a.measure_coverage(save=False, assign=False, count_mode="bases")
+
+    @pytest.mark.skipif(not PYBIGWIG, reason="pyBigWig not installed")
+    def test_bigwig_source(self, a):
+        import pyBigWig
+        import pysam
+
+        # bigWig files with constant signal along the genome
+        for s in a.samples:
+            bam = pysam.AlignmentFile(s.aligned_filtered_bam)
+            chroms = list(zip(bam.references, bam.lengths))
+            s.bigwig = os.path.join(s.sample_root, s.name + ".bigWig")
+            bw = pyBigWig.open(s.bigwig, "w")
+            bw.addHeader(chroms)
+            bw.addEntries(
+                [c for c, _ in chroms], [0] * len(chroms),
+                ends=[l for _, l in chroms], values=[1.0] * len(chroms))
+            bw.close()
+
+        m = a.measure_coverage(save=False, assign=False, source="bigwig")
+        lengths = a.sites.to_dataframe().eval("end - start").values
+
+        assert m.shape == (len(lengths), len(a.samples))
+        assert (m.values == lengths[:, None]).all()
+
+        m = a.measure_coverage(
+            save=False, assign=False, source="bigwig", bigwig_statistic="mean")
+        assert (m == 1).all().all()
+
+    def test_cram_input(self, a):
+        import pysam
+
+        m1 = a.measure_coverage(save=False, assign=False)
+
+        # reference covering the reads of all samples
+        ends = dict()
+        for s in a.samples:
+            for read in pysam.AlignmentFile(s.aligned_filtered_bam):
+                ends[read.reference_name] = max(ends.get(read.reference_name, 1), read.reference_end)
+        reference = os.path.join(a.results_dir, "reference.fa")
+        with open(reference, "w") as handle:
+            for chrom, end in ends.items():
+                handle.write(">{}\n{}\n".format(chrom, "N" * end))
+        pysam.faidx(reference)
+
+        for s in a.samples:
+            cram = s.aligned_filtered_bam.replace(".bam", ".cram")
+            pysam.view(
+                "-C", "-T", reference, "-o", cram, s.aligned_filtered_bam, catch_stdout=False)
+            pysam.index(cram)
+            s.aligned_filtered_bam = cram
+
+        m2 = a.measure_coverage(save=False, assign=False, reference=reference)
+        m3 = a.measure_coverage(
+            save=False, assign=False, reference=reference, engine="sweep", cores=2)
+
+        assert (m1 == m2.loc[m1.index, m1.columns]).all().all()
+        assert (m1 == m3.loc[m1.index, m1.columns]).all().all()
+
     def test_distributed(self, a):
         mn = get_this_file_or_timestamped(os.path.join(a.results_dir, a.name + ".matrix_raw.csv"))
 
@@ -66,6 +336,22 @@ class Test_measure_coverage:
                 fs.append(f + end)
         assert all([os.path.exists(f) for f in fs])
 
+    def test_distributed_binary(self, a):
+        m1 = a.measure_coverage(save=False, assign=False)
+
+        a.measure_coverage(
+            distributed=True, computing_configuration="localhost", coverage_format="binary"
+        )
+        fs = [
+            os.path.join(s.sample_root, "coverage", s.name + ".peak_set_coverage.bin")
+            for s in a.samples
+        ]
+        assert all([file_exists_and_not_empty(f) for f in fs])
+
+        m2 = a.collect_coverage(save=False, assign=False, coverage_format="binary")
+        assert m1.shape == m2.shape
+        assert (m1 == m2.loc[m1.index, m1.columns]).all().all()
+
     def test_few_samples(self, a):
         mn = get_this_file_or_timestamped(os.path.join(a.results_dir, a.name + ".matrix_raw.csv"))
 
@@ -118,3 +404,28 @@ class Test_measure_coverage:
         mn = get_this_file_or_timestamped(mn)
         assert file_exists_and_not_empty(mn)
         assert pd.read_csv(mn, index_col=0).shape[1] == 1
+
+
+class Test_add_samples:
+    def test_add_samples(self, a):
+        full = a.measure_coverage(save=False, assign=False)
+        a.calculate_peak_support()
+        full_support = a.support.copy()
+
+        a.measure_coverage(samples=a.samples[:2])
+        a.calculate_peak_support(samples=a.samples[:2])
+        previous = a.matrix_raw.copy()
+
+        m = a.add_samples(a.samples[2:])
+
+        assert m.shape == full.shape
+        assert (m[previous.columns] == previous).all().all()
+        assert (m == full.loc[m.index, m.columns]).all().all()
+        assert (a.support["support"] == full_support.loc[a.support.index, "support"]).all()
+
+    def test_existing_samples(self, a):
+        a.measure_coverage()
+        previous = a.matrix_raw.copy()
+
+        m = a.add_samples(a.samples)
+        assert (m == previous).all().all()
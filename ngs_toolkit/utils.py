@@ -5,6 +5,7 @@ import os
 
 import numpy as np
 import pandas as pd
+from pandas.api.extensions import ExtensionArray, ExtensionDtype, register_extension_dtype
 
 
 def _format_string_with_environment_variables(string):
@@ -458,36 +459,96 @@ def count_dataframe_values(x):
     return np.multiply(*x.shape) - x.isnull().sum().sum()
 
 
+_LOCATION_INDEX_CACHE = dict()
+
+
+def _cache_location_index(index, chroms, starts, ends):
+    """
+    Memoize the coordinates of an index of regions for as long as the index exists.
+    """
+    import weakref
+
+    key = id(index)
+    _LOCATION_INDEX_CACHE[key] = (weakref.ref(index), chroms, starts, ends)
+    weakref.finalize(index, _LOCATION_INDEX_CACHE.pop, key, None)
+
+
+def _parse_location_index(index):
+    """
+    Parse strings of the form "chrom:start-end" into arrays of
+    chromosomes, start and end positions with a single split of each string.
+    """
+    from ngs_toolkit import _LOGGER
+
+    labels = np.asarray(index, dtype=str)
+    chroms, _, positions = np.char.rpartition(labels, ":").T
+    starts, _, ends = np.char.partition(positions, "-").T
+    try:
+        starts = starts.astype(np.int64)
+        ends = ends.astype(np.int64)
+    except ValueError:
+        msg = "Index is not composed of strings of the form 'chrom:start-end'."
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+    return chroms.astype(object), starts, ends
+
+
+def _make_location_labels(chroms, starts, ends):
+    """
+    Make strings of the form "chrom:start-end" from arrays of coordinates.
+    """
+    return [
+        "{}:{}-{}".format(c, s, e)
+        for c, s, e in zip(
+            np.asarray(chroms).tolist(),
+            np.asarray(starts, dtype=np.int64).tolist(),
+            np.asarray(ends, dtype=np.int64).tolist(),
+        )
+    ]
+
+
 def location_index_to_bed(index):
     """
     Get a pandas DataFrame with columns "chrom", "start", "end"
     from an pandas Index of strings in form "chrom:start-end".
 
+    Coordinates of :class:`pandas.Index` objects are memoized,
+    so repeated calls with the same index do not parse it again.
+
     Parameters
     ----------
     index : {:obj:`list`, :class:`pandas.Index`, :class:`pandas.Series)`, :class:`pandas.DataFrame)`}
-        Index strings of the form "chrom:start-end".
+        Index strings of the form "chrom:start-end"
+        or index of regions made by :func:`~ngs_toolkit.utils.to_region_index`.
+        If a DataFrame, its index is used.
 
     Returns
     -------
     :class:`pandas.DataFrame`
         Pandas dataframe.
     """
-    bed = pd.DataFrame(index=index)
-    if isinstance(index, list):
-        index = pd.Series(index=index, name="region").index
-    elif isinstance(index, pd.DataFrame):
-        index = index.to_series(name="region").index
-    elif isinstance(index, pd.Index):
-        pass
+    if isinstance(index, pd.DataFrame):
+        index = index.index
+    elif isinstance(index, pd.Series):
+        index = pd.Index(index.values, name=index.name)
+    elif not isinstance(index, pd.Index):
+        index = pd.Index(list(index))
+
+    if isinstance(index.array, RegionArray):
+        # coordinates are stored in the index already
+        bed = index.array.to_bed()
+        bed.index = index
+        return bed
+
+    cached = _LOCATION_INDEX_CACHE.get(id(index))
+    if cached is not None and cached[0]() is index:
+        chroms, starts, ends = cached[1:]
     else:
-        msg = "index is not list, Series or Index"
-        TypeError(msg)
-    bed.loc[:, "chrom"] = index.str.split(":").str[0]
-    index2 = index.str.split(":").str[1]
-    bed.loc[:, "start"] = index2.str.split("-").str[0].astype(int)
-    bed.loc[:, "end"] = index2.str.split("-").str[1].astype(int)
-    return bed
+        chroms, starts, ends = _parse_location_index(index)
+        _cache_location_index(index, chroms, starts, ends)
+    return pd.DataFrame(
+        {"chrom": chroms.copy(), "start": starts.copy(), "end": ends.copy()}, index=index
+    )
 
 
 def bed_to_index(df):
@@ -495,6 +556,9 @@ def bed_to_index(df):
     Get an index of the form chrom:start-end
     from a a dataframe with such columns.
 
+    The coordinates are memoized for the returned index
+    (see :func:`~ngs_toolkit.utils.location_index_to_bed`).
+
     Parameters
     ----------
     df : {:class:`pandas.DataFrame`, :class:`pybedtools.bedtool.BedTool`, :obj:`str`}
@@ -507,21 +571,36 @@ def bed_to_index(df):
     """
     import pybedtools
 
-    if isinstance(df, pybedtools.BedTool):
-        df = df.to_dataframe()
-    elif isinstance(df, str):
-        df = pybedtools.BedTool(df).to_dataframe()
+    if isinstance(df, (pybedtools.BedTool, str)):
+        df = _read_bedtool_coordinates(df)
     cols = ["chrom", "start", "end"]
     if not all([x in df.columns for x in cols]):
         raise AttributeError("DataFrame does not have '{}' columns.".format("', '".join(cols)))
-    index = (
-        df["chrom"].astype(str)
-        + ":"
-        + df["start"].astype(int).astype(str)
-        + "-"
-        + df["end"].astype(int).astype(str)
-    )
-    return pd.Index(index, name="region")
+    chroms = df["chrom"].astype(str).values.astype(object)
+    starts = df["start"].values.astype(np.int64)
+    ends = df["end"].values.astype(np.int64)
+    index = pd.Index(_make_location_labels(chroms, starts, ends), name="region")
+    _cache_location_index(index, chroms, starts, ends)
+    return index
+
+
+def _read_bedtool_coordinates(bedtool):
+    """
+    Read coordinates of a BED file or :class:`pybedtools.bedtool.BedTool` into a dataframe,
+    with a vectorized reader if it is a file and by iterating over its intervals otherwise.
+    """
+    import pybedtools
+
+    if isinstance(bedtool, str):
+        bedtool = pybedtools.BedTool(bedtool)
+    if isinstance(bedtool.fn, str) and os.path.isfile(bedtool.fn):
+        try:
+            return read_bed_coordinates(bedtool.fn)
+        except ValueError:
+            # e.g. files with header lines
+            pass
+    return pd.DataFrame(
+        [(i.chrom, i.start, i.stop) for i in bedtool], columns=["chrom", "start", "end"])
 
 
 def bedtool_to_index(bedtool):
@@ -535,7 +614,8 @@ def bedtool_to_index(bedtool):
     else:
         msg = "Input not pybedtools.BedTool or string to BED file."
         raise ValueError(msg)
-    return [str(i.chrom) + ":" + str(i.start) + "-" + str(i.stop) for i in bedtool]
+    bed = _read_bedtool_coordinates(bedtool)
+    return _make_location_labels(bed["chrom"].values, bed["start"].values, bed["end"].values)
 
 
 def to_bed_index(sites):
@@ -555,6 +635,275 @@ def to_bed_index(sites):
         raise ValueError(msg)
 
 
+@register_extension_dtype
+class RegionDtype(ExtensionDtype):
+    """
+    Pandas data type of genomic regions stored as a :class:`~ngs_toolkit.utils.RegionArray`.
+    """
+
+    name = "region"
+    type = str
+    kind = "O"
+    na_value = np.nan
+
+    @classmethod
+    def construct_array_type(cls):
+        return RegionArray
+
+    @classmethod
+    def construct_from_string(cls, string):
+        if string == cls.name:
+            return cls()
+        raise TypeError("Cannot construct a '{}' from '{}'.".format(cls.__name__, string))
+
+
+class RegionArray(ExtensionArray):
+    """
+    Compact array of genomic regions usable as the values of a :class:`pandas.Index`.
+
+    Chromosomes are stored as integer codes into an array of chromosome names
+    and positions as integer arrays, instead of one Python string per region.
+    Regions are rendered as strings of the form ``"chrom:start-end"``,
+    the same labels made by :func:`~ngs_toolkit.utils.bed_to_index`.
+    Use :func:`~ngs_toolkit.utils.to_region_index` to create an index.
+
+    Label lookups (e.g. ``loc``, ``get_loc``, ``in`` or ``reindex`` with labels)
+    go through the lookup table pandas builds for the index on first use:
+    this renders every label as a Python string and hashes it, and the table is kept
+    with the index until it is deleted or copied, costing about as much memory as
+    an index of strings. To select regions without rendering labels, compare the
+    values of the index with a label, which only parses that label
+    (e.g. ``df.loc[df.index.values == "chr1:100-200"]``), or use its coordinates.
+
+    Parameters
+    ----------
+    chroms : :class:`numpy.ndarray`
+        Names of chromosomes.
+
+    codes : :class:`numpy.ndarray`
+        Position of the chromosome of each region in ``chroms`` or -1 for missing regions.
+
+    starts : :class:`numpy.ndarray`
+        Start position of each region.
+
+    ends : :class:`numpy.ndarray`
+        End position of each region.
+    """
+
+    def __init__(self, chroms, codes, starts, ends):
+        self._chroms = np.asarray(chroms, dtype=object)
+        self._codes = np.asarray(codes, dtype=np.int32)
+        self._starts = np.asarray(starts, dtype=np.int64)
+        self._ends = np.asarray(ends, dtype=np.int64)
+
+    @classmethod
+    def from_labels(cls, labels):
+        """
+        Make an array from strings of the form ``"chrom:start-end"``.
+
+        Raises
+        ------
+        ValueError
+            If a label is not of the form ``"chrom:start-end"``.
+        """
+        from ngs_toolkit import _LOGGER
+
+        coords = _parse_interval_strings(labels, zero_based=True)
+        missing = pd.isnull(pd.Series(labels, dtype=object)).values
+        invalid = ~(coords["valid"].values | missing)
+        if invalid.any():
+            msg = "Regions not of the form 'chrom:start-end': '{}'.".format(
+                "', '".join(map(str, np.asarray(labels, dtype=object)[invalid][:10])))
+            _LOGGER.error(msg)
+            raise ValueError(msg)
+        codes, chroms = pd.factorize(coords["chrom"].where(~missing))
+        return cls(chroms.astype(object), codes, coords["start"].values, coords["end"].values)
+
+    @classmethod
+    def from_bed(cls, bed):
+        """
+        Make an array from a dataframe with columns "chrom", "start" and "end".
+        """
+        codes, chroms = pd.factorize(bed["chrom"].astype(str))
+        return cls(chroms.astype(object), codes, bed["start"].values, bed["end"].values)
+
+    @classmethod
+    def _from_sequence(cls, scalars, dtype=None, copy=False):
+        if isinstance(scalars, cls):
+            return scalars.copy() if copy else scalars
+        return cls.from_labels(list(scalars))
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls.from_labels(values)
+
+    @property
+    def dtype(self):
+        return RegionDtype()
+
+    @property
+    def nbytes(self):
+        return (
+            self._codes.nbytes + self._starts.nbytes + self._ends.nbytes
+            + sum(len(c) for c in self._chroms))
+
+    @property
+    def chrom(self):
+        """Chromosome of each region."""
+        return np.append(self._chroms, np.nan)[self._codes]
+
+    @property
+    def start(self):
+        """Start position of each region."""
+        return self._starts
+
+    @property
+    def end(self):
+        """End position of each region."""
+        return self._ends
+
+    def to_bed(self):
+        """
+        Get a dataframe with columns "chrom", "start" and "end".
+        """
+        return pd.DataFrame({"chrom": self.chrom, "start": self.start, "end": self.end})
+
+    def to_labels(self):
+        """
+        Get an array of strings of the form ``"chrom:start-end"``.
+        """
+        labels = np.asarray(
+            _make_location_labels(self.chrom, self._starts, self._ends), dtype=object)
+        labels[self._codes == -1] = np.nan
+        return labels
+
+    def __len__(self):
+        return self._codes.shape[0]
+
+    def __getitem__(self, item):
+        if pd.api.types.is_integer(item):
+            code = self._codes[item]
+            if code == -1:
+                return self.dtype.na_value
+            return "{}:{}-{}".format(self._chroms[code], self._starts[item], self._ends[item])
+        item = pd.api.indexers.check_array_indexer(self, item)
+        return type(self)(self._chroms, self._codes[item], self._starts[item], self._ends[item])
+
+    def __iter__(self):
+        return iter(self.to_labels())
+
+    def __eq__(self, other):
+        if isinstance(other, (pd.Series, pd.Index, pd.DataFrame)):
+            return NotImplemented
+        if isinstance(other, str):
+            chrom, _, position = other.rpartition(":")
+            start, _, end = position.partition("-")
+            code = np.flatnonzero(self._chroms == chrom)
+            if code.shape[0] == 0 or not (start.isdigit() and end.isdigit()):
+                return np.zeros(len(self), dtype=bool)
+            return (
+                (self._codes == code[0])
+                & (self._starts == int(start))
+                & (self._ends == int(end)))
+        if isinstance(other, type(self)):
+            return (
+                (self.chrom == other.chrom)
+                & (self._starts == other._starts)
+                & (self._ends == other._ends)
+                & (self._codes != -1))
+        return self.to_labels() == np.asarray(other, dtype=object)
+
+    def isna(self):
+        return self._codes == -1
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        from pandas.api.extensions import take
+
+        if allow_fill and not (fill_value is None or pd.isnull(fill_value)):
+            msg = "Only missing values can be used to fill regions."
+            raise ValueError(msg)
+        return type(self)(
+            self._chroms,
+            take(self._codes, indices, allow_fill=allow_fill, fill_value=-1),
+            take(self._starts, indices, allow_fill=allow_fill, fill_value=0),
+            take(self._ends, indices, allow_fill=allow_fill, fill_value=0),
+        )
+
+    def copy(self):
+        return type(self)(self._chroms, self._codes.copy(), self._starts.copy(), self._ends.copy())
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        chroms = pd.unique(np.concatenate([a._chroms for a in to_concat]))
+        codes = list()
+        for a in to_concat:
+            mapping = np.append(pd.Index(chroms).get_indexer(a._chroms), -1)
+            codes.append(mapping[a._codes])
+        return cls(
+            chroms,
+            np.concatenate(codes),
+            np.concatenate([a._starts for a in to_concat]),
+            np.concatenate([a._ends for a in to_concat]),
+        )
+
+    def _values_for_factorize(self):
+        return self.to_labels(), np.nan
+
+    def _values_for_argsort(self):
+        return self.to_labels()
+
+    def _formatter(self, boxed=False):
+        return str
+
+    def astype(self, dtype, copy=True):
+        dtype = pd.api.types.pandas_dtype(dtype)
+        if isinstance(dtype, RegionDtype):
+            return self.copy() if copy else self
+        if dtype == object:
+            # an object ndarray lets pandas index labels in a hash table
+            # instead of scanning all regions for each single label lookup
+            return self.to_labels()
+        if pd.api.types.is_string_dtype(dtype):
+            return pd.array(self.to_labels(), dtype=dtype)
+        return super().astype(dtype, copy=copy)
+
+
+def to_region_index(index, name="region"):
+    """
+    Convert genomic regions to a compact :class:`pandas.Index` backed by a
+    :class:`~ngs_toolkit.utils.RegionArray`.
+
+    The index has the same labels as an index of strings made by
+    :func:`~ngs_toolkit.utils.bed_to_index`, can be used in its place in
+    dataframes, and gives direct access to the coordinates of regions
+    through its ``values`` (:attr:`RegionArray.chrom`,
+    :attr:`RegionArray.start`, :attr:`RegionArray.end`) without parsing strings.
+
+    Parameters
+    ----------
+    index : {:class:`pandas.Index`, :obj:`list`, :class:`pandas.DataFrame`}
+        Strings of the form ``"chrom:start-end"`` or
+        dataframe with columns "chrom", "start" and "end".
+
+    name : :obj:`str`
+        Name of the index.
+
+        Default is "region".
+
+    Returns
+    -------
+    :class:`pandas.Index`
+        Pandas index of regions.
+    """
+    if isinstance(index, pd.DataFrame):
+        values = RegionArray.from_bed(index)
+    elif isinstance(getattr(index, "array", None), RegionArray):
+        values = index.array
+    else:
+        values = RegionArray.from_labels(list(index))
+    return pd.Index(values, name=name)
+
+
 def sort_bed_nicely(bed_file):
     """Sorts BED file but in sorted_nicely order"""
     import pybedtools
@@ -598,721 +947,3303 @@ def filter_bed_file(input_bed, filter_bed, output_bed):
     )
 
 
-def timedelta_to_years(x):
+def read_bed_coordinates(input_bed, score=False, name=False):
     """
-    Convert a timedelta to years.
+    Read the first three columns of a BED file into a dataframe
+    with vectorized parsing.
+    Leading "track" and "browser" lines are skipped.
 
     Parameters
     ----------
-    x : :class:`pandas.Timedelta`
-        A Timedelta object.
+    input_bed : {:obj:`str`, :class:`pybedtools.bedtool.BedTool`}
+        BED file.
+
+    score : :obj:`bool`
+        Whether to read also the fifth column of the file (score).
+
+        Default is :obj:`False`.
+
+    name : :obj:`bool`
+        Whether to read also the fourth column of the file (name).
+
+        Default is :obj:`False`.
 
     Returns
     -------
-    float
-        Years.
+    :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start", "end",
+        "name" if ``name`` and "score" if ``score``.
     """
-    return x / np.timedelta64(60 * 60 * 24 * 365, "s")
+    import gzip
+    import pybedtools
 
+    if isinstance(input_bed, pybedtools.BedTool):
+        input_bed = input_bed.fn
+    dtype = {"chrom": str, "start": np.int64, "end": np.int64}
+    usecols = [0, 1, 2]
+    if name:
+        dtype["name"] = str
+        usecols.append(3)
+    if score:
+        dtype["score"] = np.float64
+        usecols.append(4)
+    skip = 0
+    if isinstance(input_bed, str) and os.path.exists(input_bed):
+        with (gzip.open if input_bed.endswith(".gz") else open)(input_bed, "rt") as handle:
+            for line in handle:
+                if not line.startswith(("track", "browser")):
+                    break
+                skip += 1
+    try:
+        return pd.read_csv(
+            input_bed,
+            sep="\t",
+            header=None,
+            usecols=usecols,
+            names=list(dtype.keys()),
+            dtype=dtype,
+            comment="#",
+            skiprows=skip,
+        )
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame({k: pd.Series([], dtype=v) for k, v in dtype.items()})
 
-def signed_max(x, f=0.66, axis=0):
+
+def extend_intervals(bed, extension, chrom_sizes):
     """
-    Return maximum or minimum of array ``x`` depending on the sign of the
-    majority of values.
-    If there isn't a clear majority (at least ``f`` fraction in one side),
-    return mean of values.
-    If given a pandas DataFrame or 2D numpy array, will apply this across rows
-    (columns-wise, axis=0) or across columns (row-wise, axis=1).
-    Will return :obj:`numpy.nan` for non-numeric values.
+    Extend intervals in both directions, bounded by the chromosome ends
+    as ``bedtools slop -b``.
 
     Parameters
     ----------
-    x : {:class:`numpy.ndarray`, :class:`pandas.DataFrame`, :class:`pandas.Series`}
-        Input values to reduce
-    f : :obj:`float`
-        Threshold fraction of majority agreement.
+    bed : :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start" and "end".
 
-        Default is 0.66.
-    axis : :obj:`int`
-        Whether to apply across rows (0, column-wise) or
-        across columns (1, row-wise).
+    extension : :obj:`int`
+        Number of basepairs to extend intervals by in both directions.
 
-        Default is 0.
+    chrom_sizes : :obj:`dict`
+        Dictionary of chromosome names and their length.
 
     Returns
     -------
-    :class:`pandas.Series`
-        Pandas Series with values reduced to the signed maximum.
+    :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start" and "end".
+
+    Raises
+    ------
+    ValueError
+        If a chromosome of ``bed`` is not in ``chrom_sizes``.
     """
-    if axis not in [0, 1]:
-        raise ValueError("Axis must be one of 0 (columns) or 1 (rows).")
+    from ngs_toolkit import _LOGGER
 
-    if len(x.shape) == 1:
-        # Return nan if not numeric
-        if x.dtype not in [np.float_, np.int_]:
-            return np.nan
+    sizes = bed["chrom"].map(chrom_sizes)
+    if sizes.isnull().any():
+        msg = "Chromosomes not in chromosome sizes: '{}'.".format(
+            "', '".join(bed.loc[sizes.isnull(), "chrom"].unique()))
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+    return pd.DataFrame(
+        {
+            "chrom": bed["chrom"].values,
+            "start": np.maximum(bed["start"].values - extension, 0),
+            "end": np.minimum(bed["end"].values + extension, sizes.values.astype(np.int64)),
+        }
+    )
 
-        types = [type(i) for i in x]
-        if not all(types):
-            return np.nan
-        else:
-            if types[0] not in [np.float_, float, np.int_, int]:
-                return np.nan
-        ll = float(len(x))
-        neg = sum(x < 0)
-        pos = sum(x > 0)
-        obs_f = max(neg / ll, pos / ll)
-        if obs_f >= f:
-            if neg > pos:
-                return min(x)
-            else:
-                return max(x)
-        else:
-            return np.mean(x)
-    else:
-        if not isinstance(x, pd.DataFrame):
-            x = pd.DataFrame(x)
 
-        if axis == 1:
-            x = x.T
-        res = pd.Series(np.empty(x.shape[1]), index=x.columns)
-        for v in x.columns:
-            res[v] = signed_max(x.loc[:, v], f=f)
+def shuffle_intervals(bed, chrom_sizes, exclude=None, replicates=1, seed=None, max_tries=1000):
+    """
+    Randomly place intervals within their chromosome keeping their length,
+    as ``bedtools shuffle -chrom``, sampling positions for all intervals at once.
 
-        return res
+    Parameters
+    ----------
+    bed : :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start" and "end".
 
+    chrom_sizes : :obj:`dict`
+        Dictionary of chromosome names and their length.
 
-def log_pvalues(x, f=0.1):
-    """
-    Calculate -log10(p-value) of array.
+    exclude : :class:`pandas.DataFrame`, optional
+        Dataframe with columns "chrom", "start" and "end" of regions
+        (e.g. blacklist or assembly gaps) which shuffled intervals must not overlap.
+        Intervals overlapping them are placed again.
 
-    Replaces infinite values with:
+        Default is not to exclude any region.
 
-    .. highlight:: python
-    .. code-block:: python
+    replicates : :obj:`int`, optional
+        Number of times to shuffle the intervals.
 
-        max(x) + max(x) * f
+        Default is 1.
 
-    that is, fraction ``f`` more than the maximum non-infinite -log10(p-value).
+    seed : :obj:`int`, optional
+        Seed for the random number generator, to make shuffling reproducible.
 
-    Parameters
-    ----------
-    x : :class:`pandas.Series`
-        Series with numeric values
-    f : :obj:`float`
-        Fraction to augment the maximum value by if ``x`` contains infinite values.
+        Default is not to seed the generator.
 
-        Defaults to 0.1.
+    max_tries : :obj:`int`, optional
+        Maximum number of times to place intervals overlapping ``exclude``.
+
+        Default is 1000.
 
     Returns
     -------
-    :class:`pandas.Series`
-        Transformed values.
+    :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start", "end" and "replicate",
+        with the intervals of ``bed`` in the same order for each replicate.
+
+    Raises
+    ------
+    ValueError
+        If a chromosome of ``bed`` is not in ``chrom_sizes``, if an interval is longer
+        than its chromosome or if intervals could not be placed outside ``exclude``.
     """
-    ll = -np.log10(x)
-    rmax = ll[ll != np.inf].max()
-    return ll.replace(np.inf, rmax + rmax * f)
+    from ngs_toolkit import _LOGGER
 
+    sizes = bed["chrom"].map(chrom_sizes)
+    if sizes.isnull().any():
+        msg = "Chromosomes not in chromosome sizes: '{}'.".format(
+            "', '".join(bed.loc[sizes.isnull(), "chrom"].unique()))
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+    lengths = (bed["end"] - bed["start"]).values.astype(np.int64)
+    sizes = sizes.values.astype(np.int64)
+    if (lengths > sizes).any():
+        msg = "Intervals are longer than their chromosome."
+        _LOGGER.error(msg)
+        raise ValueError(msg)
 
-def fix_dataframe_header(df, force_dtypes=float):
-    # First try to see whether it is not a MultiIndex after all
-    if df.index.isna().any().sum() == 1:
-        df.columns = df.loc[df.index.isna(), :].squeeze()
-        df.columns.name = None
-        df.index.name = None
-        return df.loc[~df.index.isna()]
-    # If so, get potential categorical columns and prepare MultiIndex with them
-    cols = list()
-    for i in df.index[:300]:
-        try:
-            df.loc[i, :].astype(float)
-        except ValueError:
-            cols.append(i)
-    if len(cols) == 0:
-        pass
-    elif len(cols) == 1:
-        df.columns = df.loc[cols[0]]
-        df = df.loc[~df.index.isin(cols)]
-    else:
-        df.columns = pd.MultiIndex.from_arrays(df.loc[cols].values, names=cols)
-        df = df.loc[~df.index.isin(cols)]
-    df.index.name = None
-    if force_dtypes is not None:
-        return df.astype(force_dtypes)
+    rng = np.random.default_rng(seed)
+    chroms = np.tile(bed["chrom"].values, replicates)
+    lengths = np.tile(lengths, replicates)
+    sizes = np.tile(sizes, replicates)
+    starts = np.zeros(chroms.shape[0], dtype=np.int64)
+    todo = np.arange(chroms.shape[0])
+    for _ in range(max_tries):
+        starts[todo] = rng.integers(0, sizes[todo] - lengths[todo] + 1)
+        if exclude is None or exclude.empty:
+            break
+        placed = pd.DataFrame(
+            {"chrom": chroms[todo], "start": starts[todo], "end": starts[todo] + lengths[todo]}
+        )
+        todo = todo[count_interval_overlaps(placed, exclude) > 0]
+        if todo.shape[0] == 0:
+            break
     else:
-        return df
-
-
-def r2pandas_df(r_df):
-    """Make :class:`pandas.DataFrame` from a ``R`` dataframe given by :class:`rpy`."""
-    from rpy2.robjects import pandas2ri
+        msg = "Could not place {} intervals outside excluded regions in {} tries.".format(
+            todo.shape[0], max_tries)
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+    return pd.DataFrame(
+        {
+            "chrom": chroms,
+            "start": starts,
+            "end": starts + lengths,
+            "replicate": np.repeat(np.arange(replicates), bed.shape[0]),
+        }
+    )
 
-    if isinstance(r_df, pd.DataFrame):
-        return r_df
-    if isinstance(r_df, np.recarray):
-        return pd.DataFrame.from_records(r_df)
-    df = pd.DataFrame(np.asarray(r_df)).T
-    df.columns = [str(x) for x in r_df.colnames]
-    df.index = [str(x) for x in r_df.rownames]
-    return df
 
+class GenomeSequence:
+    """
+    Random-access reader of a genome sequence in 2bit or FASTA format.
 
-def recarray2pandas_df(recarray):
-    """Make :class:`pandas.DataFrame` from :class:`numpy.recarray`."""
-    df = pd.DataFrame.from_records(recarray, index=list(range(recarray.shape[0])))
-    return df
+    2bit files and uncompressed FASTA files are memory-mapped and only the bases
+    of the requested regions are read and decoded, so no conversion between formats
+    is needed. FASTA files compressed with bgzip are read with pysam.
+    FASTA files are indexed (".fai" file) if not already.
+    Bases are returned as in the genome file, keeping soft-masked (lowercase) bases.
+
+    Parameters
+    ----------
+    genome_file : :obj:`str`
+        Path to genome file in either 2bit or FASTA format.
+        The format is guessed from the content of the file.
+    """
+
+    _TWOBIT_SIGNATURE = 0x1A412743
+    # each 2bit byte packs four bases, most significant bits first
+    _TWOBIT_TABLE = np.frombuffer(b"TCAG", dtype=np.uint8)[
+        (np.arange(256)[:, np.newaxis] >> np.array([6, 4, 2, 0])) & 3
+    ]
+    _COMPLEMENT = np.arange(256, dtype=np.uint8)
+    _COMPLEMENT[list(b"ACGTNacgtn")] = list(b"TGCANtgcan")
+
+    def __init__(self, genome_file):
+        self.genome_file = genome_file
+        self._data = None
+        self._fasta = None
+        self._records = dict()
+        with open(genome_file, "rb") as handle:
+            head = handle.read(4)
+        if len(head) == 4 and self._TWOBIT_SIGNATURE in (
+            int.from_bytes(head, "little"),
+            int.from_bytes(head, "big"),
+        ):
+            self.format = "2bit"
+            self._read_twobit_index()
+        else:
+            self.format = "fasta"
+            self.gzipped = head[:2] == b"\x1f\x8b"
+            self._index = _read_fasta_index(genome_file)
+            self.chrom_sizes = {chrom: v[0] for chrom, v in self._index.items()}
+
+    def __getstate__(self):
+        # do not pickle the memory-map or file handles (e.g. to send to other processes)
+        state = self.__dict__.copy()
+        state.update({"_data": None, "_fasta": None})
+        return state
+
+    def _get_data(self):
+        if self._data is None:
+            self._data = np.memmap(self.genome_file, dtype=np.uint8, mode="r")
+        return self._data
+
+    def _read_integers(self, position, count, width=4):
+        data = self._get_data()
+        return np.frombuffer(
+            data[position: position + count * width].tobytes(),
+            dtype=self._byte_order + "u{}".format(width),
+        ).astype(np.int64)
+
+    def _read_twobit_index(self):
+        data = self._get_data()
+        self._byte_order = (
+            "<" if int.from_bytes(data[:4].tobytes(), "little") == self._TWOBIT_SIGNATURE else ">"
+        )
+        version, count = self._read_integers(4, 2)
+        width = 8 if version == 1 else 4
+        self._index = dict()
+        position = 16
+        for _ in range(count):
+            size = int(data[position])
+            name = data[position + 1: position + 1 + size].tobytes().decode()
+            position += 1 + size
+            self._index[name] = int(self._read_integers(position, 1, width)[0])
+            position += width
+        self.chrom_sizes = {
+            chrom: int(self._read_integers(offset, 1)[0]) for chrom, offset in self._index.items()
+        }
+
+    def _get_twobit_record(self, chrom):
+        """
+        Get the offset of the packed bases, the "N" blocks and the soft-masked blocks
+        of a sequence in the 2bit file.
+        """
+        if chrom not in self._records:
+            position = self._index[chrom] + 4
+            blocks = list()
+            for _ in range(2):
+                count = int(self._read_integers(position, 1)[0])
+                starts = self._read_integers(position + 4, count)
+                sizes = self._read_integers(position + 4 + 4 * count, count)
+                blocks.append((starts, starts + sizes))
+                position += 4 + 8 * count
+            # skip reserved field
+            self._records[chrom] = (position + 4, blocks[0], blocks[1])
+        return self._records[chrom]
+
+    @staticmethod
+    def _get_block_mask(blocks, starts, ends, reverse=None):
+        """
+        Whether each base of regions concatenated one after the other
+        (reversed if ``reverse``) is in one of the sorted, non-overlapping ``blocks``.
+        """
+        block_starts, block_ends = blocks
+        offsets = np.concatenate([[0], np.cumsum(ends - starts)])
+        # pairs of regions and overlapping blocks
+        region, block = _expand_ranges(
+            np.searchsorted(block_ends, starts, side="right"),
+            np.searchsorted(block_starts, ends, side="left"),
+        )
+        lo = np.maximum(block_starts[block], starts[region]) - starts[region]
+        hi = np.minimum(block_ends[block], ends[region]) - starts[region]
+        if reverse is not None:
+            flip = reverse[region]
+            lengths = (ends - starts)[region]
+            lo, hi = np.where(flip, lengths - hi, lo), np.where(flip, lengths - lo, hi)
+        delta = np.bincount(offsets[region] + lo, minlength=offsets[-1] + 1)
+        delta -= np.bincount(offsets[region] + hi, minlength=offsets[-1] + 1)
+        return np.cumsum(delta[:-1]) > 0
+
+    def fetch_array(self, chrom, start, end):
+        """
+        Get the bases of a region as an array of ASCII codes.
+        Positions are zero-based and half-open, and are clipped to the chromosome length.
+
+        Raises
+        ------
+        ValueError
+            If the chromosome is not in the genome file.
+        """
+        from ngs_toolkit import _LOGGER
+
+        if chrom not in self.chrom_sizes:
+            msg = "Chromosome '{}' not in genome file.".format(chrom)
+            _LOGGER.error(msg)
+            raise ValueError(msg)
+        start = int(min(max(start, 0), self.chrom_sizes[chrom]))
+        end = int(min(max(end, start), self.chrom_sizes[chrom]))
+
+        if self.format == "2bit":
+            offset, n_blocks, mask_blocks = self._get_twobit_record(chrom)
+            first, last = start // 4, (end + 3) // 4
+            packed = self._get_data()[offset + first: offset + last]
+            sequence = self._TWOBIT_TABLE[packed].ravel()[start - first * 4: end - first * 4]
+            for blocks, value in [(n_blocks, ord("N")), (mask_blocks, None)]:
+                mask = self._get_block_mask(blocks, np.array([start]), np.array([end]))
+                sequence[mask] = value if value is not None else sequence[mask] + 32
+            return sequence
+        if self.gzipped:
+            import pysam
+
+            if self._fasta is None:
+                self._fasta = pysam.FastaFile(self.genome_file)
+            return np.frombuffer(self._fasta.fetch(chrom, start, end).encode(), dtype=np.uint8)
+
+        _, offset, line_bases, line_width = self._index[chrom]
+        raw = self._get_data()[
+            offset + start // line_bases * line_width + start % line_bases:
+            offset + end // line_bases * line_width + end % line_bases
+        ]
+        return np.asarray(raw[(raw != ord("\n")) & (raw != ord("\r"))])
+
+    def fetch(self, chrom, start, end, reverse_complement=False):
+        """
+        Get the sequence of a region as a string.
+        Positions are zero-based and half-open, and are clipped to the chromosome length.
+        """
+        sequence = self.fetch_array(chrom, start, end)
+        if reverse_complement:
+            sequence = self._COMPLEMENT[sequence[::-1]]
+        return sequence.tobytes().decode()
+
+    def fetch_intervals(self, bed, reverse_complement=False, batch_size=2 ** 24):
+        """
+        Get the sequences of many regions.
+
+        Regions of each chromosome are read in batches of up to ``batch_size`` bases
+        by gathering the bases of all their positions at once.
+        Positions are clipped to the chromosome length.
+
+        Parameters
+        ----------
+        bed : :class:`pandas.DataFrame`
+            Dataframe with columns "chrom", "start" and "end".
+
+        reverse_complement : {:obj:`bool`, :class:`numpy.ndarray`}
+            Whether to get the reverse complement of the sequences.
+            Can be an array of booleans with a value for each region
+            (e.g. ``bed["strand"] == "-"``).
+
+            Default is :obj:`False`.
+
+        batch_size : :obj:`int`
+            Maximum number of bases to read at once.
+
+            Default is 2 ** 24.
+
+        Returns
+        -------
+        :obj:`list`
+            Sequences of the regions in the order of ``bed``.
+
+        Raises
+        ------
+        ValueError
+            If a chromosome of ``bed`` is not in the genome file.
+        """
+        from ngs_toolkit import _LOGGER
+
+        chroms = bed["chrom"].values
+        sizes = pd.Series(self.chrom_sizes, dtype=float).reindex(chroms).values
+        if np.isnan(sizes).any():
+            msg = "Chromosomes not in genome file: '{}'.".format(
+                "', '".join(sorted(set(chroms[np.isnan(sizes)]))))
+            _LOGGER.error(msg)
+            raise ValueError(msg)
+        sizes = sizes.astype(np.int64)
+        starts = np.clip(bed["start"].values.astype(np.int64), 0, sizes)
+        ends = np.clip(bed["end"].values.astype(np.int64), starts, sizes)
+        reverse = np.broadcast_to(np.asarray(reverse_complement, dtype=bool), (bed.shape[0],))
+
+        if self.format == "fasta" and self.gzipped:
+            return [
+                self.fetch(*region) for region in zip(chroms, starts, ends, reverse)
+            ]
+
+        sequences = [None] * bed.shape[0]
+        groups = pd.Series(np.arange(bed.shape[0])).groupby(chroms).indices
+        for chrom, idx in groups.items():
+            # read regions in genomic order
+            idx = idx[np.argsort(starts[idx], kind="mergesort")]
+            lengths = ends[idx] - starts[idx]
+            cumulative = np.cumsum(lengths)
+            bounds = np.searchsorted(
+                cumulative, np.arange(batch_size, cumulative[-1], batch_size), side="left")
+            for batch in np.split(idx, np.unique(bounds)):
+                if batch.shape[0] == 0:
+                    continue
+                region, positions = _expand_ranges(starts[batch], ends[batch])
+                rev = reverse[batch][region]
+                positions = np.where(
+                    rev, starts[batch][region] + ends[batch][region] - 1 - positions, positions)
+                if self.format == "2bit":
+                    offset, n_blocks, mask_blocks = self._get_twobit_record(chrom)
+                    packed = self._get_data()[offset + (positions >> 2)]
+                    bases = self._TWOBIT_TABLE[packed, positions & 3]
+                    args = (starts[batch], ends[batch], reverse[batch])
+                    bases[self._get_block_mask(n_blocks, *args)] = ord("N")
+                    bases[self._get_block_mask(mask_blocks, *args)] += 32
+                else:
+                    _, offset, line_bases, line_width = self._index[chrom]
+                    bases = np.asarray(self._get_data()[
+                        offset + positions // line_bases * line_width + positions % line_bases])
+                bases[rev] = self._COMPLEMENT[bases[rev]]
+                text = bases.tobytes().decode()
+                offsets = np.concatenate([[0], np.cumsum(ends[batch] - starts[batch])])
+                for i, start, end in zip(batch, offsets[:-1], offsets[1:]):
+                    sequences[i] = text[start:end]
+        return sequences
+
+
+def _read_fasta_index(fasta_file):
+    """
+    Read the index of a FASTA file (creating it if needed) into a dictionary of
+    chromosome names and their length, byte offset, bases per line and bytes per line.
+    """
+    import pysam
+
+    if not os.path.exists(fasta_file + ".fai"):
+        pysam.faidx(fasta_file)
+    index = pd.read_csv(fasta_file + ".fai", sep="\t", header=None, usecols=[0, 1, 2, 3, 4])
+    return {
+        chrom: (int(length), int(offset), int(line_bases), int(line_width))
+        for chrom, length, offset, line_bases, line_width in index.values
+    }
+
+
+def _count_gc_in_chromosome(genome_file, chrom, starts, ends, chunk_size=2 ** 24):
+    """
+    Count G and C bases (in any case) in intervals of one chromosome of a genome file.
+
+    Cumulative counts at interval boundaries are computed reading chunks of
+    ``chunk_size`` bases with :class:`~ngs_toolkit.utils.GenomeSequence`
+    to bound memory usage.
+    """
+    genome = GenomeSequence(genome_file)
+    length = genome.chrom_sizes[chrom]
+    starts = np.minimum(starts, length)
+    ends = np.minimum(ends, length)
+
+    is_gc = np.zeros(256, dtype=np.int32)
+    is_gc[list(b"GCgc")] = 1
+    # cumulative number of GC bases before each boundary
+    points, inverse = np.unique(np.concatenate([starts, ends]), return_inverse=True)
+    cumulative = np.zeros(points.shape[0], dtype=np.int64)
+    total = 0
+    for chunk_start in range(0, int(points[-1]) if points.shape[0] else 0, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, length)
+        counts = np.cumsum(is_gc[genome.fetch_array(chrom, chunk_start, chunk_end)])
+        i = np.searchsorted(points, chunk_start, side="right")
+        j = np.searchsorted(points, chunk_end, side="right")
+        cumulative[i:j] = total + counts[points[i:j] - chunk_start - 1]
+        total += int(counts[-1]) if counts.shape[0] else 0
+    cumulative = cumulative[inverse]
+    return cumulative[starts.shape[0]:] - cumulative[: starts.shape[0]]
+
+
+def get_gc_content_length(bed, genome_file, cores=None):
+    """
+    Get the GC content and length of genomic intervals, as ``bedtools nuc``,
+    from a memory-mapped 2bit or FASTA file in parallel by chromosome.
+
+    Parameters
+    ----------
+    bed : :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start" and "end".
+
+    genome_file : :obj:`str`
+        2bit or FASTA file of the genome, read with :class:`~ngs_toolkit.utils.GenomeSequence`.
+        Compressed FASTA files must be compressed with bgzip.
+
+    cores : :obj:`int`
+        Number of processes to use.
+
+        Default is to use all available cores.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Dataframe with columns "gc_content" (fraction of G or C bases)
+        and "length" in the order of ``bed``.
+
+    Raises
+    ------
+    ValueError
+        If a chromosome of ``bed`` is not in the genome file.
+    """
+    import parmap
+    from ngs_toolkit import _LOGGER
+
+    chrom_sizes = GenomeSequence(genome_file).chrom_sizes
+    missing = set(bed["chrom"].unique()) - set(chrom_sizes.keys())
+    if missing:
+        msg = "Chromosomes not in genome file: '{}'.".format("', '".join(sorted(missing)))
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+
+    starts = bed["start"].values.astype(np.int64)
+    ends = bed["end"].values.astype(np.int64)
+    groups = pd.Series(np.arange(bed.shape[0])).groupby(bed["chrom"].values).indices
+    res = parmap.starmap(
+        _count_gc_in_chromosome,
+        [(genome_file, chrom, starts[idx], ends[idx]) for chrom, idx in groups.items()],
+        pm_processes=cores,
+        pm_parallel=True,
+    )
+    gc = np.zeros(bed.shape[0], dtype=np.int64)
+    for idx, counts in zip(groups.values(), res):
+        gc[idx] = counts
+    lengths = ends - starts
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gc_content = gc / lengths
+    return pd.DataFrame({"gc_content": gc_content, "length": lengths})
+
+
+def _get_gc_content_length_cache_file(genome_file, intervals, cache_dir=None):
+    """
+    Get the path of the cached GC content and length of a set of intervals in a genome file.
+
+    Entries are kept apart from the coverage cache, by default in the directory given by
+    "preferences:nucleotide_content_cache:location" in the configuration or the
+    "nucleotide_content_cache" directory of the ngs_toolkit cache directory,
+    and are identified by the path, size and modification time of the genome file and
+    a hash of the intervals (see :func:`~ngs_toolkit.utils.get_site_set_hash`).
+    """
+    import hashlib
+    from ngs_toolkit import _CONFIG, JOBLIB_CACHE_DIR
+
+    if cache_dir is None:
+        try:
+            cache_dir = _CONFIG["preferences"]["nucleotide_content_cache"]["location"]
+        except KeyError:
+            cache_dir = None
+    if cache_dir is None:
+        cache_dir = os.path.join(JOBLIB_CACHE_DIR, "nucleotide_content_cache")
+    cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    os.makedirs(cache_dir, exist_ok=True)
+    genome_file = os.path.abspath(genome_file)
+    stat = os.stat(genome_file)
+    key = hashlib.sha1(
+        "\t".join(
+            [genome_file, str(stat.st_size), str(stat.st_mtime_ns), get_site_set_hash(intervals)]
+        ).encode()
+    ).hexdigest()
+    return os.path.join(cache_dir, key + ".npy")
+
+
+def get_cached_gc_content_length(genome_file, intervals, cache_dir=None):
+    """
+    Get the GC content and length of genomic intervals stored with
+    :func:`~ngs_toolkit.utils.cache_gc_content_length`.
+
+    Parameters
+    ----------
+    genome_file : :obj:`str`
+        2bit or FASTA file of the genome.
+
+    intervals : :obj:`list`
+        List of strings with genomic coordinates in format
+        ``"chrom:start-end"``.
+
+    cache_dir : :obj:`str`
+        Directory of the cache.
+
+        Default is the value of "preferences:nucleotide_content_cache:location" in the
+        configuration or "~/.ngs_toolkit/nucleotide_content_cache".
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Dataframe with columns "gc_content" and "length" in the order of ``intervals``
+        or :obj:`None` if not in cache.
+    """
+    cache_file = _get_gc_content_length_cache_file(genome_file, intervals, cache_dir)
+    try:
+        values = np.load(cache_file)
+    except (IOError, ValueError):
+        return None
+    if values.shape != (len(intervals), 2):
+        return None
+    return pd.DataFrame({"gc_content": values[:, 0], "length": values[:, 1].astype(np.int64)})
+
+
+def cache_gc_content_length(genome_file, intervals, nuc, cache_dir=None):
+    """
+    Store the GC content and length of genomic intervals
+    (see :func:`~ngs_toolkit.utils.get_gc_content_length`) in a cache of their own.
+
+    Parameters
+    ----------
+    genome_file : :obj:`str`
+        2bit or FASTA file of the genome.
+
+    intervals : :obj:`list`
+        List of strings with genomic coordinates in format
+        ``"chrom:start-end"``.
+
+    nuc : :class:`pandas.DataFrame`
+        Dataframe with columns "gc_content" and "length" in the order of ``intervals``.
+
+    cache_dir : :obj:`str`
+        Directory of the cache.
+
+        Default is the value of "preferences:nucleotide_content_cache:location" in the
+        configuration or "~/.ngs_toolkit/nucleotide_content_cache".
+    """
+    cache_file = _get_gc_content_length_cache_file(genome_file, intervals, cache_dir)
+    tmp_file = cache_file + ".{}.tmp.npy".format(os.getpid())
+    np.save(tmp_file, nuc[["gc_content", "length"]].values.astype(np.float64))
+    os.replace(tmp_file, cache_file)
+
+
+def _get_offset_coordinates(beds):
+    """
+    Get the coordinates of several sets of intervals on a single axis
+    where chromosomes, in lexicographic order, follow each other.
+    Returns the sorted chromosome names, the length of each
+    chromosome in the axis and the start and end coordinates of each set.
+    """
+    # factorize each set by hashing and sort only the unique chromosome names
+    factors = [pd.factorize(bed["chrom"].values) for bed in beds]
+    chroms = np.unique(
+        np.concatenate([np.asarray(uniques, dtype=object).astype(str) for _, uniques in factors]))
+    span = max([int(bed["end"].max()) for bed in beds if not bed.empty] + [0]) + 1
+    coords = list()
+    for bed, (codes, uniques) in zip(beds, factors):
+        ranks = np.searchsorted(chroms, np.asarray(uniques, dtype=object).astype(str))
+        offset = ranks.astype(np.int64)[codes] * span
+        coords.append(
+            (bed["start"].values.astype(np.int64) + offset,
+             bed["end"].values.astype(np.int64) + offset))
+    return chroms, span, coords
+
+
+def merge_intervals(bed):
+    """
+    Merge overlapping and book-ended intervals with sorted NumPy arrays,
+    as ``bedtools sort | bedtools merge``.
+
+    Parameters
+    ----------
+    bed : :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start" and "end".
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start" and "end" of merged intervals,
+        sorted by chromosome and start position.
+    """
+    chroms, span, [(starts, ends)] = _get_offset_coordinates([bed])
+    if starts.shape[0] == 0:
+        return bed[["chrom", "start", "end"]].iloc[:0].reset_index(drop=True)
+    order = np.argsort(starts, kind="mergesort")
+    starts = starts[order]
+    ends = ends[order]
+    # a new interval starts where the start is past all previous ends
+    breaks = np.concatenate(
+        [[0], np.flatnonzero(starts[1:] > np.maximum.accumulate(ends)[:-1]) + 1])
+    starts = starts[breaks]
+    ends = np.maximum.reduceat(ends, breaks)
+    offsets = starts // span
+    return pd.DataFrame(
+        {"chrom": chroms[offsets], "start": starts - offsets * span, "end": ends - offsets * span}
+    )
+
+
+def remove_overlapping_intervals(bed, other):
+    """
+    Remove intervals overlapping by at least one basepair
+    any interval of another set, as ``bedtools intersect -v``.
+
+    Parameters
+    ----------
+    bed : :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start" and "end".
+
+    other : :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start" and "end".
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Intervals of ``bed`` not overlapping ``other``, in the same order.
+    """
+    if bed.empty or other.empty:
+        return bed
+    other = merge_intervals(other)
+    _, _, [(starts, ends), (other_starts, other_ends)] = _get_offset_coordinates([bed, other])
+    # merged intervals are disjoint, so the first one ending after
+    # each start is the only one which can overlap
+    idx = np.searchsorted(other_ends, starts, side="right")
+    overlap = np.zeros(starts.shape[0], dtype=bool)
+    within = idx < other_starts.shape[0]
+    overlap[within] = other_starts[idx[within]] < ends[within]
+    return bed.loc[~overlap]
+
+
+def select_intervals_by_score(bed):
+    """
+    Select intervals greedily by descending score, keeping each interval
+    only if it does not overlap by at least one basepair an interval already kept.
+    Ties are broken by position.
+
+    Each interval is checked only against the intervals starting less than
+    the maximum interval length before it, and only if it was kept,
+    which makes this efficient for intervals of fixed width such as extended peak summits
+    and keeps memory use linear in the number of intervals.
+
+    Parameters
+    ----------
+    bed : :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start", "end" and "score".
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Dataframe with kept intervals sorted by chromosome and start position.
+    """
+    _, _, [(starts, ends)] = _get_offset_coordinates([bed])
+    if starts.shape[0] == 0:
+        return bed.reset_index(drop=True)
+    order = np.argsort(starts, kind="mergesort")
+    starts = starts[order]
+    ends = ends[order]
+    width = int((ends - starts).max())
+    # range of intervals which can overlap each interval
+    lo = np.searchsorted(starts, starts - width, side="right")
+    hi = np.searchsorted(starts, ends, side="left")
+    rank = np.argsort(-bed["score"].values[order], kind="mergesort")
+
+    # windows are small, so plain Python sequences are faster than NumPy slicing
+    starts_l = starts.tolist()
+    ends_l = ends.tolist()
+    removed = bytearray(starts.shape[0])
+    keep = bytearray(starts.shape[0])
+    for i, l, h in zip(rank.tolist(), lo[rank].tolist(), hi[rank].tolist()):
+        if removed[i]:
+            continue
+        keep[i] = 1
+        start = starts_l[i]
+        for j in range(l, h):
+            if ends_l[j] > start:
+                removed[j] = 1
+    keep = np.frombuffer(keep, dtype=np.uint8).astype(bool)
+    return bed.iloc[order[keep]].reset_index(drop=True)
+
+
+def count_interval_overlaps(bed, other):
+    """
+    Count the intervals of another set overlapping by at least one basepair
+    each interval, as ``bedtools intersect -c``.
+
+    Parameters
+    ----------
+    bed : {:class:`pandas.DataFrame`, :obj:`str`, :class:`pybedtools.bedtool.BedTool`}
+        Dataframe with columns "chrom", "start" and "end" or BED file.
+
+    other : {:class:`pandas.DataFrame`, :obj:`str`, :class:`pybedtools.bedtool.BedTool`}
+        Dataframe with columns "chrom", "start" and "end" or BED file.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Number of intervals of ``other`` overlapping each interval of ``bed``.
+    """
+    if not isinstance(bed, pd.DataFrame):
+        bed = read_bed_coordinates(bed)
+    if not isinstance(other, pd.DataFrame):
+        other = read_bed_coordinates(other)
+    _, _, [(starts, ends), (other_starts, other_ends)] = _get_offset_coordinates([bed, other])
+    return _count_sorted_overlaps(np.sort(other_starts), np.sort(other_ends), starts, ends)
+
+
+def _expand_ranges(lo, hi):
+    """
+    Expand ranges of positions into pairs of the index of each range
+    and each position within it.
+    """
+    counts = np.maximum(hi - lo, 0)
+    idx = np.repeat(np.arange(counts.shape[0]), counts)
+    pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - lo, counts)
+    return idx, pos
+
+
+def get_closest_intervals(bed, other):
+    """
+    Find the closest intervals of another set to each interval with sorted NumPy arrays,
+    as ``bedtools closest -D b``, reporting all ties.
+
+    Distances between non-overlapping intervals are the number of basepairs
+    between them plus one, and zero for overlapping intervals.
+    Distances are negative if the interval is upstream of the closest interval,
+    with respect to the strand of the closest interval if ``other`` has a "strand" column.
+
+    Parameters
+    ----------
+    bed : :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start" and "end".
+
+    other : :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start", "end" and optionally "strand".
+
+    Returns
+    -------
+    :obj:`tuple`
+        Three arrays, with the position of each interval in ``bed``,
+        the position of its closest interval in ``other`` (-1 if there is none
+        in the same chromosome) and their signed distance (NaN if there is none).
+        There is one element per closest interval, ordered by position in ``bed``
+        and then in ``other``.
+    """
+    _, span, [(starts, ends), (other_starts, other_ends)] = _get_offset_coordinates([bed, other])
+    chroms = starts // span
+    n = starts.shape[0]
+    if other_starts.shape[0] == 0:
+        return np.arange(n), np.full(n, -1), np.full(n, np.nan)
+    by_start = np.argsort(other_starts, kind="mergesort")
+    by_end = np.argsort(other_ends, kind="mergesort")
+    sorted_starts = other_starts[by_start]
+    sorted_ends = other_ends[by_end]
+    width = int((other_ends - other_starts).max())
+
+    # overlapping intervals start less than the maximum width before each start
+    idx, pos = _expand_ranges(
+        np.searchsorted(sorted_starts, starts - width, side="right"),
+        np.searchsorted(sorted_starts, ends, side="left"),
+    )
+    pos = by_start[pos]
+    overlap = other_ends[pos] > starts[idx]
+    idx, pos = idx[overlap], pos[overlap]
+    has_overlap = np.bincount(idx, minlength=n) > 0
+
+    # closest intervals ending before each start and starting after each end
+    left = np.searchsorted(sorted_ends, starts, side="right") - 1
+    right = np.searchsorted(sorted_starts, ends, side="left")
+    left_end = sorted_ends[np.maximum(left, 0)]
+    right_start = sorted_starts[np.minimum(right, sorted_starts.shape[0] - 1)]
+    left_dist = np.where(
+        (left >= 0) & (left_end // span == chroms) & ~has_overlap,
+        starts - left_end + 1, np.iinfo(np.int64).max)
+    right_dist = np.where(
+        (right < sorted_starts.shape[0]) & (right_start // span == chroms) & ~has_overlap,
+        right_start - ends + 1, np.iinfo(np.int64).max)
+    dist = np.minimum(left_dist, right_dist)
+    found = dist < np.iinfo(np.int64).max
+    use_left = found & (left_dist == dist)
+    use_right = found & (right_dist == dist)
+
+    # ties share the same end (on the left) or start (on the right)
+    left_idx, left_pos = _expand_ranges(
+        np.where(use_left, np.searchsorted(sorted_ends, left_end, side="left"), 0),
+        np.where(use_left, left + 1, 0),
+    )
+    right_idx, right_pos = _expand_ranges(
+        np.where(use_right, right, 0),
+        np.where(use_right, np.searchsorted(sorted_starts, right_start, side="right"), 0),
+    )
+    missing = np.flatnonzero(~has_overlap & ~found)
+
+    index = np.concatenate([idx, left_idx, right_idx, missing])
+    other_index = np.concatenate(
+        [pos, by_end[left_pos], by_start[right_pos], np.full(missing.shape[0], -1)])
+    # intervals on the left of the closest are upstream of it
+    distance = np.concatenate(
+        [
+            np.zeros(idx.shape[0]),
+            dist[left_idx],
+            -dist[right_idx],
+            np.full(missing.shape[0], np.nan),
+        ]
+    )
+    if "strand" in other.columns:
+        minus = np.append(other["strand"].values == "-", False)[other_index] & (distance != 0)
+        distance[minus] = -distance[minus]
+    order = np.lexsort((other_index, index))
+    return index[order], other_index[order], distance[order]
+
+
+def get_interval_overlaps(bed, other, fraction=None):
+    """
+    Find all pairs of overlapping intervals of two sets with sorted NumPy arrays,
+    as ``bedtools intersect -wa -wb``.
+
+    Intervals of ``other`` are grouped in classes of similar length, and for each class
+    only the intervals starting less than the maximum length of the class before
+    each interval are checked, so that long intervals do not make all others candidates.
+
+    Parameters
+    ----------
+    bed : :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start" and "end".
+
+    other : :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start" and "end".
+
+    fraction : :obj:`float`
+        Minimum overlap required as a fraction of the length of each interval of ``bed``,
+        as ``bedtools intersect -f``.
+
+        Default is to require an overlap of one basepair.
+
+    Returns
+    -------
+    :obj:`tuple`
+        Two arrays with the positions of each overlapping interval in ``bed`` and in ``other``,
+        ordered by position in ``bed`` and then in ``other``.
+    """
+    _, _, [(starts, ends), (other_starts, other_ends)] = _get_offset_coordinates([bed, other])
+    lengths = other_ends - other_starts
+    # classes of lengths in powers of four
+    classes = np.floor(np.log2(np.maximum(lengths, 1)) / 2).astype(np.int64)
+    index = list()
+    other_index = list()
+    for c in np.unique(classes):
+        members = np.flatnonzero(classes == c)
+        members = members[np.argsort(other_starts[members], kind="mergesort")]
+        idx, pos = _expand_ranges(
+            np.searchsorted(
+                other_starts[members], starts - int(lengths[members].max()), side="right"),
+            np.searchsorted(other_starts[members], ends, side="left"),
+        )
+        pos = members[pos]
+        overlap = np.minimum(ends[idx], other_ends[pos]) - np.maximum(starts[idx], other_starts[pos])
+        if fraction is None:
+            keep = overlap > 0
+        else:
+            keep = (overlap > 0) & (overlap / (ends[idx] - starts[idx]) >= fraction)
+        index.append(idx[keep])
+        other_index.append(pos[keep])
+    index = np.concatenate(index + [np.array([], dtype=np.int64)])
+    other_index = np.concatenate(other_index + [np.array([], dtype=np.int64)])
+    order = np.lexsort((other_index, index))
+    return index[order], other_index[order]
+
+
+def annotate_intervals(bed, layers, fraction=None, missing=None):
+    """
+    Annotate intervals with the names of overlapping features of several annotation layers
+    (e.g. genomic context, chromatin states) in a single pass over all features.
+
+    Parameters
+    ----------
+    bed : :class:`pandas.DataFrame`
+        Dataframe with columns "chrom", "start" and "end".
+
+    layers : :obj:`dict`
+        Dictionary of layer names and BED files or dataframes with columns
+        "chrom", "start", "end" and "name" of features.
+
+    fraction : :obj:`float`
+        Minimum overlap required as a fraction of the length of each interval of ``bed``.
+        See :func:`ngs_toolkit.utils.get_interval_overlaps`.
+
+        Default is to require an overlap of one basepair.
+
+    missing : :obj:`dict`
+        Dictionary of layer names and a value to report for intervals
+        without overlapping features in that layer, as ``bedtools intersect -loj``.
+        Intervals without features are not reported in layers not in ``missing``.
+
+        Default is not to report intervals without features.
+
+    Returns
+    -------
+    :obj:`dict`
+        Dictionary of layer names and dataframes with columns "chrom", "start", "end"
+        and the layer name, with one row per interval and overlapping feature,
+        indexed by the position of the interval in ``bed``.
+    """
+    if missing is None:
+        missing = dict()
+    layers = {
+        name: layer if isinstance(layer, pd.DataFrame) else read_bed_coordinates(layer, name=True)
+        for name, layer in layers.items()
+    }
+    features = pd.concat(
+        [layer[["chrom", "start", "end", "name"]] for layer in layers.values()],
+        ignore_index=True,
+    )
+    codes = np.repeat(np.arange(len(layers)), [layer.shape[0] for layer in layers.values()])
+    index, other_index = get_interval_overlaps(bed, features, fraction=fraction)
+
+    names = features["name"].values.astype(object)
+    output = dict()
+    for i, name in enumerate(layers):
+        sel = codes[other_index] == i
+        idx = index[sel]
+        values = names[other_index[sel]]
+        if name in missing:
+            empty = np.setdiff1d(np.arange(bed.shape[0]), idx)
+            idx = np.concatenate([idx, empty])
+            values = np.concatenate([values, np.full(empty.shape[0], missing[name], dtype=object)])
+            order = np.argsort(idx, kind="mergesort")
+            idx, values = idx[order], values[order]
+        output[name] = pd.DataFrame(
+            {
+                "chrom": bed["chrom"].values[idx],
+                "start": bed["start"].values[idx],
+                "end": bed["end"].values[idx],
+                name: values,
+            },
+            index=idx,
+        )
+    return output
+
+
+_REFERENCE_STORE_CACHE = dict()
+
+
+class ReferenceStore:
+    """
+    Reference annotations of a genome assembly (e.g. TSSs, genomic context or
+    blacklisted regions, and chromosome sizes) stored in a single binary file,
+    with the intervals of each annotation layer sorted by chromosome and start position.
+
+    The file is an uncompressed NumPy ".npz" archive of arrays where text columns are
+    stored as integer codes into arrays of their unique values, so it loads without
+    parsing text. Use :meth:`load` to share a store across the whole process.
+
+    Parameters
+    ----------
+    store_file : :obj:`str`
+        Path to store file written with :meth:`write`.
+    """
+
+    def __init__(self, store_file):
+        self.store_file = store_file
+        with np.load(store_file, allow_pickle=False) as data:
+            self._arrays = {key: data[key] for key in data.files}
+        self.chroms = self._arrays["chroms"].astype(object)
+        self.chrom_sizes = {
+            chrom: int(size)
+            for chrom, size in zip(self.chroms, self._arrays["chrom_sizes"])
+            if size >= 0
+        }
+        self.layers = self._arrays["layers"].tolist()
+        self._intervals = dict()
+
+    @classmethod
+    def load(cls, store_file):
+        """
+        Load a store once per process, reading it again only if the file was modified.
+        """
+        key = os.path.abspath(store_file)
+        modified = os.path.getmtime(key)
+        if (key not in _REFERENCE_STORE_CACHE) or (_REFERENCE_STORE_CACHE[key][0] != modified):
+            _REFERENCE_STORE_CACHE[key] = (modified, cls(key))
+        return _REFERENCE_STORE_CACHE[key][1]
+
+    @staticmethod
+    def write(store_file, layers, chrom_sizes=None):
+        """
+        Write annotation layers to a store file.
+
+        Parameters
+        ----------
+        store_file : :obj:`str`
+            Path to output file.
+
+        layers : :obj:`dict`
+            Dictionary of layer names and dataframes with columns "chrom", "start", "end"
+            and any other columns, which are stored as text.
+
+        chrom_sizes : :obj:`dict`
+            Dictionary of chromosome names and their length.
+
+            Default is not to store chromosome sizes.
+        """
+        if chrom_sizes is None:
+            chrom_sizes = dict()
+        chroms = np.unique(
+            np.concatenate(
+                [np.asarray(list(chrom_sizes), dtype=str)]
+                + [np.asarray(layer["chrom"].values, dtype=str) for layer in layers.values()]
+            )
+        )
+        arrays = {
+            "chroms": chroms,
+            "chrom_sizes": np.array([chrom_sizes.get(c, -1) for c in chroms], dtype=np.int64),
+            "layers": np.asarray(list(layers), dtype=str),
+        }
+        for name, layer in layers.items():
+            codes = np.searchsorted(chroms, np.asarray(layer["chrom"].values, dtype=str))
+            starts = layer["start"].values.astype(np.int64)
+            ends = layer["end"].values.astype(np.int64)
+            order = np.lexsort((ends, starts, codes))
+            columns = [c for c in layer.columns if c not in ["chrom", "start", "end"]]
+            arrays[name + "/start"] = starts[order]
+            arrays[name + "/end"] = ends[order]
+            # position of the first interval of each chromosome
+            arrays[name + "/offsets"] = np.searchsorted(
+                codes[order], np.arange(chroms.shape[0] + 1)
+            ).astype(np.int64)
+            arrays[name + "/columns"] = np.asarray(columns, dtype=str)
+            for column in columns:
+                values, uniques = pd.factorize(np.asarray(layer[column].values, dtype=str)[order])
+                arrays[name + "/" + column + "/codes"] = values.astype(np.int32)
+                arrays[name + "/" + column + "/values"] = np.asarray(uniques, dtype=str)
+        # write to a temporary file first so that readers never see partial files
+        tmp_file = store_file + ".tmp"
+        with open(tmp_file, "wb") as handle:
+            np.savez(handle, **arrays)
+        os.replace(tmp_file, store_file)
+
+    def get_intervals(self, layer, chrom=None):
+        """
+        Get the intervals of an annotation layer sorted by chromosome and start position.
+
+        Parameters
+        ----------
+        layer : :obj:`str`
+            Name of layer.
+
+        chrom : :obj:`str`
+            Chromosome to get intervals for.
+
+            Default is to get intervals of all chromosomes.
+
+        Returns
+        -------
+        :class:`pandas.DataFrame`
+            Dataframe with columns "chrom", "start", "end" and the other columns of the layer.
+
+        Raises
+        ------
+        ValueError
+            If ``layer`` is not in the store.
+        """
+        from ngs_toolkit import _LOGGER
+
+        if layer not in self.layers:
+            msg = "Layer '{}' not in reference store '{}'.".format(layer, self.store_file)
+            _LOGGER.error(msg)
+            raise ValueError(msg)
+        offsets = self._arrays[layer + "/offsets"]
+        if chrom is None:
+            if layer not in self._intervals:
+                self._intervals[layer] = self._get_interval_slice(layer, 0, offsets[-1])
+            return self._intervals[layer].copy()
+        i = np.searchsorted(self.chroms.astype(str), chrom)
+        if (i == self.chroms.shape[0]) or (self.chroms[i] != chrom):
+            return self._get_interval_slice(layer, 0, 0)
+        return self._get_interval_slice(layer, offsets[i], offsets[i + 1])
+
+    def _get_interval_slice(self, layer, first, last):
+        offsets = self._arrays[layer + "/offsets"]
+        codes = np.repeat(
+            np.arange(self.chroms.shape[0]), np.diff(np.clip(offsets, first, last))
+        )
+        intervals = pd.DataFrame(
+            {
+                "chrom": self.chroms[codes],
+                "start": self._arrays[layer + "/start"][first:last],
+                "end": self._arrays[layer + "/end"][first:last],
+            }
+        )
+        for column in self._arrays[layer + "/columns"].tolist():
+            values = self._arrays[layer + "/" + column + "/values"].astype(object)
+            intervals[column] = values[self._arrays[layer + "/" + column + "/codes"][first:last]]
+        return intervals
+
+
+def _join_unique_values(codes, values, size, exclude=None):
+    """
+    Join with commas the unique values of each group given by integer codes.
+    Groups with one value, the most frequent case, are filled without joining strings.
+    """
+    values = pd.DataFrame({"code": codes, "value": values})
+    if exclude is not None:
+        values = values.loc[values["value"] != exclude]
+    values = values.drop_duplicates()
+    output = np.full(size, "", dtype=object)
+    single = ~values["code"].duplicated(keep=False).values
+    output[values["code"].values[single]] = values["value"].values[single]
+    if not single.all():
+        joined = values.loc[~single].groupby("code", sort=False)["value"].agg(",".join)
+        output[joined.index.values] = joined.values
+    return output
+
+
+def timedelta_to_years(x):
+    """
+    Convert a timedelta to years.
+
+    Parameters
+    ----------
+    x : :class:`pandas.Timedelta`
+        A Timedelta object.
+
+    Returns
+    -------
+    float
+        Years.
+    """
+    return x / np.timedelta64(60 * 60 * 24 * 365, "s")
+
+
+def signed_max(x, f=0.66, axis=0):
+    """
+    Return maximum or minimum of array ``x`` depending on the sign of the
+    majority of values.
+    If there isn't a clear majority (at least ``f`` fraction in one side),
+    return mean of values.
+    If given a pandas DataFrame or 2D numpy array, will apply this across rows
+    (columns-wise, axis=0) or across columns (row-wise, axis=1).
+    Will return :obj:`numpy.nan` for non-numeric values.
+
+    Parameters
+    ----------
+    x : {:class:`numpy.ndarray`, :class:`pandas.DataFrame`, :class:`pandas.Series`}
+        Input values to reduce
+    f : :obj:`float`
+        Threshold fraction of majority agreement.
+
+        Default is 0.66.
+    axis : :obj:`int`
+        Whether to apply across rows (0, column-wise) or
+        across columns (1, row-wise).
+
+        Default is 0.
+
+    Returns
+    -------
+    :class:`pandas.Series`
+        Pandas Series with values reduced to the signed maximum.
+    """
+    if axis not in [0, 1]:
+        raise ValueError("Axis must be one of 0 (columns) or 1 (rows).")
+
+    if len(x.shape) == 1:
+        # Return nan if not numeric
+        if x.dtype not in [np.float_, np.int_]:
+            return np.nan
+
+        types = [type(i) for i in x]
+        if not all(types):
+            return np.nan
+        else:
+            if types[0] not in [np.float_, float, np.int_, int]:
+                return np.nan
+        ll = float(len(x))
+        neg = sum(x < 0)
+        pos = sum(x > 0)
+        obs_f = max(neg / ll, pos / ll)
+        if obs_f >= f:
+            if neg > pos:
+                return min(x)
+            else:
+                return max(x)
+        else:
+            return np.mean(x)
+    else:
+        if not isinstance(x, pd.DataFrame):
+            x = pd.DataFrame(x)
+
+        if axis == 1:
+            x = x.T
+        res = pd.Series(np.empty(x.shape[1]), index=x.columns)
+        for v in x.columns:
+            res[v] = signed_max(x.loc[:, v], f=f)
+
+        return res
+
+
+def log_pvalues(x, f=0.1):
+    """
+    Calculate -log10(p-value) of array.
+
+    Replaces infinite values with:
+
+    .. highlight:: python
+    .. code-block:: python
+
+        max(x) + max(x) * f
+
+    that is, fraction ``f`` more than the maximum non-infinite -log10(p-value).
+
+    Parameters
+    ----------
+    x : :class:`pandas.Series`
+        Series with numeric values
+    f : :obj:`float`
+        Fraction to augment the maximum value by if ``x`` contains infinite values.
+
+        Defaults to 0.1.
+
+    Returns
+    -------
+    :class:`pandas.Series`
+        Transformed values.
+    """
+    ll = -np.log10(x)
+    rmax = ll[ll != np.inf].max()
+    return ll.replace(np.inf, rmax + rmax * f)
+
+
+def fix_dataframe_header(df, force_dtypes=float):
+    # First try to see whether it is not a MultiIndex after all
+    if df.index.isna().any().sum() == 1:
+        df.columns = df.loc[df.index.isna(), :].squeeze()
+        df.columns.name = None
+        df.index.name = None
+        return df.loc[~df.index.isna()]
+    # If so, get potential categorical columns and prepare MultiIndex with them
+    cols = list()
+    for i in df.index[:300]:
+        try:
+            df.loc[i, :].astype(float)
+        except ValueError:
+            cols.append(i)
+    if len(cols) == 0:
+        pass
+    elif len(cols) == 1:
+        df.columns = df.loc[cols[0]]
+        df = df.loc[~df.index.isin(cols)]
+    else:
+        df.columns = pd.MultiIndex.from_arrays(df.loc[cols].values, names=cols)
+        df = df.loc[~df.index.isin(cols)]
+    df.index.name = None
+    if force_dtypes is not None:
+        return df.astype(force_dtypes)
+    else:
+        return df
+
+
+def r2pandas_df(r_df):
+    """Make :class:`pandas.DataFrame` from a ``R`` dataframe given by :class:`rpy`."""
+    from rpy2.robjects import pandas2ri
+
+    if isinstance(r_df, pd.DataFrame):
+        return r_df
+    if isinstance(r_df, np.recarray):
+        return pd.DataFrame.from_records(r_df)
+    df = pd.DataFrame(np.asarray(r_df)).T
+    df.columns = [str(x) for x in r_df.colnames]
+    df.index = [str(x) for x in r_df.rownames]
+    return df
+
+
+def recarray2pandas_df(recarray):
+    """Make :class:`pandas.DataFrame` from :class:`numpy.recarray`."""
+    df = pd.DataFrame.from_records(recarray, index=list(range(recarray.shape[0])))
+    return df
 
 
 # def detect_peaks(x, mph=None, mpd=1, threshold=0, edge='rising',
 #                  kpsh=False, valley=False):
 #     """Detect peaks in data based on their amplitude and other features.
 
-#     Parameters
-#     ----------
-#     x : 1D array_like
-#         data.
-#     mph : {None, number},optional (default = None)
-#         detect peaks that are greater than minimum peak height.
-#     mpd : positive integer,optional (default = 1)
-#         detect peaks that are at least separated by minimum peak distance (in
-#         number of data).
-#     threshold : positive number,optional (default = 0)
-#         detect peaks (valleys) that are greater (smaller) than `threshold`
-#         in relation to their immediate neighbors.
-#     edge : {None, 'rising', 'falling', 'both'},optional (default = 'rising')
-#         for a flat peak, keep only the rising edge ('rising'), only the
-#         falling edge ('falling'), both edges ('both'), or don't detect a
-#         flat peak (None).
-#     kpsh: :obj:`bool`,optional (default = False)
-#         keep peaks with same height even if they are closer than `mpd`.
-#     valley: :obj:`bool`,optional (default = False)
-#         if True (1), detect valleys (local minima) instead of peaks.
-#     show: :obj:`bool`,optional (default = False)
-#         if True (1), plot data in matplotlib figure.
-#     ax : a matplotlib.axes.Axes instance,optional (default = None).
+#     Parameters
+#     ----------
+#     x : 1D array_like
+#         data.
+#     mph : {None, number},optional (default = None)
+#         detect peaks that are greater than minimum peak height.
+#     mpd : positive integer,optional (default = 1)
+#         detect peaks that are at least separated by minimum peak distance (in
+#         number of data).
+#     threshold : positive number,optional (default = 0)
+#         detect peaks (valleys) that are greater (smaller) than `threshold`
+#         in relation to their immediate neighbors.
+#     edge : {None, 'rising', 'falling', 'both'},optional (default = 'rising')
+#         for a flat peak, keep only the rising edge ('rising'), only the
+#         falling edge ('falling'), both edges ('both'), or don't detect a
+#         flat peak (None).
+#     kpsh: :obj:`bool`,optional (default = False)
+#         keep peaks with same height even if they are closer than `mpd`.
+#     valley: :obj:`bool`,optional (default = False)
+#         if True (1), detect valleys (local minima) instead of peaks.
+#     show: :obj:`bool`,optional (default = False)
+#         if True (1), plot data in matplotlib figure.
+#     ax : a matplotlib.axes.Axes instance,optional (default = None).
+
+#     Returns
+#     -------
+#     ind : 1D array_like
+#         indeces of the peaks in `x`.
+
+#     Notes
+#     -----
+#     The detection of valleys instead of peaks is performed internally by simply
+#     negating the data: `ind_valleys = detect_peaks(-x)`
+
+#     The function can handle NaN's
+
+#     See this IPython Notebook [1]_.
+
+#     References
+#     ----------
+#     .. [1] http://nbviewer.ipython.org/github/demotu/BMC/blob/master/notebooks/DetectPeaks.ipynb
+
+#     Examples
+#     --------
+#     >>> from detect_peaks import detect_peaks
+#     >>> x = np.random.randn(100)
+#     >>> x[60:81] = np.nan
+#     >>> # detect all peaks and plot data
+#     >>> ind = detect_peaks(x, show=True)
+#     >>> print(ind)
+
+#     >>> x = np.sin(2*np.pi*5*np.linspace(0, 1, 200)) + np.random.randn(200)/5
+#     >>> # set minimum peak height = 0 and minimum peak distance = 20
+#     >>> detect_peaks(x, mph=0, mpd=20, show=True)
+
+#     >>> x = [0, 1, 0, 2, 0, 3, 0, 2, 0, 1, 0]
+#     >>> # set minimum peak distance = 2
+#     >>> detect_peaks(x, mpd=2, show=True)
+
+#     >>> x = np.sin(2*np.pi*5*np.linspace(0, 1, 200)) + np.random.randn(200)/5
+#     >>> # detection of valleys instead of peaks
+#     >>> detect_peaks(x, mph=0, mpd=20, valley=True, show=True)
+
+#     >>> x = [0, 1, 1, 0, 1, 1, 0]
+#     >>> # detect both edges
+#     >>> detect_peaks(x, edge='both', show=True)
+
+#     >>> x = [-2, 1, -2, 2, 1, 1, 3, 0]
+#     >>> # set threshold = 2
+#     >>> detect_peaks(x, threshold = 2, show=True)
+
+#     x = np.atleast_1d(x).astype('float64')
+#     if x.size < 3:
+#         return np.array([], dtype=int)
+#     if valley:
+#         x = -x
+#     # find indices of all peaks
+#     dx = x[1:] - x[:-1]
+#     # handle NaN's
+#     indnan = np.where(np.isnan(x))[0]
+#     if indnan.size:
+#         x[indnan] = np.inf
+#         dx[np.where(np.isnan(dx))[0]] = np.inf
+#     ine, ire, ife = np.array([[], [], []], dtype=int)
+#     if not edge:
+#         ine = np.where((np.hstack((dx, 0)) < 0) & (np.hstack((0, dx)) > 0))[0]
+#     else:
+#         if edge.lower() in ['rising', 'both']:
+#             ire = np.where((np.hstack((dx, 0)) <= 0) & (np.hstack((0, dx)) > 0))[0]
+#         if edge.lower() in ['falling', 'both']:
+#             ife = np.where((np.hstack((dx, 0)) < 0) & (np.hstack((0, dx)) >= 0))[0]
+#     ind = np.unique(np.hstack((ine, ire, ife)))
+#     # handle NaN's
+#     if ind.size and indnan.size:
+#         # NaN's and values close to NaN's cannot be peaks
+#         ind = ind[np.in1d(ind, np.unique(np.hstack((indnan, indnan - 1, indnan + 1))), invert=True)]
+#     # first and last values of x cannot be peaks
+#     if ind.size and ind[0] == 0:
+#         ind = ind[1:]
+#     if ind.size and ind[-1] == x.size - 1:
+#         ind = ind[:-1]
+#     # remove peaks < minimum peak height
+#     if ind.size and mph is not None:
+#         ind = ind[x[ind] >= mph]
+#     # remove peaks - neighbors < threshold
+#     if ind.size and threshold > 0:
+#         dx = np.min(np.vstack([x[ind] - x[ind - 1], x[ind] - x[ind + 1]]), axis=0)
+#         ind = np.delete(ind, np.where(dx < threshold)[0])
+#     # detect small peaks closer than minimum peak distance
+#     if ind.size and mpd > 1:
+#         ind = ind[np.argsort(x[ind])][::-1]  # sort ind by peak height
+#         idel = np.zeros(ind.size, dtype=bool)
+#         for i in range(ind.size):
+#             if not idel[i]:
+#                 # keep peaks with the same height if kpsh is True
+#                 idel = idel | (ind >= ind[i] - mpd) & (ind <= ind[i] + mpd) \
+#                     & (x[ind[i]] > x[ind] if kpsh else True)
+#                 idel[i] = 0  # Keep current peak
+#         # remove the small peaks and sort back the indices by their occurrence
+#         ind = np.sort(ind[~idel])
+
+#     return ind
+
+
+def collect_md5_sums(df):
+    """
+    Given a dataframe with columns with paths to md5sum files ending in '_md5sum',
+    replace the paths to the md5sum files with the actual checksums.
+
+    Useful to use in combination with :func:`~ngs_toolkit.general.project_to_geo`.
+
+    Parameters
+    ----------
+    df : :class:`pandas.DataFrame`
+        A dataframe with columns ending in '_md5sum'.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        DataFrame with md5sum columns replaced with the actual md5sums.
+    """
+    cols = df.columns[df.columns.str.endswith("_md5sum")]
+    for col in cols:
+        for i, path in df.loc[:, col].iteritems():
+            if not pd.isnull(path):
+                cont = open(path, "r").read().strip()
+                if any([x.isspace() for x in cont]):
+                    cont = cont.split(" ")[0]
+                df.loc[i, col] = cont
+    return df
+
+
+def decompress_file(file, output_file=None):
+    """
+    Decompress a gzip-compressed file out-of-memory.
+    Output default is same as ``file`` without ".gz" ending.
+    """
+    import shutil
+    import gzip
+
+    from ngs_toolkit import _LOGGER
+
+    if output_file is None:
+        if not file.endswith(".gz"):
+            msg = "`output_file` not given and input_file does not end in '.gz'."
+            _LOGGER.error(msg)
+            raise ValueError(msg)
+        output_file = file.replace(".gz", "")
+    # decompress
+    with gzip.open(file, "rb") as _in:
+        with open(output_file, "wb") as _out:
+            shutil.copyfileobj(_in, _out)
+            # for line in _in.readlines():
+            # _out.write(line.decode('utf-8'))
+
+
+def compress_file(file, output_file=None):
+    """
+    Compress a gzip-compressed file out-of-memory.
+    Output default is same as ``file`` but with ".gz" ending.
+    """
+    import shutil
+    import gzip
+
+    if output_file is None:
+        output_file = file + ".gz"
+    # compress
+    with open(file, "rb") as _in:
+        with gzip.open(output_file, "wb") as _out:
+            shutil.copyfileobj(_in, _out)
+            # for line in _in.readlines():
+            # _out.write(line.decode('utf-8'))
+
+
+def download_file(url, output_file, chunk_size=1024):
+    """
+    Download a file and write to disk in chunks (not in memory).
+
+    Parameters
+    ----------
+    url : :obj:`str`
+        URL to download from.
+    output_file : :obj:`str`
+        Path to file as output.
+    chunk_size : :obj:`int`
+        Size in bytes of chunk to write to disk at a time.
+    """
+    if url.startswith("ftp://"):
+        import shutil
+        import urllib.request as request
+        from contextlib import closing
+
+        with closing(request.urlopen(url)) as r:
+            with open(output_file, "wb") as f:
+                shutil.copyfileobj(r, f)
+    else:
+        import requests
+
+        response = requests.get(url, stream=True)
+        with open(output_file, "wb") as outfile:
+            outfile.writelines(response.iter_content(chunk_size=chunk_size))
+
+
+def download_gzip_file(url, output_file, decompress=True, **kwargs):
+    """
+    Download a gzip compressed file and write uncompressed
+    file to disk in chunks (not in memory).
+
+    Parameters
+    ----------
+    url : :obj:`str`
+        URL to download from.
+    output_file : :obj:`str`
+        Path to file as output.
+    **kwargs : :obj:`dict`
+        Additional keyword arguments are passed to :meth:`ngs_toolkit.utils.download_file`.
+    """
+    if not output_file.endswith(".gz"):
+        output_file += ".gz"
+    download_file(url, output_file, **kwargs)
+    if not decompress:
+        return
+    decompress_file(output_file)
+    if os.path.exists(output_file) and os.path.exists(output_file.replace(".gz", "")):
+        os.remove(output_file)
+
+
+def deseq_results_to_bed_file(
+    deseq_result_file,
+    bed_file,
+    sort=True,
+    ascending=False,
+    normalize=False,
+    significant_only=False,
+    alpha=0.05,
+    abs_fold_change=1.0,
+):
+    """
+    Write BED file with fold changes from DESeq2 as score value.
+    """
+    from ngs_toolkit import _LOGGER
+    from sklearn.preprocessing import MinMaxScaler
+
+    df = pd.read_csv(deseq_result_file, index_col=0)
+
+    msg = "DESeq2 results do not have a 'log2FoldChange' column."
+    if not ("log2FoldChange" in df.columns.tolist()):
+        _LOGGER.error(msg)
+        raise AssertionError(msg)
+
+    if sort is True:
+        df = df.sort_values("log2FoldChange", ascending=ascending)
+
+    if significant_only is True:
+        df = df.loc[(df["padj"] < alpha) & (df["log2FoldChange"].abs() > abs_fold_change), :]
+
+    # decompose index string (chrom:start-end) into columns
+    df["chrom"] = map(lambda x: x[0], df.index.str.split(":"))
+    r = pd.Series(map(lambda x: x[1], df.index.str.split(":")))
+    df["start"] = map(lambda x: x[0], r.str.split("-"))
+    df["end"] = map(lambda x: x[1], r.str.split("-"))
+    df["name"] = df.index
+    if normalize:
+        MinMaxScaler(feature_range=(0, 1000)).fit_transform(df["log2FoldChange"])
+    df["score"] = df["log2FoldChange"]
+
+    df[["chrom", "start", "end", "name", "score"]].to_csv(
+        bed_file, sep="\t", header=False, index=False
+    )
+
+
+def homer_peaks_to_bed(homer_peaks, output_bed):
+    """
+    Convert HOMER peak calls to BED format.
+    The fifth column (score) is the -log10(p-value) of the peak.
+
+    Parameters
+    ----------
+    homer_peaks : :obj:`str`
+        HOMER output with peak calls.
+    output_bed : :obj:`str`
+        Output BED file.
+    """
+    df = pd.read_csv(homer_peaks, sep="\t", comment="#", header=None)
+    df["-log_pvalue"] = (-np.log10(df.iloc[:, -2])).replace(pd.np.inf, 1000)
+    df["name"] = df[1] + ":" + df[2].astype(str) + "-" + df[3].astype(str)
+
+    (
+        df[[1, 2, 3, "name", "-log_pvalue"]]
+        .sort_values([1, 2, 3], ascending=True)
+        .to_csv(output_bed, header=False, index=False, sep="\t")
+    )
+
+
+def macs2_call_chipseq_peak(signal_samples, control_samples, output_dir, name, distributed=True):
+    """
+    Call ChIP-seq peaks with MACS2 in a slurm job.
+
+    Parameters
+    ----------
+    signal_samples : :obj:`list`
+        Signal Sample objects.
+
+    control_samples : :obj:`list`
+        Background Sample objects.
+
+    output_dir : :obj:`list`
+        Parent directory where MACS2 outputs will be stored.
+
+    name : :obj:`str`
+        Name of the MACS2 comparison being performed.
+
+    distributed: :obj:`bool`
+        Whether to submit a SLURM job or to return a string with the runnable.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    runnable = """macs2 callpeak -t {0} -c {1} -n {2} --outdir {3}""".format(
+        " ".join([s.aligned_filtered_bam for s in signal_samples]),
+        " ".join([s.aligned_filtered_bam for s in control_samples]),
+        name,
+        output_dir,
+    )
+
+    if distributed:
+        job_name = "macs2_{}".format(name)
+        job_file = os.path.join(output_dir, name + ".macs2.sh")
+        submit_job(runnable, job_file, cores=4, jobname=job_name)
+    else:
+        return runnable
+
+
+def homer_call_chipseq_peak_job(
+    signal_samples, control_samples, output_dir, name, distributed=True
+):
+    """
+    Call ChIP-seq peaks with MACS2 in a slurm job.
+
+    Parameters
+    ----------
+    signal_samples : :obj:`list`
+        Signal Sample objects.
+
+    control_samples : :obj:`list`
+        Background Sample objects.
+
+    output_dir : :obj:`list`
+        Parent directory where MACS2 outputs will be stored.
+
+    name : :obj:`str`
+        Name of the MACS2 comparison being performed.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # make tag directory for the signal and background samples separately
+    signal_tag_directory = os.path.join(output_dir, "homer_tag_dir_" + name + "_signal")
+    fs = " ".join([s.aligned_filtered_bam for s in signal_samples])
+    runnable = """makeTagDirectory {0} {1}\n""".format(signal_tag_directory, fs)
+    background_tag_directory = os.path.join(output_dir, "homer_tag_dir_" + name + "_background")
+    fs = " ".join([s.aligned_filtered_bam for s in control_samples])
+    runnable += """makeTagDirectory {0} {1}\n""".format(background_tag_directory, fs)
+
+    # call peaks
+    output_file = os.path.join(output_dir, name, name + "_homer_peaks.factor.narrowPeak")
+    runnable += """findPeaks {signal} -style factor -o {output_file} -i {background}\n""".format(
+        output_file=output_file, background=background_tag_directory, signal=signal_tag_directory,
+    )
+    output_file = os.path.join(output_dir, name, name + "_homer_peaks.histone.narrowPeak")
+    runnable += """findPeaks {signal} -style histone -o {output_file} -i {background}""".format(
+        output_file=output_file, background=background_tag_directory, signal=signal_tag_directory,
+    )
+
+    if distributed:
+        job_name = "homer_findPeaks_{}".format(name)
+        job_file = os.path.join(output_dir, name + ".homer.sh")
+        submit_job(runnable, job_file, cores=4, jobname=job_name)
+    else:
+        return runnable
+
+
+def bed_to_fasta(
+    input_bed, output_fasta, genome_file, engine="bedtools", reverse_complement=False
+):
+    """
+    Retrieves DNA sequence underlying specific region.
+    Names of FASTA entries will be of form ``chr:start-end``.
+
+    Parameters
+    ----------
+    input_bed : :obj:`str`
+        Path to input BED file.
+
+    output_fasta : :obj:`str`
+        Path to resulting FASTA file.
+
+    genome_file : :obj:`str`
+        Path to genome file in either 2bit or FASTA format.
+        With the "bedtools" ``engine``, will be guessed based on file ending.
+
+    engine : :obj:`str`
+        Engine used to retrieve the sequences. One of "bedtools"
+        (uses ``twoBitToFa`` for 2bit files or ``bedtools getfasta`` for FASTA files)
+        or "numpy" (reads all regions from the memory-mapped genome file in-process
+        with :class:`~ngs_toolkit.utils.GenomeSequence`, guessing its format from its content).
+
+        Default is "bedtools".
+
+    reverse_complement : :obj:`bool`
+        Whether to write the reverse complement of the sequence of regions
+        on the "-" strand, given by the sixth column of ``input_bed``.
+        Only available with the "numpy" ``engine``.
+
+        Default is :obj:`False`.
+
+    Raises
+    ----------
+    ValueError
+        If `genome_file` format cannot be guessed or is not supported,
+        if ``engine`` is not one of the available options or if ``reverse_complement``
+        is requested for an ``input_bed`` without strand or with the "bedtools" ``engine``.
+    """
+    from ngs_toolkit import _LOGGER
+
+    if engine not in ["bedtools", "numpy"]:
+        msg = "`engine` must be one of 'bedtools' or 'numpy'."
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+
+    if engine == "numpy":
+        bed = pd.read_csv(input_bed, sep="\t", header=None, comment="#")
+        if reverse_complement and bed.shape[1] < 6:
+            msg = "`input_bed` must have a strand column to get the reverse complement."
+            _LOGGER.error(msg)
+            raise ValueError(msg)
+        bed = bed.rename(columns={0: "chrom", 1: "start", 2: "end", 5: "strand"})
+        reverse = (bed["strand"] == "-").values if reverse_complement else False
+        sequences = GenomeSequence(genome_file).fetch_intervals(bed, reverse_complement=reverse)
+        with open(output_fasta, "w") as handle:
+            for name, sequence in zip(bed_to_index(bed), sequences):
+                handle.write(">" + name + "\n" + sequence + "\n")
+        return
+
+    if reverse_complement:
+        msg = "`reverse_complement` is only available with the 'numpy' `engine`."
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+
+    if genome_file.endswith(".2bit"):
+        bed_to_fasta_through_2bit(input_bed, output_fasta, genome_file)
+    elif genome_file.endswith(".fa") or genome_file.endswith(".fasta"):
+        bed_to_fasta_through_fasta(input_bed, output_fasta, genome_file)
+    else:
+        msg = "Format of `genome_file` must be one of FASTA or 2bit, "
+        msg += "with file ending in either '.fa', '.fasta' or '.2bit'"
+        raise ValueError(msg)
+
+
+def read_bed_file_three_columns(input_bed: str) -> pd.DataFrame:
+    """Read BED file into dataframe, make 'name' field from location."""
+    bed = pd.read_csv(
+        input_bed, sep="\t", header=None, usecols=[0, 1, 2], names=["chrom", "start", "end"]
+    )
+    bed["name"] = bed_to_index(bed)
+    return bed
+
+
+def bed_to_fasta_through_2bit(input_bed, output_fasta, genome_2bit):
+    """
+    Retrieves DNA sequence underlying specific region.
+    Requires the `twoBitToFa` command from UCSC kent tools.
+    Names of FASTA entries will be of form "chr:start-end".
+
+    Parameters
+    ----------
+    input_bed : :obj:`str`
+        Path to input BED file.
+
+    output_fasta : :obj:`str`
+        Path to resulting FASTA file.
+
+    genome_2bit : :obj:`str`
+        Path to genome 2bit file.
+    """
+    import subprocess
+
+    tmp_bed = input_bed + ".tmp.bed"
+    bed = read_bed_file_three_columns(input_bed)
+    bed.to_csv(tmp_bed, sep="\t", header=None, index=False)
+
+    cmd = "twoBitToFa {0} -bed={1} {2}".format(genome_2bit, tmp_bed, output_fasta)
+    subprocess.call(cmd.split(" "))
+    os.remove(tmp_bed)
+
+
+def bed_to_fasta_through_fasta(input_bed, output_fasta, genome_fasta):
+    """
+    Retrieves DNA sequence underlying specific region.
+    Uses ``bedtools getfasta`` (internally through pybedtools.BedTool.sequence).
+    Names of FASTA entries will be of form "chr:start-end".
+
+    Parameters
+    ----------
+    input_bed : :obj:`str`
+        Path to input BED file.
+
+    output_fasta : :obj:`str`
+        Path to resulting FASTA file.
+
+    genome_fasta : :obj:`str`
+        Path to genome FASTA file.
+    """
+    import pybedtools
+
+    bed = read_bed_file_three_columns(input_bed)
+    bed = pybedtools.BedTool.from_dataframe(bed)
+    bed.sequence(fi=genome_fasta, fo=output_fasta, name=True)
+
+
+def count_reads_in_intervals(
+    bam,
+    intervals,
+    permissive=True,
+    engine="count",
+    as_array=False,
+    read_filters=None,
+    count_mode="reads",
+    reference=None,
+):
+    """
+    Count total number of reads in a iterable holding strings
+    representing genomic intervals of the form ``"chrom:start-end"``.
+
+    Please make sure both ``intervals`` and ``bam`` file are
+    zero- or one-indexed.
+
+    Parameters
+    ----------
+    bam : :obj:`str`
+        Path to BAM or CRAM file.
+
+    intervals : :obj:`list`
+        List of strings with genomic coordinates in format
+        ``"chrom:start-end"``.
+
+    permissive : :obj:`bool`
+        Whether intervals which cannot be quantified (e.g. chromosome not in
+        the BAM file) should be skipped or an error thrown.
+
+        Default is :obj:`True`.
+
+    engine : :obj:`str`
+        How to count reads. One of:
+
+            * "count": one indexed query per interval with :meth:`pysam.AlignmentFile.count`;
+            * "sweep": read each chromosome once and assign reads to
+              the intervals with a sweep line over sorted read coordinates.
+
+        Both give the same counts. The "sweep" engine is much faster for
+        large numbers of intervals (e.g. a consensus peak set).
+
+        Default is "count".
+
+    as_array : :obj:`bool`
+        Whether to return counts as an unsigned 32-bit integer array in the
+        order of ``intervals`` instead of a dict keyed by interval.
+        This is much more compact to keep in memory and to send between processes.
+        Intervals which cannot be quantified will have a count of zero.
+
+        Default is :obj:`False`.
+
+    read_filters : :obj:`dict`
+        Filters to apply to reads while counting, which avoid having to
+        produce a filtered BAM file beforehand. Possible keys are:
+
+            * "min_mapq": minimum mapping quality;
+            * "include_flags": SAM flag bits which must all be set;
+            * "exclude_flags": SAM flag bits which must all be unset;
+            * "skip_duplicates": whether to skip reads marked as duplicates;
+            * "fragment_length": tuple with minimum and maximum absolute template
+              length (inclusive). Reads without template length are excluded.
+
+        Default is not to filter reads.
+
+    count_mode : :obj:`str`
+        What to count in each interval. One of:
+
+            * "reads": reads overlapping the interval;
+            * "fragments": read pairs (fragments) overlapping the interval, counted once
+              over the span of the fragment given by the mate with positive template length.
+              Reads without template length are counted as in "reads";
+            * "cutsites": Tn5 transposase insertion sites, given by the read start
+              shifted by +4 bp for reads in the forward strand and the read end
+              shifted by -5 bp for reads in the reverse strand.
+
+        Modes other than "reads" always use the "sweep" engine.
+
+        Default is "reads".
+
+    reference : :obj:`str`
+        Path to reference genome FASTA file, required to decode CRAM files.
+        If a shared reference cache was set up with
+        :func:`~ngs_toolkit.utils.setup_reference_cache`,
+        sequences are read from the cache instead.
+
+        Default is :obj:`None`.
+
+    Returns
+    -------
+    :obj:`dict` or :class:`numpy.ndarray`
+        Dict of read counts for each interval or array of read counts
+        in the order of ``intervals`` if ``as_array`` is :obj:`True`.
+
+    Raises
+    -------
+    :obj:`ValueError`
+        If ``engine`` or ``count_mode`` are not one of the available options,
+        ``read_filters`` has unknown keys or
+        if not ``permissive`` and an interval cannot be quantified.
+    """
+    import pysam
+    from ngs_toolkit import _LOGGER
+
+    engines = ["count", "sweep"]
+    if engine not in engines:
+        msg = "`engine` must be one of '{}'.".format("', '".join(engines))
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+    read_filters = _check_read_filters(read_filters)
+    _check_count_mode(count_mode)
+    if engine == "sweep" or count_mode != "reads":
+        return _count_reads_in_intervals_sweep(
+            bam, intervals, permissive=permissive, as_array=as_array,
+            read_filters=read_filters, count_mode=count_mode, reference=reference,
+        )
+
+    counts = dict()
+    callback = "nofilter"
+    if read_filters:
+        callback = _get_read_filter_callback(read_filters)
+
+    bam = _open_alignment_file(bam, reference=reference)
+
+    errors: int = 0
+    for interval in intervals:
+        try:
+            counts[interval] = bam.count(region=interval, read_callback=callback)
+        except ValueError:
+            if permissive:
+                errors += 1
+            else:
+                raise
+            # if fix_off_by_one:
+            #     i = interval.split(":")[1]
+            #     s = (
+            #         interval.split(":")[0] +
+            #         ":" + str(int(i.split("-")[0]) + 1) +
+            #         "-" + str(int(i.split("-")[1]) + 1))
+            #     counts[interval] = bam.count(region=s)
+    bam.close()
+    if errors > 0:
+        _LOGGER.warning("There have been %i errors. Beware.", errors)
+
+    if as_array:
+        return np.fromiter(
+            (counts.get(interval, 0) for interval in intervals),
+            dtype=np.uint32,
+            count=len(intervals),
+        )
+    return counts
+
+
+def split_intervals_by_chromosome(intervals):
+    """
+    Split an iterable of strings of the form ``"chrom:start-end"`` into
+    one list per chromosome, keeping the original order within each list.
+
+    Parameters
+    ----------
+    intervals : :obj:`list`
+        List of strings with genomic coordinates in format
+        ``"chrom:start-end"``.
+
+    Returns
+    -------
+    :obj:`list`
+        List of lists of intervals, one per chromosome,
+        ordered from the chromosome with most to the one with fewest intervals.
+    """
+    intervals = np.asarray(list(intervals), dtype=object)
+    return [intervals[pos].tolist() for pos in _get_chromosome_positions(intervals)]
+
+
+def _get_chromosome_positions(intervals):
+    """
+    Get the positions of intervals of each chromosome in an iterable of strings
+    of the form ``"chrom:start-end"``, from the chromosome with most
+    to the one with fewest intervals.
+    """
+    chroms = pd.Series(list(intervals), dtype=object).str.rsplit(":", n=1).str[0]
+    positions = chroms.groupby(chroms, sort=False).indices.values()
+    return sorted(positions, key=len, reverse=True)
+
+
+def count_reads_in_intervals_parallel(bams, intervals, cores=None, compact=False, **kwargs):
+    """
+    Count reads in genomic intervals for several BAM files in parallel,
+    splitting the work of each BAM file by chromosome.
+
+    The tasks of counting reads in each (BAM file, chromosome) pair
+    are distributed in a pool of processes with the :class:`parmap` library,
+    so that all cores are used even when there are few BAM files.
+    If a ``reference`` is given, the processes decode CRAM files with its
+    reference cache (see :func:`~ngs_toolkit.utils.setup_reference_cache`).
+
+    Parameters
+    ----------
+    bams : :obj:`list`
+        Paths to BAM files.
+
+    intervals : :obj:`list`
+        List of strings with genomic coordinates in format
+        ``"chrom:start-end"``.
+
+    cores : :obj:`int`
+        Number of processes to use.
+
+        Defaults to the number of available cores.
+
+    compact : :obj:`bool`
+        Whether each task should return an unsigned 32-bit integer array
+        of counts which is placed in a preallocated matrix, instead of a dict
+        keyed by interval. This reduces memory usage and communication
+        between processes, particularly for large numbers of intervals.
+        Intervals which cannot be quantified will have a count of zero.
+
+        Default is :obj:`False`.
+
+    **kwargs : :obj:`dict`
+        Additional keyword arguments are passed to
+        :func:`~ngs_toolkit.utils.count_reads_in_intervals`.
+
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Read counts of shape (intervals, bams), in the order of ``intervals``.
+    """
+    import parmap
+
+    intervals = np.asarray(list(intervals), dtype=object)
+    positions = _get_chromosome_positions(intervals)
+    tasks = [(bam, intervals[pos].tolist()) for pos in positions for bam in bams]
+    with _get_reference_cache_pool(kwargs.get("reference"), cores) as pool:
+        res = parmap.starmap(
+            count_reads_in_intervals,
+            tasks,
+            pm_pool=pool,
+            pm_parallel=True,
+            as_array=compact,
+            **kwargs,
+        )
+
+    if compact:
+        # fill in matrix with counts of each task
+        matrix = np.zeros((len(intervals), len(bams)), dtype=np.uint32)
+        for i, c in enumerate(res):
+            matrix[positions[i // len(bams)], i % len(bams)] = c
+        return pd.DataFrame(
+            matrix, index=intervals, columns=range(len(bams))
+        )
+
+    # reassemble counts of each BAM file in the order of intervals
+    counts = [dict() for _ in bams]
+    for i, c in enumerate(res):
+        counts[i % len(bams)].update(c)
+    return pd.DataFrame(
+        {i: pd.Series(c, dtype=np.int64) for i, c in enumerate(counts)},
+        index=intervals,
+    )
+
+
+def count_reads_in_interval_sets(
+    bam,
+    interval_sets,
+    permissive=True,
+    stats=False,
+    read_filters=None,
+    count_mode="reads",
+    reference=None,
+):
+    """
+    Count reads in several sets of genomic intervals with a single pass over a BAM file.
+
+    Each chromosome of the BAM file is read once, and reads are assigned to the
+    intervals of all sets as in the "sweep" engine of
+    :func:`~ngs_toolkit.utils.count_reads_in_intervals`.
+
+    Parameters
+    ----------
+    bam : :obj:`str`
+        Path to BAM or CRAM file.
+
+    interval_sets : :obj:`dict`
+        Dictionary of set names and lists of strings with
+        genomic coordinates in format ``"chrom:start-end"``.
+
+    permissive : :obj:`bool`
+        Whether intervals which cannot be quantified (e.g. chromosome not in
+        the BAM file) should be given a count of zero or an error thrown.
+
+        Default is :obj:`True`.
+
+    stats : :obj:`bool`
+        Whether to also return the total number of reads in the BAM file
+        and the number of reads overlapping any interval of each set,
+        from which the fraction of reads in each set (e.g. FRiP) can be derived.
+        Both count the same reads: all records placed in a chromosome,
+        passing ``read_filters`` and counted according to ``count_mode``.
+        Reads overlapping several intervals of a set are counted only once.
+
+        Default is :obj:`False`.
+
+    read_filters : :obj:`dict`
+        Filters to apply to reads while counting, which avoid having to
+        produce a filtered BAM file beforehand. Possible keys are:
+
+            * "min_mapq": minimum mapping quality;
+            * "include_flags": SAM flag bits which must all be set;
+            * "exclude_flags": SAM flag bits which must all be unset;
+            * "skip_duplicates": whether to skip reads marked as duplicates;
+            * "fragment_length": tuple with minimum and maximum absolute template
+              length (inclusive). Reads without template length are excluded.
+
+        Default is not to filter reads.
+
+    count_mode : :obj:`str`
+        What to count in each interval. One of:
+
+            * "reads": reads overlapping the interval;
+            * "fragments": read pairs (fragments) overlapping the interval, counted once
+              over the span of the fragment given by the mate with positive template length.
+              Reads without template length are counted as in "reads";
+            * "cutsites": Tn5 transposase insertion sites, given by the read start
+              shifted by +4 bp for reads in the forward strand and the read end
+              shifted by -5 bp for reads in the reverse strand.
+
+        Default is "reads".
+
+    reference : :obj:`str`
+        Path to reference genome FASTA file, required to decode CRAM files.
+        If a shared reference cache was set up with
+        :func:`~ngs_toolkit.utils.setup_reference_cache`,
+        sequences are read from the cache instead.
+
+        Default is :obj:`None`.
+
+    Returns
+    -------
+    :obj:`dict`
+        Dictionary of set names and unsigned 32-bit integer arrays of
+        read counts in the order of the intervals of each set.
+        If ``stats``, a tuple of the former and a dictionary with
+        the total number of reads (key "total") and number of reads in
+        each set (keyed by set name).
+
+    Raises
+    -------
+    :obj:`ValueError`
+        If ``count_mode`` is not one of the available options,
+        ``read_filters`` has unknown keys or
+        if not ``permissive`` and an interval cannot be quantified.
+    """
+    _check_count_mode(count_mode)
+    read_stats = dict() if stats else None
+    counts, _ = _count_reads_in_interval_sets_sweep(
+        bam, interval_sets, permissive=permissive, stats=read_stats,
+        read_filters=_check_read_filters(read_filters), count_mode=count_mode,
+        reference=reference)
+    if stats:
+        return counts, read_stats
+    return counts
+
+
+def measure_bigwig_signal(bigwig, intervals, statistic="sum", permissive=True):
+    """
+    Measure the signal of a bigWig file in genomic intervals.
+
+    The signal of each chromosome is read with a single query and summed
+    for all intervals in that chromosome at once.
+    Intervals are interpreted as zero-based and half-open as in BED files and
+    parts of intervals without signal count as zero.
+
+    Requires the "pyBigWig" Python library to be installed.
+
+    Parameters
+    ----------
+    bigwig : :obj:`str`
+        Path to bigWig file.
+
+    intervals : :obj:`list`
+        List of strings with genomic coordinates in format
+        ``"chrom:start-end"``.
+
+    statistic : :obj:`str`
+        Statistic of the signal to compute in each interval.
+        One of "sum" or "mean".
+
+        Default is "sum".
+
+    permissive : :obj:`bool`
+        Whether intervals which cannot be quantified (e.g. chromosome not in
+        the bigWig file) should be given a value of zero or an error thrown.
+
+        Default is :obj:`True`.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Signal in the order of ``intervals``.
+
+    Raises
+    -------
+    :obj:`ValueError`
+        If ``statistic`` is not one of the available options or
+        if not ``permissive`` and an interval cannot be quantified.
+    """
+    import pyBigWig
+    from ngs_toolkit import _LOGGER
+
+    statistics = ["sum", "mean"]
+    if statistic not in statistics:
+        msg = "`statistic` must be one of '{}'.".format("', '".join(statistics))
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+
+    intervals = list(intervals)
+    coords = _parse_interval_strings(intervals, zero_based=True)
+    bw = pyBigWig.open(bigwig)
+    chrom_sizes = bw.chroms()
+    valid = (coords["valid"] & coords["chrom"].isin(list(chrom_sizes.keys()))).values
+    errors = int((~valid).sum())
+    if errors > 0 and not permissive:
+        bw.close()
+        msg = "Could not quantify intervals: '{}'.".format(
+            "', '".join([str(intervals[i]) for i in np.flatnonzero(~valid)[:10]]))
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+
+    signal = np.zeros(len(intervals), dtype=np.float64)
+    for chrom, chrom_coords in coords.loc[valid].groupby("chrom", sort=False):
+        # signal is returned as sorted, non-overlapping intervals with constant value
+        values = np.asarray(bw.intervals(chrom) or [], dtype=np.float64).reshape(-1, 3)
+        starts = chrom_coords["start"].values
+        ends = np.minimum(chrom_coords["end"].values, chrom_sizes[chrom])
+        signal[chrom_coords.index] = _integrate_step_function(
+            values[:, 0], values[:, 1], values[:, 2], ends
+        ) - _integrate_step_function(values[:, 0], values[:, 1], values[:, 2], starts)
+    bw.close()
+    if errors > 0:
+        _LOGGER.warning("There have been %i errors. Beware.", errors)
+
+    if statistic == "mean":
+        lengths = (coords["end"] - coords["start"]).values
+        signal = np.divide(signal, lengths, out=np.zeros_like(signal), where=lengths > 0)
+    return signal
+
+
+def _integrate_step_function(starts, ends, values, positions):
+    """
+    Integrate a step function given by sorted, non-overlapping intervals with
+    constant values from the start of the chromosome up to each position.
+    """
+    area = np.concatenate([[0.0], np.cumsum((ends - starts) * values)])
+    i = np.searchsorted(ends, positions, side="right")
+    res = area[i]
+    # add part of interval containing the position
+    partial = i < starts.shape[0]
+    j = i[partial]
+    res[partial] += np.clip(positions[partial] - starts[j], 0, None) * values[j]
+    return res
+
+
+def get_bam_fingerprint(bam):
+    """
+    Get a fingerprint of a BAM/CRAM file which changes if the file changes.
+
+    The fingerprint is based on the absolute path, size and modification time
+    of the BAM file and of its index if existing.
+
+    Parameters
+    ----------
+    bam : :obj:`str`
+        Path to BAM file.
+
+    Returns
+    -------
+    :obj:`str`
+        Hexadecimal fingerprint of the BAM file.
+    """
+    import hashlib
+
+    bam = os.path.abspath(bam)
+    fields = [bam]
+    for file in [bam, bam + ".bai", bam + ".csi", bam + ".crai"]:
+        if os.path.exists(file):
+            stat = os.stat(file)
+            fields += [file, str(stat.st_size), str(stat.st_mtime_ns)]
+    return hashlib.sha1("\t".join(fields).encode()).hexdigest()
+
+
+def get_site_set_hash(intervals):
+    """
+    Get a hash of an ordered set of genomic intervals.
+
+    Parameters
+    ----------
+    intervals : :obj:`list`
+        List of strings with genomic coordinates in format
+        ``"chrom:start-end"``.
+
+    Returns
+    -------
+    :obj:`str`
+        Hexadecimal hash of the intervals.
+    """
+    import hashlib
+
+    return hashlib.sha1("\n".join(map(str, intervals)).encode()).hexdigest()
+
+
+def _get_coverage_cache_dir(cache_dir=None):
+    """
+    Get the directory of the coverage cache, by default from the configuration
+    value "preferences:coverage_cache:location" or a directory
+    within the ngs_toolkit cache directory.
+    """
+    from ngs_toolkit import _CONFIG, JOBLIB_CACHE_DIR
+
+    if cache_dir is None:
+        try:
+            cache_dir = _CONFIG["preferences"]["coverage_cache"]["location"]
+        except KeyError:
+            cache_dir = None
+    if cache_dir is None:
+        cache_dir = os.path.join(JOBLIB_CACHE_DIR, "coverage_cache")
+    cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def _get_coverage_cache_key(bam, intervals, parameters=None):
+    """
+    Get the key of a coverage cache entry and its metadata.
+    """
+    import hashlib
+    import json
+
+    metadata = {
+        "bam": os.path.abspath(bam),
+        "bam_fingerprint": get_bam_fingerprint(bam),
+        "site_hash": get_site_set_hash(intervals),
+        "parameters": parameters or dict(),
+    }
+    key = hashlib.sha1(
+        json.dumps(
+            [metadata["bam_fingerprint"], metadata["site_hash"], metadata["parameters"]],
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()
+    return key, metadata
+
+
+def get_cached_coverage(bam, intervals, parameters=None, cache_dir=None):
+    """
+    Get read counts of a BAM file in genomic intervals from the coverage cache.
+
+    Entries are identified by a fingerprint of the BAM file
+    (see :func:`~ngs_toolkit.utils.get_bam_fingerprint`),
+    a hash of the intervals (see :func:`~ngs_toolkit.utils.get_site_set_hash`)
+    and any parameters used to count reads.
+    Retrieving an entry marks it as recently used.
+
+    Parameters
+    ----------
+    bam : :obj:`str`
+        Path to BAM file.
+
+    intervals : :obj:`list`
+        List of strings with genomic coordinates in format
+        ``"chrom:start-end"``.
 
-#     Returns
-#     -------
-#     ind : 1D array_like
-#         indeces of the peaks in `x`.
+    parameters : :obj:`dict`
+        Parameters used to count reads.
 
-#     Notes
-#     -----
-#     The detection of valleys instead of peaks is performed internally by simply
-#     negating the data: `ind_valleys = detect_peaks(-x)`
+        Default is :obj:`None`.
 
-#     The function can handle NaN's
+    cache_dir : :obj:`str`
+        Directory of the coverage cache.
 
-#     See this IPython Notebook [1]_.
+        Default is the value of "preferences:coverage_cache:location" in the
+        configuration or "~/.ngs_toolkit/coverage_cache".
 
-#     References
-#     ----------
-#     .. [1] http://nbviewer.ipython.org/github/demotu/BMC/blob/master/notebooks/DetectPeaks.ipynb
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Read counts in the order of ``intervals`` or :obj:`None` if not in cache.
+    """
+    import json
+    import time
 
-#     Examples
-#     --------
-#     >>> from detect_peaks import detect_peaks
-#     >>> x = np.random.randn(100)
-#     >>> x[60:81] = np.nan
-#     >>> # detect all peaks and plot data
-#     >>> ind = detect_peaks(x, show=True)
-#     >>> print(ind)
+    cache_dir = _get_coverage_cache_dir(cache_dir)
+    key, _ = _get_coverage_cache_key(bam, intervals, parameters)
+    array_file = os.path.join(cache_dir, key + ".npy")
+    metadata_file = os.path.join(cache_dir, key + ".json")
+    try:
+        counts = np.load(array_file)
+        metadata = json.load(open(metadata_file, "r"))
+    except (IOError, ValueError):
+        return None
+    if counts.shape[0] != len(intervals):
+        return None
+    metadata["last_access"] = time.time()
+    _write_json_atomically(metadata, metadata_file)
+    return counts
 
-#     >>> x = np.sin(2*np.pi*5*np.linspace(0, 1, 200)) + np.random.randn(200)/5
-#     >>> # set minimum peak height = 0 and minimum peak distance = 20
-#     >>> detect_peaks(x, mph=0, mpd=20, show=True)
 
-#     >>> x = [0, 1, 0, 2, 0, 3, 0, 2, 0, 1, 0]
-#     >>> # set minimum peak distance = 2
-#     >>> detect_peaks(x, mpd=2, show=True)
+def cache_coverage(bam, intervals, counts, parameters=None, cache_dir=None, max_size=None):
+    """
+    Store read counts of a BAM file in genomic intervals in the coverage cache.
 
-#     >>> x = np.sin(2*np.pi*5*np.linspace(0, 1, 200)) + np.random.randn(200)/5
-#     >>> # detection of valleys instead of peaks
-#     >>> detect_peaks(x, mph=0, mpd=20, valley=True, show=True)
+    If the size of the cache exceeds ``max_size`` after adding the entry,
+    the least recently used entries are evicted.
 
-#     >>> x = [0, 1, 1, 0, 1, 1, 0]
-#     >>> # detect both edges
-#     >>> detect_peaks(x, edge='both', show=True)
+    Parameters
+    ----------
+    bam : :obj:`str`
+        Path to BAM file.
 
-#     >>> x = [-2, 1, -2, 2, 1, 1, 3, 0]
-#     >>> # set threshold = 2
-#     >>> detect_peaks(x, threshold = 2, show=True)
+    intervals : :obj:`list`
+        List of strings with genomic coordinates in format
+        ``"chrom:start-end"``.
 
-#     x = np.atleast_1d(x).astype('float64')
-#     if x.size < 3:
-#         return np.array([], dtype=int)
-#     if valley:
-#         x = -x
-#     # find indices of all peaks
-#     dx = x[1:] - x[:-1]
-#     # handle NaN's
-#     indnan = np.where(np.isnan(x))[0]
-#     if indnan.size:
-#         x[indnan] = np.inf
-#         dx[np.where(np.isnan(dx))[0]] = np.inf
-#     ine, ire, ife = np.array([[], [], []], dtype=int)
-#     if not edge:
-#         ine = np.where((np.hstack((dx, 0)) < 0) & (np.hstack((0, dx)) > 0))[0]
-#     else:
-#         if edge.lower() in ['rising', 'both']:
-#             ire = np.where((np.hstack((dx, 0)) <= 0) & (np.hstack((0, dx)) > 0))[0]
-#         if edge.lower() in ['falling', 'both']:
-#             ife = np.where((np.hstack((dx, 0)) < 0) & (np.hstack((0, dx)) >= 0))[0]
-#     ind = np.unique(np.hstack((ine, ire, ife)))
-#     # handle NaN's
-#     if ind.size and indnan.size:
-#         # NaN's and values close to NaN's cannot be peaks
-#         ind = ind[np.in1d(ind, np.unique(np.hstack((indnan, indnan - 1, indnan + 1))), invert=True)]
-#     # first and last values of x cannot be peaks
-#     if ind.size and ind[0] == 0:
-#         ind = ind[1:]
-#     if ind.size and ind[-1] == x.size - 1:
-#         ind = ind[:-1]
-#     # remove peaks < minimum peak height
-#     if ind.size and mph is not None:
-#         ind = ind[x[ind] >= mph]
-#     # remove peaks - neighbors < threshold
-#     if ind.size and threshold > 0:
-#         dx = np.min(np.vstack([x[ind] - x[ind - 1], x[ind] - x[ind + 1]]), axis=0)
-#         ind = np.delete(ind, np.where(dx < threshold)[0])
-#     # detect small peaks closer than minimum peak distance
-#     if ind.size and mpd > 1:
-#         ind = ind[np.argsort(x[ind])][::-1]  # sort ind by peak height
-#         idel = np.zeros(ind.size, dtype=bool)
-#         for i in range(ind.size):
-#             if not idel[i]:
-#                 # keep peaks with the same height if kpsh is True
-#                 idel = idel | (ind >= ind[i] - mpd) & (ind <= ind[i] + mpd) \
-#                     & (x[ind[i]] > x[ind] if kpsh else True)
-#                 idel[i] = 0  # Keep current peak
-#         # remove the small peaks and sort back the indices by their occurrence
-#         ind = np.sort(ind[~idel])
+    counts : :class:`numpy.ndarray`
+        Read counts in the order of ``intervals``.
 
-#     return ind
+    parameters : :obj:`dict`
+        Parameters used to count reads.
 
+        Default is :obj:`None`.
 
-def collect_md5_sums(df):
-    """
-    Given a dataframe with columns with paths to md5sum files ending in '_md5sum',
-    replace the paths to the md5sum files with the actual checksums.
+    cache_dir : :obj:`str`
+        Directory of the coverage cache.
 
-    Useful to use in combination with :func:`~ngs_toolkit.general.project_to_geo`.
+        Default is the value of "preferences:coverage_cache:location" in the
+        configuration or "~/.ngs_toolkit/coverage_cache".
 
-    Parameters
-    ----------
-    df : :class:`pandas.DataFrame`
-        A dataframe with columns ending in '_md5sum'.
+    max_size : :obj:`int`
+        Maximum size of the cache in megabytes.
+
+        Default is the value of "preferences:coverage_cache:max_size" in the
+        configuration or no limit.
 
     Returns
     -------
-    :class:`pandas.DataFrame`
-        DataFrame with md5sum columns replaced with the actual md5sums.
+    :obj:`str`
+        Key of the cache entry.
     """
-    cols = df.columns[df.columns.str.endswith("_md5sum")]
-    for col in cols:
-        for i, path in df.loc[:, col].iteritems():
-            if not pd.isnull(path):
-                cont = open(path, "r").read().strip()
-                if any([x.isspace() for x in cont]):
-                    cont = cont.split(" ")[0]
-                df.loc[i, col] = cont
-    return df
+    import time
+    from ngs_toolkit import _CONFIG
 
+    cache_dir = _get_coverage_cache_dir(cache_dir)
+    key, metadata = _get_coverage_cache_key(bam, intervals, parameters)
+    metadata["n_sites"] = len(intervals)
+    metadata["created"] = metadata["last_access"] = time.time()
 
-def decompress_file(file, output_file=None):
+    array_file = os.path.join(cache_dir, key + ".npy")
+    tmp_file = array_file + ".{}.tmp.npy".format(os.getpid())
+    np.save(tmp_file, np.asarray(counts))
+    os.replace(tmp_file, array_file)
+    _write_json_atomically(metadata, os.path.join(cache_dir, key + ".json"))
+
+    if max_size is None:
+        try:
+            max_size = _CONFIG["preferences"]["coverage_cache"]["max_size"]
+        except KeyError:
+            max_size = None
+    if max_size is not None:
+        _evict_coverage_cache(cache_dir, max_size * 1024 ** 2, keep=key)
+    return key
+
+
+def _write_json_atomically(obj, file):
     """
-    Decompress a gzip-compressed file out-of-memory.
-    Output default is same as ``file`` without ".gz" ending.
+    Write an object to a JSON file through a temporary file,
+    so that concurrent readers never see a partial file.
     """
-    import shutil
-    import gzip
+    import json
+
+    tmp_file = file + ".{}.tmp".format(os.getpid())
+    with open(tmp_file, "w") as handle:
+        json.dump(obj, handle)
+    os.replace(tmp_file, file)
+
 
+def _evict_coverage_cache(cache_dir, max_bytes, keep=None):
+    """
+    Remove least recently used entries of the coverage cache until
+    its size is no more than ``max_bytes``, never removing entry ``keep``.
+    """
     from ngs_toolkit import _LOGGER
 
-    if output_file is None:
-        if not file.endswith(".gz"):
-            msg = "`output_file` not given and input_file does not end in '.gz'."
-            _LOGGER.error(msg)
-            raise ValueError(msg)
-        output_file = file.replace(".gz", "")
-    # decompress
-    with gzip.open(file, "rb") as _in:
-        with open(output_file, "wb") as _out:
-            shutil.copyfileobj(_in, _out)
-            # for line in _in.readlines():
-            # _out.write(line.decode('utf-8'))
+    entries = inspect_coverage_cache(cache_dir=cache_dir)
+    total = entries["size"].sum()
+    for key, entry in entries.sort_values("last_access").iterrows():
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        _LOGGER.debug("Evicting coverage cache entry '%s'.", key)
+        _remove_coverage_cache_entry(cache_dir, key)
+        total -= entry["size"]
 
 
-def compress_file(file, output_file=None):
+def _remove_coverage_cache_entry(cache_dir, key):
     """
-    Compress a gzip-compressed file out-of-memory.
-    Output default is same as ``file`` but with ".gz" ending.
+    Remove the files of an entry of the coverage cache.
     """
-    import shutil
-    import gzip
-
-    if output_file is None:
-        output_file = file + ".gz"
-    # compress
-    with open(file, "rb") as _in:
-        with gzip.open(output_file, "wb") as _out:
-            shutil.copyfileobj(_in, _out)
-            # for line in _in.readlines():
-            # _out.write(line.decode('utf-8'))
+    for ext in [".npy", ".json"]:
+        file = os.path.join(cache_dir, key + ext)
+        if os.path.exists(file):
+            os.remove(file)
 
 
-def download_file(url, output_file, chunk_size=1024):
+def inspect_coverage_cache(cache_dir=None):
     """
-    Download a file and write to disk in chunks (not in memory).
+    Get a summary of the entries in the coverage cache.
 
     Parameters
     ----------
-    url : :obj:`str`
-        URL to download from.
-    output_file : :obj:`str`
-        Path to file as output.
-    chunk_size : :obj:`int`
-        Size in bytes of chunk to write to disk at a time.
-    """
-    if url.startswith("ftp://"):
-        import shutil
-        import urllib.request as request
-        from contextlib import closing
+    cache_dir : :obj:`str`
+        Directory of the coverage cache.
 
-        with closing(request.urlopen(url)) as r:
-            with open(output_file, "wb") as f:
-                shutil.copyfileobj(r, f)
-    else:
-        import requests
+        Default is the value of "preferences:coverage_cache:location" in the
+        configuration or "~/.ngs_toolkit/coverage_cache".
 
-        response = requests.get(url, stream=True)
-        with open(output_file, "wb") as outfile:
-            outfile.writelines(response.iter_content(chunk_size=chunk_size))
+    Returns
+    -------
+    :class:`pandas.DataFrame`
+        Dataframe indexed by entry key, with the BAM file path, BAM file fingerprint,
+        hash of the site set, number of sites, counting parameters,
+        size in bytes, and times of creation and last access of each entry.
+    """
+    import glob
+    import json
+
+    cache_dir = _get_coverage_cache_dir(cache_dir)
+    columns = [
+        "bam", "bam_fingerprint", "site_hash", "n_sites",
+        "parameters", "size", "created", "last_access"]
+    entries = dict()
+    for metadata_file in glob.glob(os.path.join(cache_dir, "*.json")):
+        key = os.path.basename(metadata_file)[: -len(".json")]
+        array_file = os.path.join(cache_dir, key + ".npy")
+        try:
+            metadata = json.load(open(metadata_file, "r"))
+            metadata["size"] = os.path.getsize(array_file) + os.path.getsize(metadata_file)
+        except (IOError, ValueError):
+            continue
+        entries[key] = metadata
+    entries = pd.DataFrame.from_dict(entries, orient="index", columns=columns)
+    entries.index.name = "key"
+    return entries
 
 
-def download_gzip_file(url, output_file, decompress=True, **kwargs):
+def invalidate_coverage_cache(bam=None, intervals=None, cache_dir=None):
     """
-    Download a gzip compressed file and write uncompressed
-    file to disk in chunks (not in memory).
+    Remove entries from the coverage cache.
 
     Parameters
     ----------
-    url : :obj:`str`
-        URL to download from.
-    output_file : :obj:`str`
-        Path to file as output.
-    **kwargs : :obj:`dict`
-        Additional keyword arguments are passed to :meth:`ngs_toolkit.utils.download_file`.
-    """
-    if not output_file.endswith(".gz"):
-        output_file += ".gz"
-    download_file(url, output_file, **kwargs)
-    if not decompress:
-        return
-    decompress_file(output_file)
-    if os.path.exists(output_file) and os.path.exists(output_file.replace(".gz", "")):
-        os.remove(output_file)
+    bam : :obj:`str`
+        Remove only entries of this BAM file.
 
+        Default is :obj:`None`.
 
-def deseq_results_to_bed_file(
-    deseq_result_file,
-    bed_file,
-    sort=True,
-    ascending=False,
-    normalize=False,
-    significant_only=False,
-    alpha=0.05,
-    abs_fold_change=1.0,
-):
-    """
-    Write BED file with fold changes from DESeq2 as score value.
-    """
-    from ngs_toolkit import _LOGGER
-    from sklearn.preprocessing import MinMaxScaler
+    intervals : :obj:`list`
+        Remove only entries of this set of intervals.
 
-    df = pd.read_csv(deseq_result_file, index_col=0)
+        Default is :obj:`None`.
 
-    msg = "DESeq2 results do not have a 'log2FoldChange' column."
-    if not ("log2FoldChange" in df.columns.tolist()):
-        _LOGGER.error(msg)
-        raise AssertionError(msg)
+    cache_dir : :obj:`str`
+        Directory of the coverage cache.
 
-    if sort is True:
-        df = df.sort_values("log2FoldChange", ascending=ascending)
+        Default is the value of "preferences:coverage_cache:location" in the
+        configuration or "~/.ngs_toolkit/coverage_cache".
 
-    if significant_only is True:
-        df = df.loc[(df["padj"] < alpha) & (df["log2FoldChange"].abs() > abs_fold_change), :]
+    Returns
+    -------
+    :obj:`int`
+        Number of removed entries.
+    """
+    cache_dir = _get_coverage_cache_dir(cache_dir)
+    entries = inspect_coverage_cache(cache_dir=cache_dir)
+    if bam is not None:
+        entries = entries.loc[entries["bam"] == os.path.abspath(bam)]
+    if intervals is not None:
+        entries = entries.loc[entries["site_hash"] == get_site_set_hash(intervals)]
+    for key in entries.index:
+        _remove_coverage_cache_entry(cache_dir, key)
+    return entries.shape[0]
+
+
+def _get_reference_cache_dir(cache_dir=None):
+    """
+    Get the directory of the reference cache from the configuration.
+    """
+    from ngs_toolkit import _CONFIG, JOBLIB_CACHE_DIR
 
-    # decompose index string (chrom:start-end) into columns
-    df["chrom"] = map(lambda x: x[0], df.index.str.split(":"))
-    r = pd.Series(map(lambda x: x[1], df.index.str.split(":")))
-    df["start"] = map(lambda x: x[0], r.str.split("-"))
-    df["end"] = map(lambda x: x[1], r.str.split("-"))
-    df["name"] = df.index
-    if normalize:
-        MinMaxScaler(feature_range=(0, 1000)).fit_transform(df["log2FoldChange"])
-    df["score"] = df["log2FoldChange"]
+    if cache_dir is None:
+        try:
+            cache_dir = _CONFIG["preferences"]["reference_cache"]["location"]
+        except KeyError:
+            cache_dir = None
+    if cache_dir is None:
+        cache_dir = os.path.join(JOBLIB_CACHE_DIR, "reference_cache")
+    return os.path.abspath(os.path.expanduser(cache_dir))
+
+
+def _get_reference_cache_manifest(fasta, cache_dir):
+    """
+    Get the path of the file listing the checksums of the sequences of ``fasta``
+    in the reference cache, keyed on the path, size and modification time of ``fasta``.
+    """
+    import hashlib
 
-    df[["chrom", "start", "end", "name", "score"]].to_csv(
-        bed_file, sep="\t", header=False, index=False
-    )
+    fasta = os.path.abspath(fasta)
+    stat = os.stat(fasta)
+    key = hashlib.sha1(
+        "{}\t{}\t{}".format(fasta, stat.st_size, stat.st_mtime_ns).encode()
+    ).hexdigest()
+    return os.path.join(cache_dir, "manifests", key + ".json")
 
 
-def homer_peaks_to_bed(homer_peaks, output_bed):
+def _get_reference_cache_md5s(fasta, cache_dir):
     """
-    Convert HOMER peak calls to BED format.
-    The fifth column (score) is the -log10(p-value) of the peak.
+    Get the checksums of the sequences of ``fasta`` if all are in the reference cache,
+    otherwise :obj:`None`.
+    """
+    import json
+
+    manifest = _get_reference_cache_manifest(fasta, cache_dir)
+    if not os.path.exists(manifest):
+        return None
+    with open(manifest, "r") as handle:
+        md5s = json.load(handle)["md5"]
+    if not all(os.path.exists(os.path.join(cache_dir, m[:2], m[2:4], m[4:])) for m in md5s):
+        return None
+    return md5s
+
+
+def setup_reference_cache(fasta, cache_dir=None):
+    """
+    Set up a local cache of reference sequences for decoding CRAM files.
+
+    Each sequence of ``fasta`` is stored in the cache under its MD5 checksum,
+    the layout htslib uses to look up the reference of CRAM files.
+    The checksums are recorded in a manifest keyed on the path, size and
+    modification time of ``fasta``, so that the file is only read again if it changes.
+    Worker processes counting reads in CRAM files with ``fasta`` as ``reference``
+    have the ``REF_PATH`` and ``REF_CACHE`` environment variables pointed to the cache
+    when they start, so they share it
+    instead of each decoding the reference FASTA file.
 
     Parameters
     ----------
-    homer_peaks : :obj:`str`
-        HOMER output with peak calls.
-    output_bed : :obj:`str`
-        Output BED file.
+    fasta : :obj:`str`
+        Path to reference genome FASTA file.
+
+    cache_dir : :obj:`str`
+        Directory of the reference cache.
+
+        Default is the value of "preferences:reference_cache:location" in the
+        configuration or "~/.ngs_toolkit/reference_cache".
+
+    Returns
+    -------
+    :obj:`str`
+        Directory of the reference cache.
     """
-    df = pd.read_csv(homer_peaks, sep="\t", comment="#", header=None)
-    df["-log_pvalue"] = (-np.log10(df.iloc[:, -2])).replace(pd.np.inf, 1000)
-    df["name"] = df[1] + ":" + df[2].astype(str) + "-" + df[3].astype(str)
+    import hashlib
+    import pysam
 
-    (
-        df[[1, 2, 3, "name", "-log_pvalue"]]
-        .sort_values([1, 2, 3], ascending=True)
-        .to_csv(output_bed, header=False, index=False, sep="\t")
-    )
+    cache_dir = _get_reference_cache_dir(cache_dir)
+    if _get_reference_cache_md5s(fasta, cache_dir) is not None:
+        return cache_dir
+
+    md5s = list()
+    for record in pysam.FastxFile(fasta):
+        sequence = record.sequence.upper().encode()
+        md5 = hashlib.md5(sequence).hexdigest()
+        md5s.append(md5)
+        file = os.path.join(cache_dir, md5[:2], md5[2:4], md5[4:])
+        if os.path.exists(file):
+            continue
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp_file = file + ".{}.tmp".format(os.getpid())
+        with open(tmp_file, "wb") as handle:
+            handle.write(sequence)
+        os.replace(tmp_file, file)
 
+    manifest = _get_reference_cache_manifest(fasta, cache_dir)
+    os.makedirs(os.path.dirname(manifest), exist_ok=True)
+    _write_json_atomically({"fasta": os.path.abspath(fasta), "md5": md5s}, manifest)
+    return cache_dir
 
-def macs2_call_chipseq_peak(signal_samples, control_samples, output_dir, name, distributed=True):
+
+def _set_reference_cache_environment(cache_dir=None):
     """
-    Call ChIP-seq peaks with MACS2 in a slurm job.
+    Point the ``REF_PATH`` and ``REF_CACHE`` environment variables to the reference
+    cache in ``cache_dir``.
+    Used once as initializer of each worker process, leaving the environment
+    of the calling process untouched.
+    """
+    if cache_dir is None:
+        return
+    pattern = os.path.join(cache_dir, "%2s", "%2s", "%s")
+    os.environ["REF_PATH"] = pattern
+    os.environ["REF_CACHE"] = pattern
 
-    Parameters
-    ----------
-    signal_samples : :obj:`list`
-        Signal Sample objects.
 
-    control_samples : :obj:`list`
-        Background Sample objects.
+def _get_reference_cache_pool(reference=None, processes=None):
+    """
+    Get a pool of ``processes`` worker processes which decode CRAM files with the
+    reference cache if it was set up for ``reference``
+    with :func:`~ngs_toolkit.utils.setup_reference_cache`.
+    """
+    import multiprocessing
 
-    output_dir : :obj:`list`
-        Parent directory where MACS2 outputs will be stored.
+    cache_dir = None
+    if reference is not None:
+        cache_dir = _get_reference_cache_dir()
+        if _get_reference_cache_md5s(reference, cache_dir) is None:
+            cache_dir = None
+    return multiprocessing.Pool(
+        processes, initializer=_set_reference_cache_environment, initargs=(cache_dir,))
 
-    name : :obj:`str`
-        Name of the MACS2 comparison being performed.
 
-    distributed: :obj:`bool`
-        Whether to submit a SLURM job or to return a string with the runnable.
+def _open_alignment_file(bam, reference=None):
     """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    Open a BAM or CRAM file with pysam.
 
-    runnable = """macs2 callpeak -t {0} -c {1} -n {2} --outdir {3}""".format(
-        " ".join([s.aligned_filtered_bam for s in signal_samples]),
-        " ".join([s.aligned_filtered_bam for s in control_samples]),
-        name,
-        output_dir,
-    )
+    CRAM files are decoded with the reference cache set up by
+    :func:`~ngs_toolkit.utils.setup_reference_cache` if it holds all
+    sequences of the file, otherwise with ``reference``.
+    """
+    import pysam
 
-    if distributed:
-        job_name = "macs2_{}".format(name)
-        job_file = os.path.join(output_dir, name + ".macs2.sh")
-        submit_job(runnable, job_file, cores=4, jobname=job_name)
-    else:
-        return runnable
+    if not str(bam).endswith(".cram"):
+        return pysam.AlignmentFile(bam, mode="rb")
 
+    handle = pysam.AlignmentFile(bam, mode="rc")
+    pattern = os.environ.get("REF_CACHE")
+    if pattern is not None:
+        md5s = [sq.get("M5") for sq in handle.header.to_dict().get("SQ", [])]
+        if all(
+            m is not None and os.path.exists(pattern.replace("%2s", m[:2], 1).replace(
+                "%2s", m[2:4], 1).replace("%s", m[4:]))
+            for m in md5s
+        ):
+            return handle
+    if reference is None:
+        return handle
+    handle.close()
+    return pysam.AlignmentFile(bam, mode="rc", reference_filename=reference)
 
-def homer_call_chipseq_peak_job(
-    signal_samples, control_samples, output_dir, name, distributed=True
-):
+
+_COVERAGE_ARRAY_MAGIC = b"NGSTKCOV"
+_COVERAGE_ARRAY_HEADER = "<8sIQ40s4x"
+
+
+def write_coverage_array(counts, intervals, output_file):
     """
-    Call ChIP-seq peaks with MACS2 in a slurm job.
+    Write read counts in genomic intervals to a binary file.
+
+    The file has a fixed-size header with the number of intervals
+    and a hash of the intervals (see :func:`~ngs_toolkit.utils.get_site_set_hash`),
+    followed by the counts as unsigned 32-bit integers in the order of ``intervals``.
 
     Parameters
     ----------
-    signal_samples : :obj:`list`
-        Signal Sample objects.
-
-    control_samples : :obj:`list`
-        Background Sample objects.
+    counts : :class:`numpy.ndarray`
+        Read counts in the order of ``intervals``.
 
-    output_dir : :obj:`list`
-        Parent directory where MACS2 outputs will be stored.
+    intervals : :obj:`list`
+        List of strings with genomic coordinates in format
+        ``"chrom:start-end"``.
 
-    name : :obj:`str`
-        Name of the MACS2 comparison being performed.
+    output_file : :obj:`str`
+        Path to output file.
     """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    import struct
 
-    # make tag directory for the signal and background samples separately
-    signal_tag_directory = os.path.join(output_dir, "homer_tag_dir_" + name + "_signal")
-    fs = " ".join([s.aligned_filtered_bam for s in signal_samples])
-    runnable = """makeTagDirectory {0} {1}\n""".format(signal_tag_directory, fs)
-    background_tag_directory = os.path.join(output_dir, "homer_tag_dir_" + name + "_background")
-    fs = " ".join([s.aligned_filtered_bam for s in control_samples])
-    runnable += """makeTagDirectory {0} {1}\n""".format(background_tag_directory, fs)
+    from ngs_toolkit import _LOGGER
 
-    # call peaks
-    output_file = os.path.join(output_dir, name, name + "_homer_peaks.factor.narrowPeak")
-    runnable += """findPeaks {signal} -style factor -o {output_file} -i {background}\n""".format(
-        output_file=output_file, background=background_tag_directory, signal=signal_tag_directory,
-    )
-    output_file = os.path.join(output_dir, name, name + "_homer_peaks.histone.narrowPeak")
-    runnable += """findPeaks {signal} -style histone -o {output_file} -i {background}""".format(
-        output_file=output_file, background=background_tag_directory, signal=signal_tag_directory,
+    counts = np.asarray(counts, dtype=np.uint32)
+    if counts.shape != (len(intervals),):
+        msg = "Length of `counts` and `intervals` does not match."
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+    header = struct.pack(
+        _COVERAGE_ARRAY_HEADER,
+        _COVERAGE_ARRAY_MAGIC,
+        1,
+        len(intervals),
+        get_site_set_hash(intervals).encode(),
     )
-
-    if distributed:
-        job_name = "homer_findPeaks_{}".format(name)
-        job_file = os.path.join(output_dir, name + ".homer.sh")
-        submit_job(runnable, job_file, cores=4, jobname=job_name)
-    else:
-        return runnable
+    with open(output_file, "wb") as handle:
+        handle.write(header)
+        handle.write(counts.astype("<u4").tobytes())
 
 
-def bed_to_fasta(input_bed, output_fasta, genome_file):
+def read_coverage_array(input_file, intervals=None, site_hash=None, mmap=True):
     """
-    Retrieves DNA sequence underlying specific region.
-    Names of FASTA entries will be of form ``chr:start-end``.
+    Read read counts in genomic intervals from a binary file
+    written with :func:`~ngs_toolkit.utils.write_coverage_array`.
 
     Parameters
     ----------
-    input_bed : :obj:`str`
-        Path to input BED file.
+    input_file : :obj:`str`
+        Path to input file.
 
-    output_fasta : :obj:`str`
-        Path to resulting FASTA file.
+    intervals : :obj:`list`
+        List of strings with genomic coordinates in format ``"chrom:start-end"``
+        which the file must have been written with.
 
-    genome_file : :obj:`str`
-        Path to genome file in either 2bit or FASTA format.
-        Will be guessed based on file ending.
+        Default is not to check the intervals.
+
+    site_hash : :obj:`str`
+        Hash of the intervals which the file must have been written with.
+        Faster than passing ``intervals`` when reading several files.
+
+        Default is not to check the hash of the intervals.
+
+    mmap : :obj:`bool`
+        Whether to memory-map the counts instead of reading them into memory.
+
+        Default is :obj:`True`.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Read counts in the order of the intervals.
 
     Raises
-    ----------
-    ValueError
-        If `genome_file` format cannot be guessed or is not supported.
+    -------
+    :obj:`ValueError`
+        If the file is not a valid coverage file or
+        it was not written with the given intervals.
     """
+    import struct
 
-    if genome_file.endswith(".2bit"):
-        bed_to_fasta_through_2bit(input_bed, output_fasta, genome_file)
-    elif genome_file.endswith(".fa") or genome_file.endswith(".fasta"):
-        bed_to_fasta_through_fasta(input_bed, output_fasta, genome_file)
-    else:
-        msg = "Format of `genome_file` must be one of FASTA or 2bit, "
-        msg += "with file ending in either '.fa', '.fasta' or '.2bit'"
+    from ngs_toolkit import _LOGGER
+
+    size = struct.calcsize(_COVERAGE_ARRAY_HEADER)
+    with open(input_file, "rb") as handle:
+        header = handle.read(size)
+    if len(header) != size:
+        msg = "File '{}' is not a valid coverage file.".format(input_file)
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+    magic, _, n_sites, file_hash = struct.unpack(_COVERAGE_ARRAY_HEADER, header)
+    if magic != _COVERAGE_ARRAY_MAGIC or (
+        os.path.getsize(input_file) != size + n_sites * np.dtype(np.uint32).itemsize
+    ):
+        msg = "File '{}' is not a valid coverage file.".format(input_file)
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+    if intervals is not None:
+        site_hash = get_site_set_hash(intervals)
+    if site_hash is not None and file_hash.decode() != site_hash:
+        msg = "Coverage file '{}' was not produced with the requested sites.".format(input_file)
+        _LOGGER.error(msg)
         raise ValueError(msg)
+    if mmap:
+        return np.memmap(input_file, dtype="<u4", mode="r", offset=size, shape=(n_sites,))
+    return np.fromfile(input_file, dtype="<u4", offset=size, count=n_sites)
 
 
-def read_bed_file_three_columns(input_bed: str) -> pd.DataFrame:
-    """Read BED file into dataframe, make 'name' field from location."""
-    bed = pd.read_csv(
-        input_bed, sep="\t", header=None, usecols=[0, 1, 2], names=["chrom", "start", "end"]
-    )
-    bed["name"] = bed_to_index(bed)
-    return bed
+def _parse_interval_strings(intervals, zero_based=False):
+    """
+    Parse strings of the form ``"chrom:start-end"`` into a dataframe with
+    "chrom", "start" and "end" columns in the same way as
+    :meth:`pysam.AlignmentFile.count` interprets a ``region`` string
+    (i.e. "start" is one-based, and is converted here to a zero-based
+    half-open interval), or as zero-based half-open intervals
+    (as in BED files) if ``zero_based``.
+    Strings which cannot be parsed or are not valid regions will have
+    a ``False`` value in the "valid" column.
+    """
+    coords = pd.Series(intervals, dtype=object).astype(str).str.extract(r"^(.+):(\d+)-(\d+)$")
+    coords.columns = ["chrom", "start", "end"]
+    valid = ~coords.isnull().any(axis=1)
+    coords["start"] = pd.to_numeric(coords["start"]).fillna(0).astype(np.int64) - int(
+        not zero_based)
+    coords["end"] = pd.to_numeric(coords["end"]).fillna(0).astype(np.int64)
+    coords["valid"] = valid & (coords["start"] >= 0) & (coords["start"] <= coords["end"])
+    return coords
 
 
-def bed_to_fasta_through_2bit(input_bed, output_fasta, genome_2bit):
+def _get_read_coordinates(bam, chrom, read_filters=None, count_mode="reads"):
     """
-    Retrieves DNA sequence underlying specific region.
-    Requires the `twoBitToFa` command from UCSC kent tools.
-    Names of FASTA entries will be of form "chr:start-end".
+    Get start and end positions of all reads in a chromosome of an
+    open :class:`pysam.AlignmentFile`, with the same definition of read end
+    used by htslib to query reads overlapping a region.
+    Reads not passing ``read_filters`` are excluded with a vectorized mask,
+    and positions are converted to fragments or cut sites depending on ``count_mode``.
+    """
+    starts = list()
+    ends = list()
+    flags = list()
+    mapqs = list()
+    tlens = list()
+    for read in bam.fetch(chrom):
+        start = read.reference_start
+        end = read.reference_end
+        if end is None or read.is_unmapped:
+            end = start + 1
+        starts.append(start)
+        ends.append(end)
+        if read_filters or count_mode != "reads":
+            flags.append(read.flag)
+            mapqs.append(read.mapping_quality)
+            tlens.append(read.template_length)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    flags = np.asarray(flags, dtype=np.int64)
+    tlens = np.asarray(tlens, dtype=np.int64)
+    if read_filters:
+        mask = _get_read_filter_mask(
+            flags, np.asarray(mapqs, dtype=np.int64), tlens, read_filters)
+        starts, ends, flags, tlens = starts[mask], ends[mask], flags[mask], tlens[mask]
+    if count_mode == "fragments":
+        # one fragment per pair, from the leftmost mate
+        mask = tlens >= 0
+        starts, ends, tlens = starts[mask], ends[mask], tlens[mask]
+        ends = np.where(tlens > 0, starts + tlens, ends)
+    elif count_mode == "cutsites":
+        # Tn5 insertion sites: +4 bp in forward and -5 bp in reverse strand reads
+        starts = np.where(flags & 16, ends - 5, starts + 4)
+        ends = starts + 1
+    return starts, ends
+
+
+_COUNT_MODES = ["reads", "fragments", "cutsites"]
+
+
+def _check_count_mode(count_mode):
+    """
+    Check that ``count_mode`` is one of the available options.
+    """
+    from ngs_toolkit import _LOGGER
 
-    Parameters
-    ----------
-    input_bed : :obj:`str`
-        Path to input BED file.
+    if count_mode not in _COUNT_MODES:
+        msg = "`count_mode` must be one of '{}'.".format("', '".join(_COUNT_MODES))
+        _LOGGER.error(msg)
+        raise ValueError(msg)
 
-    output_fasta : :obj:`str`
-        Path to resulting FASTA file.
 
-    genome_2bit : :obj:`str`
-        Path to genome 2bit file.
-    """
-    import subprocess
+_READ_FILTERS = ["min_mapq", "include_flags", "exclude_flags", "skip_duplicates", "fragment_length"]
 
-    tmp_bed = input_bed + ".tmp.bed"
-    bed = read_bed_file_three_columns(input_bed)
-    bed.to_csv(tmp_bed, sep="\t", header=None, index=False)
 
-    cmd = "twoBitToFa {0} -bed={1} {2}".format(genome_2bit, tmp_bed, output_fasta)
-    subprocess.call(cmd.split(" "))
-    os.remove(tmp_bed)
+def _check_read_filters(read_filters):
+    """
+    Check that ``read_filters`` only has known keys and return it as a dict.
+    """
+    from ngs_toolkit import _LOGGER
 
+    if read_filters is None:
+        return dict()
+    unknown = [k for k in read_filters if k not in _READ_FILTERS]
+    if unknown:
+        msg = "Unknown read filters: '{}'. Available are: '{}'.".format(
+            "', '".join(unknown), "', '".join(_READ_FILTERS))
+        _LOGGER.error(msg)
+        raise ValueError(msg)
+    return dict(read_filters)
 
-def bed_to_fasta_through_fasta(input_bed, output_fasta, genome_fasta):
+
+def _get_read_filter_mask(flags, mapqs, tlens, read_filters):
     """
-    Retrieves DNA sequence underlying specific region.
-    Uses ``bedtools getfasta`` (internally through pybedtools.BedTool.sequence).
-    Names of FASTA entries will be of form "chr:start-end".
+    Get a boolean mask of reads passing ``read_filters`` given arrays of
+    their SAM flags, mapping qualities and template lengths.
+    """
+    mask = np.ones(flags.shape, dtype=bool)
+    if read_filters.get("min_mapq") is not None:
+        mask &= mapqs >= read_filters["min_mapq"]
+    if read_filters.get("include_flags"):
+        mask &= (flags & read_filters["include_flags"]) == read_filters["include_flags"]
+    exclude = read_filters.get("exclude_flags") or 0
+    if read_filters.get("skip_duplicates"):
+        exclude |= 1024
+    if exclude:
+        mask &= (flags & exclude) == 0
+    if read_filters.get("fragment_length") is not None:
+        min_length, max_length = read_filters["fragment_length"]
+        lengths = np.abs(tlens)
+        mask &= (lengths > 0) & (lengths >= min_length) & (lengths <= max_length)
+    return mask
+
+
+def _get_read_filter_callback(read_filters):
+    """
+    Get a function of a :class:`pysam.AlignedSegment` returning whether it passes
+    ``read_filters``, used as ``read_callback`` of :meth:`pysam.AlignmentFile.count`.
+    As it is called once per read, it only does integer comparisons
+    (see :func:`~ngs_toolkit.utils._get_read_filter_mask` for arrays of reads).
+    """
+    min_mapq = read_filters.get("min_mapq")
+    include = read_filters.get("include_flags") or 0
+    exclude = read_filters.get("exclude_flags") or 0
+    if read_filters.get("skip_duplicates"):
+        exclude |= 1024
+    min_length, max_length = read_filters.get("fragment_length") or (None, None)
+
+    def callback(read):
+        flag = read.flag
+        if (flag & include) != include or (flag & exclude):
+            return False
+        if min_mapq is not None and read.mapping_quality < min_mapq:
+            return False
+        if min_length is not None:
+            length = abs(read.template_length)
+            if length == 0 or length < min_length or length > max_length:
+                return False
+        return True
 
-    Parameters
-    ----------
-    input_bed : :obj:`str`
-        Path to input BED file.
+    return callback
 
-    output_fasta : :obj:`str`
-        Path to resulting FASTA file.
 
-    genome_fasta : :obj:`str`
-        Path to genome FASTA file.
+def _count_features_in_any(starts, ends, query_starts, query_ends):
     """
-    import pybedtools
+    Count features overlapping at least one query interval.
 
-    bed = read_bed_file_three_columns(input_bed)
-    bed = pybedtools.BedTool.from_dataframe(bed)
-    bed.sequence(fi=genome_fasta, fo=output_fasta, name=True)
+    Features and queries are given as arrays of start and end positions
+    (zero-based, half-open).
+    Queries are sorted by start so that the queries starting before a feature's end
+    are a prefix of them, and the feature overlaps one of them if the maximum
+    end in that prefix is after the feature's start.
+    """
+    keep = query_ends > query_starts
+    order = np.argsort(query_starts[keep], kind="stable")
+    query_starts = query_starts[keep][order]
+    query_ends = np.maximum.accumulate(query_ends[keep][order]) if order.size else query_ends[:0]
+    k = np.searchsorted(query_starts, ends, side="left")
+    overlap = k > 0
+    overlap[overlap] = query_ends[k[overlap] - 1] > starts[overlap]
+    return int(overlap.sum())
 
 
-def count_reads_in_intervals(bam, intervals, permissive=True):
+def _count_sorted_overlaps(starts, ends, query_starts, query_ends):
     """
-    Count total number of reads in a iterable holding strings
-    representing genomic intervals of the form ``"chrom:start-end"``.
-
-    Please make sure both ``intervals`` and ``bam`` file are
-    zero- or one-indexed.
+    Count features overlapping each query interval with a sweep over sorted features.
+
+    Features are given as two independently sorted arrays of
+    start and end positions (zero-based, half-open).
+    A feature overlaps a query if ``start < query_end`` and ``end > query_start``.
+    As all features ending before a query also start before its end, the count
+    is the number of features starting before the query end minus the number
+    of features ending before the query start.
+    Empty queries have no overlaps.
+    """
+    counts = np.searchsorted(starts, query_ends, side="left") - np.searchsorted(
+        ends, query_starts, side="right"
+    )
+    counts[query_ends <= query_starts] = 0
+    return counts
 
-    Parameters
-    ----------
-    bam : :obj:`str`
-        Path to BAM file.
 
-    intervals : :obj:`list`
-        List of strings with genomic coordinates in format
-        ``"chrom:start-end"``.
+def _count_reads_in_intervals_sweep(
+    bam,
+    intervals,
+    permissive=True,
+    as_array=False,
+    read_filters=None,
+    count_mode="reads",
+    reference=None,
+):
+    """
+    Count reads in genomic intervals streaming each chromosome of a BAM file once.
 
-    Returns
-    -------
-    :obj:`dict`
-        Dict of read counts for each interval.
+    See :func:`~ngs_toolkit.utils.count_reads_in_intervals` for details.
+    """
+    intervals = list(intervals)
+    counts, valid = _count_reads_in_interval_sets_sweep(
+        bam, {"intervals": intervals}, permissive=permissive,
+        read_filters=read_filters, count_mode=count_mode, reference=reference)
+    counts = counts["intervals"]
+    valid = valid["intervals"]
+
+    if as_array:
+        return counts
+    return dict(zip(
+        [intervals[i] for i in np.flatnonzero(valid)], counts[valid].tolist()))
+
+
+def _count_reads_in_interval_sets_sweep(
+    bam,
+    interval_sets,
+    permissive=True,
+    stats=None,
+    read_filters=None,
+    count_mode="reads",
+    reference=None,
+):
+    """
+    Count reads in several sets of genomic intervals
+    streaming each chromosome of a BAM file once.
+
+    Returns two dicts keyed by the name of each set, one with arrays of
+    counts in the order of the intervals and another with boolean arrays
+    of whether each interval could be quantified.
+    If a dict is passed as ``stats``, it is filled with the total number of
+    reads in all chromosomes ("total") and the number of those reads overlapping
+    any interval of each set (keyed by set name).
+    Reads not passing ``read_filters`` are ignored and
+    reads are counted as fragments or cut sites depending on ``count_mode``.
     """
-    import pysam
     from ngs_toolkit import _LOGGER
 
+    bam = _open_alignment_file(bam, reference=reference)
     counts = dict()
-
-    bam = pysam.AlignmentFile(bam, mode="rb")
-
+    valid = dict()
+    groups = dict()
     errors: int = 0
-    for interval in intervals:
-        try:
-            counts[interval] = bam.count(region=interval)
-        except ValueError:
-            if permissive:
-                errors += 1
-            else:
-                raise
-            # if fix_off_by_one:
-            #     i = interval.split(":")[1]
-            #     s = (
-            #         interval.split(":")[0] +
-            #         ":" + str(int(i.split("-")[0]) + 1) +
-            #         "-" + str(int(i.split("-")[1]) + 1))
-            #     counts[interval] = bam.count(region=s)
+    for name, intervals in interval_sets.items():
+        intervals = list(intervals)
+        coords = _parse_interval_strings(intervals)
+        valid[name] = (coords["valid"] & coords["chrom"].isin(bam.references)).values
+        errors += int((~valid[name]).sum())
+        if errors > 0 and not permissive:
+            bam.close()
+            msg = "Could not quantify intervals: '{}'.".format(
+                "', '".join([str(intervals[i]) for i in np.flatnonzero(~valid[name])[:10]]))
+            raise ValueError(msg)
+        counts[name] = np.zeros(len(intervals), dtype=np.uint32)
+        groups[name] = dict(list(coords.loc[valid[name]].groupby("chrom", sort=False)))
+
+    # read each chromosome once for all sets
+    chroms = list(dict.fromkeys([c for g in groups.values() for c in g]))
+    if stats is not None:
+        # the total is the sum of the same reads the sets are counted from,
+        # so all chromosomes are needed
+        stats["total"] = 0
+        stats.update({name: 0 for name in interval_sets})
+        chroms += [c for c in bam.references if c not in chroms]
+    for chrom in chroms:
+        read_starts, read_ends = _get_read_coordinates(
+            bam, chrom, read_filters=read_filters, count_mode=count_mode)
+        if stats is not None:
+            stats["total"] += read_starts.shape[0]
+        starts, ends = np.sort(read_starts), np.sort(read_ends)
+        for name, group in groups.items():
+            if chrom not in group:
+                continue
+            chrom_coords = group[chrom]
+            counts[name][chrom_coords.index] = _count_sorted_overlaps(
+                starts, ends, chrom_coords["start"].values, chrom_coords["end"].values)
+            if stats is not None:
+                stats[name] += _count_features_in_any(
+                    read_starts, read_ends,
+                    chrom_coords["start"].values, chrom_coords["end"].values)
     bam.close()
     if errors > 0:
         _LOGGER.warning("There have been %i errors. Beware.", errors)
 
-    return counts
+    return counts, valid
 
 
 def normalize_quantiles_r(array):